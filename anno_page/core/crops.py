@@ -0,0 +1,143 @@
+import cv2
+import base64
+import weakref
+import threading
+import numpy as np
+
+from anno_page.core.dedup import perceptual_hash
+
+DEFAULT_JPEG_QUALITY = 95
+
+
+class RegionCropStore:
+    # Crops of the page regions with their resized and encoded variants, each one is created on the first request and
+    # shared by all engines and outputs of the page. Engines of a page may run concurrently, the lazy caches are
+    # filled under a lock.
+    def __init__(self, image):
+        self.image = image
+        self.lock = threading.RLock()
+        self.crops = {}
+        self.resized_crops = {}
+        self.jpeg_crops = {}
+        self.base64_crops = {}
+        self.device_images = {}
+        self.perceptual_hashes = {}
+
+        self.proxy_image = None
+        self.proxy_scale = 1.0
+
+    def crop(self, region):
+        with self.lock:
+            if region.id not in self.crops:
+                x_min, y_min, x_max, y_max = region.get_polygon_bounding_box()
+                self.crops[region.id] = self.image[y_min:y_max, x_min:x_max]
+
+            return self.crops[region.id]
+
+    def resized(self, region, max_size=None):
+        # max_size is either the maximal side or the exact (width, height) of the result
+        if max_size is None:
+            return self.crop(region)
+
+        key = (region.id, max_size)
+        with self.lock:
+            if key not in self.resized_crops:
+                if isinstance(max_size, tuple):
+                    self.resized_crops[key] = resize_to_size(self.crop(region), max_size)
+                else:
+                    self.resized_crops[key] = resize_to_max_size(self.crop(region), max_size)
+
+            return self.resized_crops[key]
+
+    def jpeg(self, region, max_size=None, quality=DEFAULT_JPEG_QUALITY) -> bytes:
+        key = (region.id, max_size, quality)
+        with self.lock:
+            if key not in self.jpeg_crops:
+                self.jpeg_crops[key] = cv2.imencode('.jpg', self.resized(region, max_size), [int(cv2.IMWRITE_JPEG_QUALITY), quality])[1].tobytes()
+
+            return self.jpeg_crops[key]
+
+    def base64(self, region, max_size=None, quality=DEFAULT_JPEG_QUALITY) -> str:
+        key = (region.id, max_size, quality)
+        with self.lock:
+            if key not in self.base64_crops:
+                self.base64_crops[key] = base64.b64encode(self.jpeg(region, max_size, quality)).decode('utf-8')
+
+            return self.base64_crops[key]
+
+    def perceptual_hash(self, region) -> int:
+        with self.lock:
+            if region.id not in self.perceptual_hashes:
+                self.perceptual_hashes[region.id] = perceptual_hash(self.crop(region))
+
+            return self.perceptual_hashes[region.id]
+
+    def set_proxy(self, proxy_image, proxy_scale):
+        self.proxy_image = proxy_image
+        self.proxy_scale = proxy_scale
+
+    def page_image(self, proxy=False):
+        # Downscaled proxy (if set) for the page-level processing of large images, with its scale to the page
+        if proxy and self.proxy_image is not None:
+            return self.proxy_image, self.proxy_scale
+
+        return self.image, 1.0
+
+    def device_image(self, device, proxy=False):
+        # The page is uploaded to the device once (HWC, uint8, channels as decoded), crops are then only views of it
+        import torch
+
+        with self.lock:
+            if (device, proxy) not in self.device_images:
+                image, _ = self.page_image(proxy)
+                self.device_images[(device, proxy)] = torch.from_numpy(np.ascontiguousarray(image)).to(device)
+
+            return self.device_images[(device, proxy)]
+
+    def device_crop(self, region, device):
+        # Large pages (with a proxy) are not uploaded at the full resolution for their crops, only the crop is
+        import torch
+
+        with self.lock:
+            upload_crop = self.proxy_image is not None and (device, False) not in self.device_images
+
+        if upload_crop:
+            return torch.from_numpy(np.ascontiguousarray(self.crop(region))).to(device)
+
+        x_min, y_min, x_max, y_max = region.get_polygon_bounding_box()
+        return self.device_image(device)[y_min:y_max, x_min:x_max]
+
+
+def resize_to_max_size(image, max_size, interpolation=cv2.INTER_LINEAR):
+    height, width = image.shape[:2]
+
+    if image.size == 0 or (width <= max_size and height <= max_size):
+        return image
+
+    if width > height:
+        return cv2.resize(image, (max_size, round(max_size * height / width)), interpolation=interpolation)
+
+    return cv2.resize(image, (round(max_size * width / height), max_size), interpolation=interpolation)
+
+
+def resize_to_size(image, size, interpolation=cv2.INTER_AREA):
+    height, width = image.shape[:2]
+
+    if image.size == 0 or (width, height) == tuple(size):
+        return image
+
+    return cv2.resize(image, tuple(size), interpolation=interpolation)
+
+
+_page_crop_stores = weakref.WeakKeyDictionary()
+_page_crop_stores_lock = threading.Lock()
+
+
+def get_crop_store(page_layout, image) -> RegionCropStore:
+    with _page_crop_stores_lock:
+        crop_store = _page_crop_stores.get(page_layout, None)
+        if crop_store is None or crop_store.image is not image:
+            crop_store = RegionCropStore(image)
+            _page_crop_stores[page_layout] = crop_store
+
+        return crop_store
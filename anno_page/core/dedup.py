@@ -0,0 +1,140 @@
+import cv2
+import json
+import sqlite3
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def perceptual_hash(image, hash_size=8, highfreq_factor=4) -> int:
+    # DCT hash: the low frequencies of the downscaled grayscale image compared to their median, robust to the scan
+    # resolution, JPEG compression and small shifts of the detected boxes
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    image_size = hash_size * highfreq_factor
+    image = cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    low_frequencies = cv2.dct(image)[:hash_size, :hash_size].flatten()
+    bits = low_frequencies > np.median(low_frequencies[1:])
+
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+
+    return value
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return (first ^ second).bit_count()
+
+
+class BKTree:
+    # Nodes are [hash, values, {distance: child}], a search visits only the children within the distance range
+    def __init__(self):
+        self.root = None
+
+    def add(self, value_hash: int, value):
+        if self.root is None:
+            self.root = [value_hash, [value], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value_hash, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+
+            child = node[2].get(distance, None)
+            if child is None:
+                node[2][distance] = [value_hash, [value], {}]
+                return
+
+            node = child
+
+    def search(self, value_hash: int, max_distance: int) -> list[tuple[int, object]]:
+        results = []
+        nodes = [self.root] if self.root is not None else []
+
+        while nodes:
+            node = nodes.pop()
+            distance = hamming_distance(value_hash, node[0])
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node[1])
+
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+
+        return sorted(results, key=lambda result: result[0])
+
+
+class DuplicateIndex:
+    # Persistent index of the results computed for region crops (captions, embeddings) by the perceptual hash of the
+    # crop. Results are separated by their key (model, prompt, ...), the rows written by other processes are picked up
+    # on the next lookup.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                "result_key TEXT NOT NULL, "
+                                "hash TEXT NOT NULL, "
+                                "source TEXT, "
+                                "value TEXT NOT NULL)")
+        self.connection.commit()
+
+        self.trees = {}
+        self.last_id = 0
+
+    def refresh(self):
+        rows = self.connection.execute("SELECT id, result_key, hash, source, value FROM results WHERE id > ? ORDER BY id",
+                                       (self.last_id,)).fetchall()
+
+        for row_id, result_key, value_hash, source, value in rows:
+            self.trees.setdefault(result_key, BKTree()).add(int(value_hash, 16), (source, value))
+            self.last_id = row_id
+
+    def find(self, result_key, value_hash: int, max_distance: int):
+        # The nearest stored result as (value, source, distance), or None
+        with self.lock:
+            self.refresh()
+
+            tree = self.trees.get(result_key, None)
+            if tree is None:
+                return None
+
+            results = tree.search(value_hash, max_distance)
+            if not results:
+                return None
+
+            distance, (source, value) = results[0]
+            return json.loads(value), source, distance
+
+    def add(self, result_key, value_hash: int, value, source=None):
+        with self.lock:
+            with self.connection:
+                self.connection.execute("INSERT INTO results (result_key, hash, source, value) VALUES (?, ?, ?, ?)",
+                                        (result_key, f"{value_hash:016x}", source, json.dumps(value, ensure_ascii=False)))
+
+    def close(self):
+        self.connection.close()
+
+
+_duplicate_indices = {}
+_duplicate_indices_lock = threading.Lock()
+
+
+def get_duplicate_index(path) -> DuplicateIndex:
+    # Engines of the page parser configured with the same index share it
+    with _duplicate_indices_lock:
+        if path not in _duplicate_indices:
+            _duplicate_indices[path] = DuplicateIndex(path)
+
+        return _duplicate_indices[path]
@@ -1,5 +1,5 @@
 from typing import Optional, List, Iterator, Any
-from pydantic import BaseModel, RootModel
+from pydantic import BaseModel, RootModel, model_serializer
 
 from anno_page import globals
 
@@ -11,6 +11,15 @@ class ProcessingInfo(BaseModel):
     model: str
     decimal_places: Optional[int]
     precision: str
+    deduplicated_from: Optional[str] = None
+
+    @model_serializer(mode="wrap")
+    def serialize(self, handler):
+        # Only the records of the reused embeddings have the source of the embedding
+        data = handler(self)
+        if self.deduplicated_from is None:
+            data.pop("deduplicated_from", None)
+        return data
 
 
 class ObjectEmbedding(BaseModel):
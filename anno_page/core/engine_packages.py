@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import logging
+
+from anno_page.core.manifest import hash_file
+
+logger = logging.getLogger(__name__)
+
+ENGINE_HASHES_FILE = ".anno_page_engine_hashes.json"
+
+
+class EngineVerificationError(Exception):
+    pass
+
+
+def list_engine_files(engine_dir) -> list[str]:
+    files = []
+    for root, _, file_names in os.walk(engine_dir, followlinks=True):
+        for file_name in file_names:
+            relative_path = os.path.relpath(os.path.join(root, file_name), engine_dir)
+            if relative_path != ENGINE_HASHES_FILE:
+                files.append(relative_path)
+
+    return sorted(files)
+
+
+def verify_engine_dir(engine_dir) -> dict:
+    # Content hashes of the engine files are recorded on the first use of the engine, later uses hash again only the
+    # files with a changed size or modification time and fail if their content differs (corrupted or partially
+    # replaced engine). The recorded hashes are rewritten with the new modification times.
+    hashes_path = os.path.join(engine_dir, ENGINE_HASHES_FILE)
+
+    recorded = None
+    if os.path.isfile(hashes_path):
+        with open(hashes_path, 'r', encoding='utf-8') as file:
+            recorded = json.load(file)
+
+    files = {}
+    changed = recorded is None
+    for relative_path in list_engine_files(engine_dir):
+        stat = os.stat(os.path.join(engine_dir, relative_path))
+        recorded_file = recorded.get(relative_path, None) if recorded is not None else None
+
+        if recorded_file is not None and recorded_file["size"] == stat.st_size and recorded_file["mtime"] == stat.st_mtime:
+            files[relative_path] = recorded_file
+            continue
+
+        file_hash = hash_file(os.path.join(engine_dir, relative_path))
+        if recorded is not None:
+            if recorded_file is None:
+                raise EngineVerificationError(f"Unexpected file '{relative_path}' in engine '{engine_dir}'.")
+
+            if recorded_file["sha256"] != file_hash:
+                raise EngineVerificationError(f"Content of '{relative_path}' in engine '{engine_dir}' does not match its recorded hash.")
+
+        files[relative_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_hash}
+        changed = True
+
+    if recorded is not None:
+        missing_files = set(recorded.keys()) - set(files.keys())
+        if missing_files:
+            raise EngineVerificationError(f"Missing file(s) in engine '{engine_dir}': {', '.join(sorted(missing_files))}.")
+
+    if changed:
+        with open(hashes_path, 'w', encoding='utf-8') as file:
+            json.dump(files, file, indent=4)
+
+    return files
+
+
+def link_or_copy(source_path, target_path):
+    try:
+        os.symlink(os.path.abspath(source_path), target_path, target_is_directory=os.path.isdir(source_path))
+    except OSError:
+        if os.path.isdir(source_path):
+            shutil.copytree(source_path, target_path)
+        else:
+            shutil.copy2(source_path, target_path)
+
+
+def create_engine_overlay(engine_dir, overlay_dir, overridden_files):
+    # Job-specific view of the engine, the overridden files (relative to the engine directory, e.g. the config and the
+    # prompt settings) are copied, so that they can be rewritten, all the other files and directories (models,
+    # weights) are linked. The directories leading to the overridden files are created, not linked.
+    overridden_files = {os.path.normpath(path) for path in overridden_files}
+    os.makedirs(overlay_dir, exist_ok=True)
+
+    for entry in sorted(os.listdir(engine_dir)):
+        if entry == ENGINE_HASHES_FILE:
+            continue
+
+        source_path = os.path.join(engine_dir, entry)
+        target_path = os.path.join(overlay_dir, entry)
+
+        if entry in overridden_files:
+            shutil.copy2(source_path, target_path)
+            continue
+
+        nested_files = [os.path.relpath(path, entry) for path in overridden_files if path.startswith(entry + os.sep)]
+        if nested_files and os.path.isdir(source_path):
+            create_engine_overlay(source_path, target_path, nested_files)
+            continue
+
+        link_or_copy(source_path, target_path)
+
+    return overlay_dir
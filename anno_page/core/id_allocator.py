@@ -0,0 +1,97 @@
+import weakref
+import threading
+
+from contextlib import contextmanager
+
+
+class IdAllocator:
+    def __init__(self, existing_ids=None):
+        self.used_ids = set(existing_ids) if existing_ids is not None else set()
+        self.next_indices = {}
+
+    def reserve(self, existing_id):
+        if existing_id is not None:
+            self.used_ids.add(existing_id)
+
+    def update(self, existing_ids):
+        for existing_id in existing_ids:
+            self.reserve(existing_id)
+
+    def update_from_element(self, element):
+        self.update(child.attrib["ID"] for child in element.iter() if "ID" in child.attrib)
+
+    def update_from_page_layout(self, page_layout):
+        for region in page_layout.regions:
+            self.reserve(region.id)
+
+            graphical_metadata = getattr(region, "graphical_metadata", None)
+            if graphical_metadata is not None:
+                self.reserve(graphical_metadata.mods_id)
+
+    def next_id(self, prefix="", padding=4):
+        key = (prefix, padding)
+        index = self.next_indices.get(key, 1)
+
+        new_id = f"{prefix}{str(index).zfill(padding)}"
+        while new_id in self.used_ids:
+            index += 1
+            new_id = f"{prefix}{str(index).zfill(padding)}"
+
+        self.used_ids.add(new_id)
+        self.next_indices[key] = index + 1
+
+        return new_id
+
+    @classmethod
+    def from_element(cls, element):
+        allocator = cls()
+        allocator.update_from_element(element)
+        return allocator
+
+    @classmethod
+    def from_page_layout(cls, page_layout):
+        allocator = cls()
+        allocator.update_from_page_layout(page_layout)
+        return allocator
+
+
+_page_allocators = weakref.WeakKeyDictionary()
+
+
+def get_id_allocator(page_layout) -> IdAllocator:
+    allocator = _page_allocators.get(page_layout, None)
+    if allocator is None:
+        allocator = IdAllocator.from_page_layout(page_layout)
+        _page_allocators[page_layout] = allocator
+
+    return allocator
+
+
+# ALTO elements (lxml) do not support weak references, their allocators are kept only for one export in the current
+# thread (see element_id_allocators)
+_element_allocators_scope = threading.local()
+
+
+@contextmanager
+def element_id_allocators():
+    # The allocators of the elements are dropped when the export ends, also when it fails
+    previous_allocators = getattr(_element_allocators_scope, "allocators", None)
+    _element_allocators_scope.allocators = {}
+    try:
+        yield
+    finally:
+        _element_allocators_scope.allocators = previous_allocators
+
+
+def get_element_id_allocator(element) -> IdAllocator:
+    allocators = getattr(_element_allocators_scope, "allocators", None)
+    if allocators is None:
+        # Outside of an export scope the IDs are collected from the element on every call
+        return IdAllocator.from_element(element)
+
+    allocator = allocators.get(element, None)
+    if allocator is None:
+        allocator = IdAllocator.from_element(element)
+        allocators[element] = allocator
+
+    return allocator
@@ -0,0 +1,143 @@
+import math
+
+from abc import ABC, abstractmethod
+
+from anno_page.core.crops import DEFAULT_JPEG_QUALITY
+
+
+class ImageTokenModel(ABC):
+    # How a provider bills an image of the given size in prompt tokens; unit is the size of the tile or patch the image
+    # is split into, the crops are resized to its multiples so that no tile is paid for only partially filled
+    unit = 1
+
+    @abstractmethod
+    def provider_size(self, width, height) -> tuple[int, int]:
+        pass
+
+    @abstractmethod
+    def tokens(self, width, height) -> int:
+        pass
+
+
+class TileTokenModel(ImageTokenModel):
+    # The image is scaled to fit into max_size x max_size and its shorter side to short_side by the provider, then each
+    # started tile costs tile_tokens on top of base_tokens (OpenAI GPT-4o style high detail images)
+    def __init__(self, tile_size=512, base_tokens=85, tile_tokens=170, max_size=2048, short_side=768):
+        self.unit = tile_size
+        self.base_tokens = base_tokens
+        self.tile_tokens = tile_tokens
+        self.max_size = max_size
+        self.short_side = short_side
+
+    def provider_size(self, width, height):
+        scale = min(1.0, self.max_size / max(width, height))
+        if self.short_side is not None and min(width, height) * scale > self.short_side:
+            scale = self.short_side / min(width, height)
+
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def tokens(self, width, height):
+        width, height = self.provider_size(width, height)
+        return self.base_tokens + self.tile_tokens * math.ceil(width / self.unit) * math.ceil(height / self.unit)
+
+
+class PatchTokenModel(ImageTokenModel):
+    # The image is split into patch_size patches, images with more than max_patches patches are downscaled by the
+    # provider, each patch costs token_multiplier tokens (OpenAI GPT-4.1-mini style, Qwen-VL with 28 px patches)
+    def __init__(self, patch_size=32, max_patches=1536, token_multiplier=1.0):
+        self.unit = patch_size
+        self.max_patches = max_patches
+        self.token_multiplier = token_multiplier
+
+    def patches(self, width, height):
+        return math.ceil(width / self.unit) * math.ceil(height / self.unit)
+
+    def provider_size(self, width, height):
+        if self.max_patches is None or self.patches(width, height) <= self.max_patches:
+            return width, height
+
+        long_side = max(width, height)
+        long_side_patches = math.floor(long_side * math.sqrt(self.max_patches * self.unit ** 2 / (width * height)) / self.unit)
+        while True:
+            scale = long_side_patches * self.unit / long_side
+            size = max(1, round(width * scale)), max(1, round(height * scale))
+            if self.patches(*size) <= self.max_patches or long_side_patches <= 1:
+                return size
+
+            long_side_patches -= 1
+
+    def tokens(self, width, height):
+        return math.ceil(self.patches(*self.provider_size(width, height)) * self.token_multiplier)
+
+
+def create_token_model(settings: dict) -> ImageTokenModel:
+    settings = dict(settings)
+    model_type = settings.pop("type", "tiles")
+
+    if model_type == "tiles":
+        return TileTokenModel(**settings)
+    elif model_type == "patches":
+        return PatchTokenModel(**settings)
+
+    raise ValueError(f"Unknown image token model type '{model_type}', expected 'tiles' or 'patches'.")
+
+
+def fit_to_token_budget(token_model: ImageTokenModel, width, height, max_tokens=None) -> tuple[int, int, int]:
+    # The largest downscale of the image (never an upscale) within the budget; the candidate sizes put one of the sides
+    # exactly on a tile boundary, the pixels the provider would discard by its own resize are never sent
+    width, height = token_model.provider_size(width, height)
+    tokens = token_model.tokens(width, height)
+    if max_tokens is None or tokens <= max_tokens:
+        return width, height, tokens
+
+    scales = set()
+    for side in (width, height):
+        for count in range(1, math.ceil(side / token_model.unit)):
+            scales.add(count * token_model.unit / side)
+
+    candidate = None
+    for scale in sorted(scales, reverse=True):
+        candidate_width, candidate_height = max(1, round(width * scale)), max(1, round(height * scale))
+        candidate = candidate_width, candidate_height, token_model.tokens(candidate_width, candidate_height)
+        if candidate[2] <= max_tokens:
+            return candidate
+
+    # Budget below the cost of a single tile, the smallest candidate is used
+    return candidate if candidate is not None else (width, height, tokens)
+
+
+class ResolutionPolicy:
+    # Image size and JPEG quality of the crops sent to a VLM, with per category token budgets. Settings:
+    # {"token_model": {"type": "patches", ...}, "max_tokens": ..., "jpeg_quality": ...,
+    #  "categories": {"initial": {"max_tokens": ..., "jpeg_quality": ...}, ...},
+    #  "models": {"<model>": {<the same keys, override the ones above for the model>}}}
+    def __init__(self, token_model: ImageTokenModel, default: dict, categories: dict[str, dict], max_image_size=None):
+        self.token_model = token_model
+        self.default = default
+        self.categories = categories
+        self.max_image_size = max_image_size
+
+    @classmethod
+    def from_settings(cls, settings: dict, model_name=None, max_image_size=None):
+        settings = dict(settings)
+        model_settings = settings.pop("models", {}).get(model_name, {})
+
+        categories = {category.lower(): value for category, value in settings.get("categories", {}).items()}
+        for category, value in model_settings.get("categories", {}).items():
+            categories[category.lower()] = {**categories.get(category.lower(), {}), **value}
+
+        settings.update({key: value for key, value in model_settings.items() if key != "categories"})
+
+        default = {key: settings[key] for key in ("max_tokens", "jpeg_quality") if key in settings}
+        return cls(create_token_model(settings.get("token_model", {})), default, categories, max_image_size)
+
+    def select(self, category, width, height) -> tuple[tuple[int, int], int, int]:
+        # ((width, height), JPEG quality, predicted image tokens)
+        settings = {**self.default, **self.categories.get(category.lower() if category else None, {})}
+
+        if self.max_image_size is not None and max(width, height) > self.max_image_size:
+            scale = self.max_image_size / max(width, height)
+            width, height = max(1, round(width * scale)), max(1, round(height * scale))
+
+        width, height, tokens = fit_to_token_budget(self.token_model, width, height, settings.get("max_tokens", None))
+        return (width, height), settings.get("jpeg_quality", DEFAULT_JPEG_QUALITY), tokens
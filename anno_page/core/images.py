@@ -0,0 +1,211 @@
+import io
+import os
+import cv2
+import hashlib
+import tempfile
+import threading
+import weakref
+import tifffile
+import numpy as np
+
+from typing import Optional
+from contextlib import contextmanager
+from PIL import Image, ExifTags
+
+from anno_page.core.crops import resize_to_size
+
+# Rows of the full resolution image processed at once when it is converted or downscaled from the cache file
+STRIP_ROWS = 1024
+
+_max_image_pixels_lock = threading.Lock()
+
+
+@contextmanager
+def open_image(source):
+    # PIL's decompression bomb check would reject the large scans, it is disabled only for opening the image (the check
+    # is done on its header)
+    with _max_image_pixels_lock:
+        max_image_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            image = Image.open(source)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+    with image:
+        yield image
+
+
+def get_image_size(path) -> tuple[int, int]:
+    # Only the header is read, (height, width) as in numpy shapes
+    with open_image(path) as image:
+        width, height = image.size
+
+    return height, width
+
+
+def get_cache_file_name(path) -> str:
+    # Images of the same name from different directories or archives have cache files of their own
+    path_hash = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return f"{os.path.splitext(os.path.basename(path))[0]}-{path_hash}.npy"
+
+
+def get_proxy_size(image_size, proxy_max_size) -> tuple[int, int]:
+    # (height, width) of the proxy, as resize_to_max_size would produce it
+    height, width = image_size
+
+    if width <= proxy_max_size and height <= proxy_max_size:
+        return height, width
+
+    if width > height:
+        return round(proxy_max_size * height / width), proxy_max_size
+
+    return proxy_max_size, round(proxy_max_size * width / height)
+
+
+def remove_file(path):
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+class LargeImage:
+    # Full resolution page kept in a memory-mapped raw file (pages of it are read from the disk only when a crop needs
+    # them) and a downscaled proxy for the page-level work (detection, renders).
+    def __init__(self, image, proxy, proxy_scale, cache_file=None, remove_cache_file=False):
+        self.image = image
+        self.proxy = proxy
+        self.proxy_scale = proxy_scale
+        self.cache_file = cache_file
+        self.remove_cache_file = remove_cache_file
+
+        # Crops and device uploads of the page may still hold views of the mapped image, a temporary cache file is
+        # removed only after the last of them is freed
+        self.cache_file_finalizer = None
+        if remove_cache_file and cache_file is not None:
+            self.cache_file_finalizer = weakref.finalize(image, remove_file, cache_file)
+
+    def close(self):
+        self.image = None
+
+
+def decode_tiff_to_cache(source, cache_file, page_size) -> Optional[np.memmap]:
+    # Strips (or tiles) of 8-bit RGB TIFF scans are decoded straight into the cache file, the full image is never held
+    # in memory. Other layouts and compressions without a decoder (most need imagecodecs) are left to OpenCV.
+    with tifffile.TiffFile(source) as tiff:
+        page = tiff.pages[0]
+        orientation = page.tags.get("Orientation")
+
+        if page.dtype != np.uint8 or len(page.shape) != 3 or page.shape[2] != 3 \
+                or (page_size is not None and page.shape[:2] != tuple(page_size)) \
+                or page.photometric != tifffile.PHOTOMETRIC.RGB or page.planarconfig != tifffile.PLANARCONFIG.CONTIG \
+                or (orientation is not None and orientation.value != 1) \
+                or page.compression not in tifffile.TIFF.DECOMPRESSORS:
+            return None
+
+        cached_image = np.lib.format.open_memmap(cache_file, mode='w+', dtype=np.uint8, shape=page.shape)
+        page.asarray(out=cached_image)
+
+    # The channels are in the OpenCV order (BGR) as in the rest of the processing
+    for start in range(0, cached_image.shape[0], STRIP_ROWS):
+        strip = cached_image[start:start + STRIP_ROWS]
+        strip[:] = strip[..., ::-1]
+
+    return cached_image
+
+
+def decode_to_cache(path, cache_file, page_size, data=None):
+    with open_image(io.BytesIO(data) if data is not None else path) as image:
+        image_format = image.format
+
+    cached_image = None
+    if image_format == "TIFF":
+        cached_image = decode_tiff_to_cache(io.BytesIO(data) if data is not None else path, cache_file, page_size)
+
+    if cached_image is None:
+        # The decoded image is held in memory only until it is written to the cache
+        if data is not None:
+            decoded_image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), 1)
+        else:
+            decoded_image = cv2.imread(path, 1)
+
+        if decoded_image is None:
+            raise Exception(f'Unable to read image "{path}"')
+
+        if page_size is not None and tuple(decoded_image.shape[:2]) != tuple(page_size):
+            decoded_image = cv2.resize(decoded_image, (page_size[1], page_size[0]))
+
+        cached_image = np.lib.format.open_memmap(cache_file, mode='w+', dtype=decoded_image.dtype, shape=decoded_image.shape)
+        cached_image[:] = decoded_image
+        del decoded_image
+
+    cached_image.flush()
+    del cached_image
+
+
+def decode_reduced_proxy(path, proxy_size, data=None) -> Optional[np.ndarray]:
+    # JPEG scans are decoded at 1/2, 1/4 or 1/8 of their resolution (DCT scaling), no smaller than the proxy, the full
+    # resolution image is not read for the proxy at all. Rotated scans (EXIF orientation) are left to the cached image.
+    with open_image(io.BytesIO(data) if data is not None else path) as image:
+        if image.format != "JPEG" or image.getexif().get(ExifTags.Base.Orientation, 1) != 1:
+            return None
+
+        image.draft("RGB", (proxy_size[1], proxy_size[0]))
+        reduced_image = image.convert("RGB")
+
+    reduced_image = np.ascontiguousarray(np.asarray(reduced_image)[..., ::-1])
+    return resize_to_size(reduced_image, (proxy_size[1], proxy_size[0]), interpolation=cv2.INTER_AREA)
+
+
+def downscale_in_strips(image, proxy_size) -> np.ndarray:
+    # The mapped image is downscaled strip by strip, only one strip of it is in memory at a time
+    proxy_height, proxy_width = proxy_size
+    if tuple(image.shape[:2]) == tuple(proxy_size):
+        return np.array(image)
+
+    scale = image.shape[0] / proxy_height
+    proxy_strip_rows = max(1, int(STRIP_ROWS / scale))
+
+    proxy = np.empty((proxy_height, proxy_width) + image.shape[2:], dtype=image.dtype)
+    for proxy_start in range(0, proxy_height, proxy_strip_rows):
+        proxy_end = min(proxy_start + proxy_strip_rows, proxy_height)
+        strip = image[round(proxy_start * scale):round(proxy_end * scale)]
+        proxy[proxy_start:proxy_end] = cv2.resize(np.asarray(strip), (proxy_width, proxy_end - proxy_start),
+                                                  interpolation=cv2.INTER_AREA).reshape(proxy[proxy_start:proxy_end].shape)
+
+    return proxy
+
+
+def load_large_image(path, page_size=None, proxy_max_size=4096, cache_path=None, data=None) -> LargeImage:
+    # The encoded image is given in `data` when it is not a file on the disk (archive members), `path` then only names
+    # the cache file
+    remove_cache_file = cache_path is None
+    if cache_path is None:
+        file_descriptor, cache_file = tempfile.mkstemp(suffix=".npy")
+        os.close(file_descriptor)
+    else:
+        cache_file = os.path.join(cache_path, get_cache_file_name(path))
+
+    image = None
+    if not remove_cache_file and os.path.isfile(cache_file) and os.path.isfile(path) and os.path.getmtime(cache_file) >= os.path.getmtime(path):
+        image = np.load(cache_file, mmap_mode='r')
+        if page_size is not None and tuple(image.shape[:2]) != tuple(page_size):
+            image = None
+
+    if image is None:
+        try:
+            decode_to_cache(path, cache_file, page_size, data=data)
+        except Exception:
+            if remove_cache_file:
+                remove_file(cache_file)
+            raise
+
+        image = np.load(cache_file, mmap_mode='r')
+
+    proxy_size = get_proxy_size(image.shape[:2], proxy_max_size)
+    proxy = decode_reduced_proxy(path, proxy_size, data=data)
+    if proxy is None:
+        proxy = downscale_in_strips(image, proxy_size)
+
+    proxy_scale = proxy.shape[1] / image.shape[1]
+
+    return LargeImage(image, proxy, proxy_scale, cache_file, remove_cache_file)
@@ -0,0 +1,230 @@
+import os
+import json
+import logging
+import tarfile
+import threading
+import zipfile
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class InputSource(ABC):
+    # Files are addressed by their base names (as the loose files in a directory), the order of names() is the order
+    # in which the files are read most efficiently.
+    def __init__(self, path):
+        self.path = path
+
+    @abstractmethod
+    def names(self) -> list[str]:
+        pass
+
+    @abstractmethod
+    def exists(self, name) -> bool:
+        pass
+
+    @abstractmethod
+    def read(self, name) -> bytes:
+        pass
+
+    def local_path(self, name) -> str | None:
+        return None
+
+    def index(self):
+        # Picklable index of the files which is expensive to build, passed to the worker processes by the parent
+        return None
+
+    def close(self):
+        pass
+
+
+class DirectorySource(InputSource):
+    def names(self) -> list[str]:
+        return sorted(file for file in os.listdir(self.path) if os.path.isfile(os.path.join(self.path, file)))
+
+    def exists(self, name) -> bool:
+        return os.path.isfile(os.path.join(self.path, name))
+
+    def read(self, name) -> bytes:
+        with open(os.path.join(self.path, name), 'rb') as file:
+            return file.read()
+
+    def local_path(self, name) -> str | None:
+        return os.path.join(self.path, name)
+
+
+class MemberSource(InputSource):
+    # Archive members and manifest entries in nested directories are known by their base names, the first one wins.
+    # Reads of the archives are serialized, the read-ahead thread and the XML reads may share one source.
+    def __init__(self, path):
+        super().__init__(path)
+        self.members = {}
+        self.lock = threading.Lock()
+
+    def add_member(self, member_path, member):
+        name = os.path.basename(member_path)
+        if not name:
+            return
+
+        if name in self.members:
+            logger.warning(f"Duplicate file name '{name}' in '{self.path}', '{member_path}' is ignored.")
+            return
+
+        self.members[name] = member
+
+    def names(self) -> list[str]:
+        return list(self.members.keys())
+
+    def exists(self, name) -> bool:
+        return name in self.members
+
+
+class ZipSource(MemberSource):
+    def __init__(self, path):
+        super().__init__(path)
+        self.archive = zipfile.ZipFile(path)
+
+        for info in sorted(self.archive.infolist(), key=lambda info: info.header_offset):
+            if not info.is_dir():
+                self.add_member(info.filename, info)
+
+    def read(self, name) -> bytes:
+        with self.lock:
+            return self.archive.read(self.members[name])
+
+    def close(self):
+        self.archive.close()
+
+
+class TarSource(MemberSource):
+    # Listing the members scans the whole (compressed) archive, the workers get the members listed by the parent
+    def __init__(self, path, members=None):
+        super().__init__(path)
+        self.archive = tarfile.open(path, mode="r:*")
+
+        if members is not None:
+            self.members = dict(members)
+        else:
+            for info in self.archive.getmembers():
+                if info.isfile():
+                    self.add_member(info.name, info)
+
+    def read(self, name) -> bytes:
+        with self.lock:
+            with self.archive.extractfile(self.members[name]) as file:
+                return file.read()
+
+    def index(self):
+        return self.members
+
+    def close(self):
+        self.archive.close()
+
+
+class ManifestSource(MemberSource):
+    # JSON Lines file, each line is either a path or an object with the 'path' key, relative paths are relative to
+    # the manifest
+    def __init__(self, path):
+        super().__init__(path)
+
+        manifest_directory = os.path.dirname(os.path.abspath(path))
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                if not line:
+                    continue
+
+                entry = json.loads(line)
+                entry_path = entry if isinstance(entry, str) else entry["path"]
+                self.add_member(entry_path, os.path.join(manifest_directory, entry_path))
+
+    def read(self, name) -> bytes:
+        with open(self.members[name], 'rb') as file:
+            return file.read()
+
+    def local_path(self, name) -> str | None:
+        return self.members[name]
+
+
+def open_input_source(path, index=None) -> InputSource:
+    if os.path.isdir(path):
+        return DirectorySource(path)
+
+    lower_path = path.lower()
+    if lower_path.endswith(".zip"):
+        return ZipSource(path)
+
+    if lower_path.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+        return TarSource(path, members=index)
+
+    if lower_path.endswith((".jsonl", ".jsonlines")):
+        return ManifestSource(path)
+
+    raise ValueError(f"Unsupported input source: '{path}'.")
+
+
+_input_sources = {}
+_input_source_indices = {}
+
+
+def get_input_source(path) -> InputSource:
+    # Sources are opened once per process (archive handles can not be passed to the worker processes)
+    if path not in _input_sources:
+        _input_sources[path] = open_input_source(path, index=_input_source_indices.get(path, None))
+
+    return _input_sources[path]
+
+
+def get_input_source_indices() -> dict:
+    return {path: source.index() for path, source in _input_sources.items() if source.index() is not None}
+
+
+def set_input_source_indices(indices: dict):
+    _input_source_indices.update(indices)
+
+
+def close_input_sources():
+    for source in _input_sources.values():
+        source.close()
+
+    _input_sources.clear()
+
+
+class ReadAheadReader:
+    # Reads the files of the source in the given order on a background thread, up to `depth` files ahead of the
+    # consumer. All reads go through the single thread, the archive handles are not thread-safe.
+    def __init__(self, source: InputSource, names, depth=4):
+        self.source = source
+        self.names = list(names)
+        self.depth = depth
+        self.positions = {name: position for position, name in enumerate(self.names)}
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="read_ahead")
+        self.pending = {}
+
+    def read(self, name) -> bytes:
+        position = self.positions.get(name, None)
+        if position is None:
+            return self.executor.submit(self.source.read, name).result()
+
+        for ahead_position in range(position, min(position + self.depth + 1, len(self.names))):
+            ahead_name = self.names[ahead_position]
+            if ahead_name not in self.pending:
+                self.pending[ahead_name] = self.executor.submit(self.source.read, ahead_name)
+
+        future = self.pending.pop(name)
+
+        # Files skipped by the consumer are not kept
+        for skipped_name in [pending_name for pending_name in self.pending if self.positions[pending_name] < position]:
+            self.pending.pop(skipped_name).cancel()
+
+        return future.result()
+
+    def close(self):
+        for future in self.pending.values():
+            future.cancel()
+
+        self.pending = {}
+        self.executor.shutdown()
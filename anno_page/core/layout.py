@@ -8,24 +8,30 @@ from pero_ocr.core.layout import RegionLayout, PageLayout, create_ocr_processing
 
 from anno_page import globals
 from anno_page.enums import Category
-from anno_page.core.metadata import GraphicalObjectMetadata
-from anno_page.core.utils import find_textline_by_geometry_and_content
-from anno_page.core.utils import find_textline
+from anno_page.core.metadata import GraphicalObjectMetadata, RelatedLinesMetadata
+from anno_page.core.id_allocator import IdAllocator, get_id_allocator, get_element_id_allocator
+from anno_page.core.utils import TextLineIndex
 
 
 class AnnoPageRegionLayout(RegionLayout):
     def to_altoxml(self, print_space_element, tags, mods_namespace, arabic_helper, min_line_confidence,
-                   print_space_coords: Tuple[int, int, int, int], version: ALTOVersion, word_splitters=["-"]) -> Tuple[int, int, int, int]:
+                   print_space_coords: Tuple[int, int, int, int], version: ALTOVersion, word_splitters=["-"],
+                   id_allocator: IdAllocator | None = None) -> Tuple[int, int, int, int]:
         category = Category.from_string(self.category)
         page_element = get_page_element(print_space_element)
         page_id = page_element.attrib["ID"]
 
-        composed_block_id = get_next_id(print_space_element, "ComposedBlock", prefix=f"{page_id}_CB", padding=4)
+        # Regions written by pero-ocr's ALTO export do not get the allocator passed, the allocator seeded from the
+        # print space is kept for the export wrapped in element_id_allocators()
+        if id_allocator is None:
+            id_allocator = get_element_id_allocator(print_space_element)
+
+        composed_block_id = id_allocator.next_id(prefix=f"{page_id}_CB", padding=4)
         composed_block_element = ET.SubElement(print_space_element, "ComposedBlock")
         composed_block_element.set("ID", composed_block_id)
         composed_block_element.set("TYPE", str(category))
 
-        graphical_element_id = get_next_id(print_space_element, "GraphicalElement", prefix=f"{page_id}_GE", padding=4)
+        graphical_element_id = id_allocator.next_id(prefix=f"{page_id}_GE", padding=4)
         graphical_element = ET.SubElement(composed_block_element, "GraphicalElement")
         graphical_element.set("ID", graphical_element_id)
 
@@ -64,20 +70,6 @@ def get_page_element(print_space_element):
     return page_element
 
 
-def get_next_id(parent_element, element_tag, prefix="", padding=4):
-    existing_elements = parent_element.findall(f".//{element_tag}")
-    existing_ids = set([element.attrib["ID"] for element in existing_elements if "ID" in element.attrib])
-    index = 1
-
-    new_id = f"{prefix}{str(index).zfill(padding)}"
-
-    while new_id in existing_ids:
-        index += 1
-        new_id = f"{prefix}{str(index).zfill(padding)}"
-
-    return new_id
-
-
 def set_position_and_size(block, bounding_box):
     x_min, y_min, x_max, y_max = bounding_box
     height = y_max - y_min
@@ -106,11 +98,15 @@ def add_page_layout_to_alto(page_layout: PageLayout, alto_root: Element, alto_ve
 
     print_space_coords = get_print_space_coords(page_layout, print_space_element)
 
+    id_allocator = get_id_allocator(page_layout)
+    id_allocator.update_from_element(alto_root)
+
     for region in page_layout.regions:
         if region.category in (None, "text"):
             continue
 
-        print_space_coords = region.to_altoxml(print_space_element, tags_element, mods_namespace, None, 0.0, print_space_coords, alto_version)
+        print_space_coords = region.to_altoxml(print_space_element, tags_element, mods_namespace, None, 0.0, print_space_coords, alto_version,
+                                               id_allocator=id_allocator)
 
     update_print_space_and_margins(page_layout, page_element, print_space_coords)
 
@@ -119,6 +115,116 @@ def add_page_layout_to_alto(page_layout: PageLayout, alto_root: Element, alto_ve
     return alto_root
 
 
+def load_annopage_regions_from_alto(page_layout: PageLayout, alto_root: Element):
+    # Reverse of add_page_layout_to_alto, the graphical regions with their metadata are restored from an ALTO file
+    # written by AnnoPage and appended to the page layout, text lines are matched to the already loaded ones by ID.
+    tags_element = alto_root.find("{*}Tags")
+    print_space_element = alto_root.find("{*}Layout/{*}Page/{*}PrintSpace")
+    if tags_element is None or print_space_element is None:
+        return []
+
+    layout_tags = {tag.attrib["ID"]: tag for tag in tags_element.findall("{*}LayoutTag")}
+    related_tags = {}
+    for tag in tags_element.findall("{*}StructureTag") + tags_element.findall("{*}OtherTag"):
+        mods = tag.find("{*}XmlData/{*}mods")
+        if tag.attrib.get("LABEL", None) in ("FigureCaption", "RelatedToFigure") and mods is not None:
+            related_tags[mods.attrib.get("ID", None)] = tag
+
+    lines = {}
+    for line in page_layout.lines_iterator():
+        lines[line.id] = line
+        lines[line.id if line.id.startswith("line_") else f"line_{line.id}"] = line
+
+    tagged_lines = {}
+    abbreviated_lines = {}
+    for line_element in print_space_element.iter("{*}TextLine"):
+        line = lines.get(line_element.attrib.get("ID", None), None)
+        if line is None:
+            continue
+
+        for tag_id in line_element.attrib.get("TAGREFS", "").split():
+            tagged_lines.setdefault(tag_id, []).append(line)
+
+        string_element = line_element.find(".//{*}String")
+        if string_element is not None and string_element.attrib.get("SUBS_TYPE", None) == "Abbreviation":
+            abbreviated_lines[line.id] = (line, string_element)
+
+    regions = []
+    for composed_block in print_space_element.iter("{*}ComposedBlock"):
+        tag_id = composed_block.attrib.get("TAGREFS", None)
+        if tag_id not in layout_tags:
+            continue
+
+        layout_tag = layout_tags[tag_id]
+        mods = layout_tag.find("{*}XmlData/{*}mods")
+        if mods is None:
+            continue
+
+        caption_lines_metadata = None
+        reference_lines_metadata = None
+        for related_item in mods.findall("{*}relatedItem"):
+            related_tag = related_tags.get(related_item.attrib.get("IDREF", None), None)
+            if related_tag is None:
+                continue
+
+            related_lines_metadata = RelatedLinesMetadata.from_altoxml(related_tag, tagged_lines.get(related_tag.attrib["ID"], []))
+            if related_item.attrib.get("type", None) == "constituent":
+                caption_lines_metadata = related_lines_metadata
+            elif related_item.attrib.get("type", None) == "references":
+                reference_lines_metadata = related_lines_metadata
+
+        metadata, confidence = GraphicalObjectMetadata.from_altoxml(layout_tag, caption_lines_metadata, reference_lines_metadata)
+
+        for related_lines_metadata in (caption_lines_metadata, reference_lines_metadata):
+            if related_lines_metadata is None:
+                continue
+
+            for line in related_lines_metadata.lines:
+                if line.graphical_metadata is None:
+                    line.graphical_metadata = [related_lines_metadata]
+                else:
+                    line.graphical_metadata.append(related_lines_metadata)
+
+        x_min = int(composed_block.attrib["HPOS"])
+        y_min = int(composed_block.attrib["VPOS"])
+        x_max = x_min + int(composed_block.attrib["WIDTH"])
+        y_max = y_min + int(composed_block.attrib["HEIGHT"])
+        polygon = np.array([[x_min, y_min], [x_min, y_max], [x_max, y_max], [x_max, y_min], [x_min, y_min]])
+
+        region = AnnoPageRegionLayout(tag_id, polygon, category=layout_tag.attrib.get("LABEL", None), detection_confidence=confidence)
+        region.graphical_metadata = metadata
+
+        if metadata.tag_description is not None:
+            for line, string_element in abbreviated_lines.values():
+                subs_content = string_element.attrib.get("SUBS_CONTENT", "")
+                content = string_element.attrib.get("CONTENT", "")
+                if subs_content.startswith(metadata.tag_description) and subs_content.endswith(content):
+                    region.transcription = subs_content[:len(subs_content) - len(content)]
+                    metadata.continuing_line = line
+                    break
+
+        page_layout.regions.append(region)
+        regions.append(region)
+
+    return regions
+
+
+def load_alto_tree(path):
+    parser = ET.XMLParser(remove_blank_text=True)
+    return ET.parse(path, parser)
+
+
+def write_alto_tree(alto_tree, file):
+    # Serialized straight into the file (path or file object); lxml would write the encoding in the declaration
+    # upper-cased, keep it the same as ET.tostring(...) does
+    if isinstance(file, str):
+        with open(file, 'wb') as output_file:
+            return write_alto_tree(alto_tree, output_file)
+
+    file.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+    alto_tree.write(file, pretty_print=True, encoding="utf-8", xml_declaration=False)
+
+
 def get_print_space_coords(page_layout, print_space_element):
     print_space_height = print_space_element.attrib.get("HEIGHT", 0)
     print_space_width = print_space_element.attrib.get("WIDTH", 0)
@@ -180,6 +286,8 @@ def find_or_create_element(parent_element, tag, namespaces=None):
 
 
 def alto_postprocess_lines(page_layout, print_space_element, alto_version=ALTOVersion.ALTO_v4_4):
+    textline_index = TextLineIndex(print_space_element)
+
     for region in page_layout.regions:
         if region.category in (None, "text"):
             continue
@@ -192,7 +300,7 @@ def alto_postprocess_lines(page_layout, print_space_element, alto_version=ALTOVe
                     if not line_id.startswith("line_"):
                         line_id = f"line_{line_id}"
 
-                    line_element = print_space_element.find(f".//TextLine[@ID='{line_id}']")
+                    line_element = textline_index.find_by_id(line_id)
 
                     if line_element is None:
                         continue
@@ -211,7 +319,7 @@ def alto_postprocess_lines(page_layout, print_space_element, alto_version=ALTOVe
                 if not line_id.startswith("line_"):
                     line_id = f"line_{line_id}"
 
-                line_element = print_space_element.find(f".//{{*}}TextLine[@ID='{line_id}']")
+                line_element = textline_index.find_by_id(line_id)
                 if line_element is not None:
                     string_element = line_element.find(".//{*}String")
                     if string_element is not None:
@@ -234,14 +342,15 @@ def set_handlers(page_layout):
     page_layout.to_altoxml_regions_ended += alto_postprocess_lines
 
 
-def render_to_image(image, page_layout):
+def render_to_image(image, page_layout, scale=1.0):
+    # The image may be a downscaled copy of the page, the regions are then scaled to it
     render = np.copy(image)
 
     for region in page_layout.regions:
         if region.category in (None, "text"):
             continue
 
-        x_min, y_min, x_max, y_max = region.get_polygon_bounding_box()
+        x_min, y_min, x_max, y_max = [coordinate * scale for coordinate in region.get_polygon_bounding_box()]
         cv2.rectangle(render, (round(x_min), round(y_min)), (round(x_max), round(y_max)), (0, 255, 0), 2)
 
     return render
@@ -0,0 +1,122 @@
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+
+from anno_page.core.utils import compose_path
+from anno_page.core.services import DateTimeService
+
+logger = logging.getLogger(__name__)
+
+SKIPPED_CONFIG_SECTIONS = ("PAGE_PARSER", "PARSE_FOLDER")
+MAX_HASHED_FILE_SIZE = 1024 * 1024
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+
+def config_section_fingerprint(section, config_path=""):
+    section_hash = hashlib.sha256()
+
+    for key, value in sorted(section.items()):
+        section_hash.update(f"{key}={value}\n".encode("utf-8"))
+
+        # Files referenced from the section (prompt settings, models, ...) are part of the fingerprint, small ones
+        # by content and large ones (model weights) only by their name and size to keep the fingerprinting cheap.
+        referenced_path = compose_path(value, config_path) if value else None
+        if referenced_path is not None and os.path.isfile(referenced_path):
+            file_size = os.path.getsize(referenced_path)
+            if file_size <= MAX_HASHED_FILE_SIZE:
+                section_hash.update(hash_file(referenced_path).encode("utf-8"))
+            else:
+                section_hash.update(f"{os.path.basename(referenced_path)}:{file_size}".encode("utf-8"))
+
+    return section_hash.hexdigest()
+
+
+def config_fingerprints(config, config_path=""):
+    engine_hashes = {}
+    for section_name in config.sections():
+        if section_name in SKIPPED_CONFIG_SECTIONS:
+            continue
+
+        engine_hashes[section_name] = config_section_fingerprint(config[section_name], config_path)
+
+    config_hash = hashlib.sha256(json.dumps(engine_hashes, sort_keys=True).encode("utf-8")).hexdigest()
+
+    return config_hash, engine_hashes
+
+
+class ProcessingManifest:
+    STATE_DONE = "done"
+    STATE_FAILED = "failed"
+
+    def __init__(self, path):
+        self.path = path
+        self.date_time_service = DateTimeService()
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages ("
+                                "file_id TEXT PRIMARY KEY, "
+                                "state TEXT NOT NULL, "
+                                "config_hash TEXT, "
+                                "engine_hashes TEXT, "
+                                "outputs TEXT, "
+                                "processing_time REAL, "
+                                "updated TEXT)")
+        self.connection.commit()
+
+    def get(self, file_id) -> dict | None:
+        row = self.connection.execute("SELECT file_id, state, config_hash, engine_hashes, outputs, processing_time, updated "
+                                      "FROM pages WHERE file_id = ?", (file_id,)).fetchone()
+        if row is None:
+            return None
+
+        return {
+            "file_id": row[0],
+            "state": row[1],
+            "config_hash": row[2],
+            "engine_hashes": json.loads(row[3]) if row[3] else {},
+            "outputs": json.loads(row[4]) if row[4] else {},
+            "processing_time": row[5],
+            "updated": row[6]
+        }
+
+    def get_done_file_ids(self, config_hash) -> set[str]:
+        rows = self.connection.execute("SELECT file_id FROM pages WHERE state = ? AND config_hash = ?",
+                                       (self.STATE_DONE, config_hash))
+        return {row[0] for row in rows}
+
+    def record(self, file_id, state, config_hash, engine_hashes, output_files=None, processing_time=None):
+        # Called only once all artifacts of the page are written and closed, a page without a 'done' record is
+        # processed again regardless of any (possibly partial) outputs on the disk. The outputs may be given with their
+        # hashes already computed (e.g. members of output shards).
+        outputs = dict(output_files) if isinstance(output_files, dict) else {}
+        for output_file in output_files if isinstance(output_files, list) else []:
+            if os.path.isfile(output_file):
+                outputs[output_file] = hash_file(output_file)
+            else:
+                logger.warning(f"Output file '{output_file}' of '{file_id}' does not exist.")
+
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO pages "
+                                    "(file_id, state, config_hash, engine_hashes, outputs, processing_time, updated) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (file_id,
+                                     state,
+                                     config_hash,
+                                     json.dumps(engine_hashes, sort_keys=True),
+                                     json.dumps(outputs, ensure_ascii=False),
+                                     processing_time,
+                                     self.date_time_service().isoformat()))
+
+    def close(self):
+        self.connection.close()
@@ -1,14 +1,15 @@
 import logging
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, TYPE_CHECKING
 from lxml import etree as ET
 
-from pero_ocr.core.layout import TextLine
-
 from anno_page import globals
 from anno_page.enums import Category, Language, LineRelation
 from anno_page.enums.language import language_to_string_mapping, language_to_string_mapping_reversed
 from anno_page.core.services import UuidService, DateTimeService
 
+if TYPE_CHECKING:
+    from pero_ocr.core.layout import TextLine
+
 logger = logging.getLogger(__name__)
 
 
@@ -112,6 +113,57 @@ class BaseMetadata:
     def to_altoxml(self, *args, **kwargs):
         raise NotImplementedError
 
+    @staticmethod
+    def _strip_uuid_prefix(value):
+        if value is None:
+            return None
+
+        value = value.strip()
+        return value[len("uuid:"):] if value.startswith("uuid:") else value
+
+    @staticmethod
+    def _parse_language_values(elements):
+        # Reverse of the `str | Dict[Language, str]` convention used when writing, elements without language
+        # produce a plain value.
+        values = {}
+        for element in elements:
+            language = element.attrib.get("lang", "")
+            if language in language_to_string_mapping_reversed:
+                values[language_to_string_mapping_reversed[language]] = element.text
+            else:
+                values[None] = element.text
+
+        if not values:
+            return None
+
+        if None in values:
+            return values[None]
+
+        return values
+
+    @staticmethod
+    def _parse_mods_common(mods):
+        identifier = mods.find("{*}identifier[@type='uuid']")
+        record_identifier = mods.find("{*}recordInfo/{*}recordIdentifier")
+
+        confidence = None
+        used_ai_models = {}
+        for record_info_note in mods.findall("{*}recordInfo/{*}recordInfoNote"):
+            note_type = record_info_note.attrib.get("type", None)
+            if note_type == "confidence":
+                confidence = float(record_info_note.text)
+            elif note_type is not None:
+                used_ai_models[note_type] = record_info_note.text
+
+        return {
+            "mods_id": mods.attrib.get("ID", None),
+            "mods_uuid": BaseMetadata._strip_uuid_prefix(identifier.text) if identifier is not None else None,
+            "record_identifier": BaseMetadata._strip_uuid_prefix(record_identifier.text) if record_identifier is not None else None,
+            "title": BaseMetadata._parse_language_values(mods.findall("{*}titleInfo/{*}title")),
+            "used_ai_models": used_ai_models,
+            "confidence": confidence
+        }
+
     def to_dict(self) -> dict:
         return {
             "tag_id": self.tag_id,
@@ -124,7 +176,7 @@ class RelatedLinesMetadata(BaseMetadata):
     def __init__(self,
                  tag_id,
                  mods_id,
-                 lines: List[TextLine],
+                 lines: List["TextLine"],
                  relation: LineRelation,
                  description: Optional[str] = None,
                  title: Optional[str | Dict[Language, str]] = None,
@@ -198,6 +250,29 @@ class RelatedLinesMetadata(BaseMetadata):
                                       confidence=confidence,
                                       used_ai_models=self.used_ai_models)
 
+    @classmethod
+    def from_altoxml(cls, tag, lines: List["TextLine"]):
+        label = tag.attrib.get("LABEL", None)
+        if label == "FigureCaption":
+            relation = LineRelation.CAPTION
+        elif label == "RelatedToFigure":
+            relation = LineRelation.REFERENCE
+        else:
+            raise ValueError(f"Unknown related lines label: {label}")
+
+        mods = tag.find("{*}XmlData/{*}mods")
+        values = cls._parse_mods_common(mods)
+
+        return cls(tag_id=tag.attrib["ID"],
+                   mods_id=values["mods_id"],
+                   lines=lines,
+                   relation=relation,
+                   description=tag.attrib.get("DESCRIPTION", None),
+                   title=values["title"],
+                   mods_uuid=values["mods_uuid"],
+                   record_identifier=values["record_identifier"],
+                   used_ai_models=values["used_ai_models"])
+
     def to_dict(self) -> dict:
         result = super().to_dict()
 
@@ -245,7 +320,7 @@ class GraphicalObjectMetadata(BaseMetadata):
                  title: Optional[str | Dict[Language, str]] = None,
                  caption_lines_metadata: Optional[RelatedLinesMetadata] = None,
                  reference_lines_metadata: Optional[RelatedLinesMetadata] = None,
-                 continuing_line: Optional[TextLine] = None,
+                 continuing_line: Optional["TextLine"] = None,
                  prompts: Optional[List[str]] = None,
                  used_ai_models: Optional[Dict[str, str]] = None):
         super().__init__(tag_id, mods_id, mods_uuid, record_identifier, used_ai_models)
@@ -292,6 +367,43 @@ class GraphicalObjectMetadata(BaseMetadata):
             else:
                 self.reference_lines_metadata = other.reference_lines_metadata
 
+    @classmethod
+    def from_altoxml(cls, layout_tag, caption_lines_metadata=None, reference_lines_metadata=None):
+        mods = layout_tag.find("{*}XmlData/{*}mods")
+        values = cls._parse_mods_common(mods)
+
+        title = values["title"]
+        if caption_lines_metadata is not None and title == caption_lines_metadata.title:
+            # The title of the caption lines is written in place of a missing title
+            title = None
+
+        topics = {}
+        for topic in mods.findall("{*}subject/{*}topic"):
+            topics.setdefault(topic.attrib.get("lang", ""), []).append(topic.text)
+
+        if "" in topics:
+            topics = topics[""]
+        else:
+            topics = {language_to_string_mapping_reversed[language]: language_topics
+                      for language, language_topics in topics.items()
+                      if language in language_to_string_mapping_reversed} or None
+
+        metadata = cls(tag_id=layout_tag.attrib["ID"],
+                       mods_id=values["mods_id"],
+                       mods_uuid=values["mods_uuid"],
+                       record_identifier=values["record_identifier"],
+                       tag_description=layout_tag.attrib.get("DESCRIPTION", None),
+                       description=cls._parse_language_values(mods.findall("{*}abstract[@type='description']")),
+                       caption=cls._parse_language_values(mods.findall("{*}abstract[@type='caption']")),
+                       topics=topics,
+                       color=cls._parse_language_values(mods.findall("{*}physicalDescription/{*}form[@type='color']")),
+                       title=title,
+                       caption_lines_metadata=caption_lines_metadata,
+                       reference_lines_metadata=reference_lines_metadata,
+                       used_ai_models=values["used_ai_models"])
+
+        return metadata, values["confidence"]
+
     def to_altoxml(self, tags, mods_namespace, category, bounding_box, confidence):
         self.graphics_to_altoxml(tags, mods_namespace, category, bounding_box, confidence)
 
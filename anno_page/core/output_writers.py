@@ -0,0 +1,238 @@
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import tarfile
+
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+SHARD_EXTENSION = ".tar"
+INDEX_EXTENSION = ".index.jsonl"
+
+
+class OutputWriter(ABC):
+    # Artifacts of a page (ALTO, PAGE XML, embeddings, renders, crops, prompts) are written by their kind and file name,
+    # commit_page() is called once all of them are written.
+    @abstractmethod
+    def write(self, kind, name, data: bytes) -> str:
+        pass
+
+    def write_stream(self, kind, name, write_data) -> tuple[str, str]:
+        # write_data(file) serializes the artifact into a file object, returns the path and the SHA-256 of the data;
+        # writers without a file per artifact get the data buffered
+        buffer = io.BytesIO()
+        write_data(buffer)
+        data = buffer.getvalue()
+        return self.write(kind, name, data), hashlib.sha256(data).hexdigest()
+
+    @abstractmethod
+    def read(self, kind, name) -> bytes | None:
+        pass
+
+    def commit_page(self, file_id):
+        pass
+
+    def discard_page(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class HashingFile:
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.file.write(data)
+
+
+class DirectoryOutputWriter(OutputWriter):
+    def __init__(self, paths: dict[str, str]):
+        self.paths = paths
+
+    def write(self, kind, name, data: bytes) -> str:
+        path = os.path.join(self.paths[kind], name)
+        with open(path, 'wb') as file:
+            file.write(data)
+
+        return path
+
+    def write_stream(self, kind, name, write_data) -> tuple[str, str]:
+        path = os.path.join(self.paths[kind], name)
+        with open(path, 'wb') as file:
+            hashing_file = HashingFile(file)
+            write_data(hashing_file)
+
+        return path, hashing_file.sha256.hexdigest()
+
+    def read(self, kind, name) -> bytes | None:
+        path = os.path.join(self.paths[kind], name)
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, 'rb') as file:
+            return file.read()
+
+
+class ShardedOutputWriter(OutputWriter):
+    # Artifacts are appended to uncompressed TAR shards ('{prefix}-000000.tar', ...) as '{kind}/{name}' members, each
+    # shard has an index ('{prefix}-000000.index.jsonl') with the data offsets of its members. A shard is closed at
+    # a page boundary once it reaches the maximal size or page count, all artifacts of a page are in the same shard.
+    # The index lines of a page are written only after its data is flushed, the indexed pages of an interrupted shard
+    # are still readable.
+    def __init__(self, path, prefix="shard", max_shard_bytes=1024 ** 3, max_shard_pages=None):
+        self.path = path
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self.max_shard_pages = max_shard_pages
+
+        self.shard_path = None
+        self.shard_file = None
+        self.archive = None
+        self.index_file = None
+        self.shard_pages = 0
+        self.page_entries = []
+
+        self.reader = None
+
+    def create_shard_file(self):
+        # The shard file is created exclusively, a number taken by another writer in the meantime is skipped
+        shard_number = 0
+        while True:
+            shard_path = os.path.join(self.path, f"{self.prefix}-{shard_number:06d}{SHARD_EXTENSION}")
+            try:
+                return shard_path, open(shard_path, 'xb')
+            except FileExistsError:
+                shard_number += 1
+
+    def open_shard(self):
+        self.shard_path, self.shard_file = self.create_shard_file()
+        self.archive = tarfile.open(fileobj=self.shard_file, mode='w', format=tarfile.PAX_FORMAT)
+        self.index_file = open(self.shard_path[:-len(SHARD_EXTENSION)] + INDEX_EXTENSION, 'w', encoding='utf-8')
+        self.shard_pages = 0
+
+        logger.info(f"Opened output shard '{self.shard_path}'.")
+
+    def close_shard(self):
+        if self.archive is None:
+            return
+
+        self.archive.close()
+        self.shard_file.close()
+        self.index_file.close()
+
+        logger.info(f"Closed output shard '{self.shard_path}' with {self.shard_pages} page(s).")
+
+        self.shard_path = None
+        self.shard_file = None
+        self.archive = None
+        self.index_file = None
+
+    def write(self, kind, name, data: bytes) -> str:
+        if self.archive is None:
+            self.open_shard()
+
+        member_name = f"{kind}/{name}"
+        info = tarfile.TarInfo(member_name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.archive.addfile(info, io.BytesIO(data))
+
+        # The data blocks are the last ones written, the header before them may span more blocks (long names)
+        data_blocks_size = -(-info.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        self.page_entries.append({
+            "name": member_name,
+            "offset": self.archive.offset - data_blocks_size,
+            "size": info.size
+        })
+
+        return f"{self.shard_path}/{member_name}"
+
+    def commit_page(self, file_id):
+        if self.archive is None:
+            return
+
+        self.shard_file.flush()
+
+        shard_name = os.path.basename(self.shard_path)
+        committed = time.time()
+        for entry in self.page_entries:
+            entry.update({"file_id": file_id, "shard": shard_name, "time": committed})
+            self.index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        self.index_file.flush()
+        self.page_entries = []
+        self.shard_pages += 1
+
+        if self.shard_file.tell() >= self.max_shard_bytes or (self.max_shard_pages is not None and self.shard_pages >= self.max_shard_pages):
+            self.close_shard()
+
+    def discard_page(self):
+        # Artifacts of a failed page are left in the shard, but not indexed
+        self.page_entries = []
+
+    def read(self, kind, name) -> bytes | None:
+        # Previous outputs (incremental processing), the index is loaded once and does not see the new pages
+        if self.reader is None:
+            self.reader = ShardedOutputReader(self.path)
+
+        return self.reader.read(f"{kind}/{name}")
+
+    def close(self):
+        self.discard_page()
+        self.close_shard()
+
+
+class ShardedOutputReader:
+    # Random access to the artifacts of the sharded output through the indices, a member written more times (pages
+    # processed again) is read from its last committed version.
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+
+        if not os.path.isdir(path):
+            return
+
+        for index_name in sorted(os.listdir(path)):
+            if not index_name.endswith(INDEX_EXTENSION):
+                continue
+
+            with open(os.path.join(path, index_name), 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f"Skipping incomplete index line in '{index_name}'.")
+                        continue
+
+                    previous_entry = self.entries.get(entry["name"], None)
+                    if previous_entry is None or previous_entry["time"] <= entry["time"]:
+                        self.entries[entry["name"]] = entry
+
+    def names(self) -> list[str]:
+        return list(self.entries.keys())
+
+    def file_ids(self) -> set[str]:
+        return {entry["file_id"] for entry in self.entries.values()}
+
+    def page_names(self, file_id) -> list[str]:
+        return [name for name, entry in self.entries.items() if entry["file_id"] == file_id]
+
+    def exists(self, name) -> bool:
+        return name in self.entries
+
+    def read(self, name) -> bytes | None:
+        entry = self.entries.get(name, None)
+        if entry is None:
+            return None
+
+        with open(os.path.join(self.path, entry["shard"]), 'rb') as file:
+            file.seek(entry["offset"])
+            return file.read(entry["size"])
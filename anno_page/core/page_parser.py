@@ -1,48 +1,47 @@
 import re
-import torch
 import logging
 
-from anno_page.engines import (LayoutProcessingEngine, YoloDetectionEngine, HuggingfaceImageEmbeddingEngine,
-                               OpenAICompletionsImageCaptioningEngine, CaptionYoloNearestEngine,
-                               CaptionYoloKeypointsEngine, CaptionYoloOrganizerEngine, InitialRecognitionEngine)
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from anno_page.engines.base import LayoutProcessingEngine
+from anno_page.engines.registry import load_engine_class
+from anno_page.enums import LayoutData
 
 
 def operation_factory(config, device, config_path) -> LayoutProcessingEngine | None:
-    engine = None
     logger = logging.getLogger(__name__)
 
     if "METHOD" not in config:
         logger.warning("Config does not contain 'METHOD' key.")
         return None
 
-    if config['METHOD'] == 'YOLO_DETECTION':
-        logger.info("Creating YoloDetection engine")
-        engine = YoloDetectionEngine(config, device, config_path=config_path)
-    elif config['METHOD'] == 'HUGGINGFACE_IMAGE_EMBEDDING':
-        logger.info("Creating HuggingfaceImageEmbedding engine")
-        engine = HuggingfaceImageEmbeddingEngine(config, device, config_path=config_path)
-    elif config['METHOD'] == 'OPENAI_COMPLETIONS_IMAGE_CAPTIONING':
-        logger.info("Creating OpenAICompletionsImageCaptioning engine")
-        engine = OpenAICompletionsImageCaptioningEngine(config, device, config_path=config_path)
-    elif config['METHOD'] == 'CAPTION_YOLO_NEAREST':
-        logger.info("Creating CaptionYoloNearestEngine engine")
-        engine = CaptionYoloNearestEngine(config, device, config_path=config_path)
-    elif config['METHOD'] == 'CAPTION_YOLO_ORGANIZER':
-        logger.info("Creating CaptionYoloOrganizerEngine engine")
-        engine = CaptionYoloOrganizerEngine(config, device, config_path=config_path)
-    elif config['METHOD'] == 'CAPTION_YOLO_KEYPOINTS':
-        logger.info("Creating CaptionYoloKeypointsEngine engine")
-        engine = CaptionYoloKeypointsEngine(config, device, config_path=config_path)
-    elif config["METHOD"] == "INITIAL_RECOGNITION":
-        logger.info("Creating InitialRecognitionEngine engine")
-        engine = InitialRecognitionEngine(config, device, config_path=config_path)
-    else:
+    engine_class = load_engine_class(config["METHOD"])
+    if engine_class is None:
         logger.warning(f"Unknown operation method: {config['METHOD']}")
+        return None
+
+    logger.info(f"Creating {engine_class.__name__} engine")
+    return engine_class(config, device, config_path=config_path)
+
+
+def engines_depend(engine, previous_engine) -> bool:
+    if None in (engine.inputs, engine.outputs, previous_engine.inputs, previous_engine.outputs):
+        return True
+
+    return bool(engine.inputs & previous_engine.outputs or
+                engine.outputs & previous_engine.outputs or
+                engine.outputs & previous_engine.inputs)
+
 
-    return engine
+def build_engine_dependencies(engines) -> list[set[int]]:
+    # The config order is kept between engines working with the same parts of the layout, the others are independent
+    return [{previous_index for previous_index in range(index) if engines_depend(engine, engines[previous_index])}
+            for index, engine in enumerate(engines)]
 
 
 def get_default_device():
+    import torch
+
     return torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
 
 
@@ -55,15 +54,54 @@ class PageParser:
 
         self.device = device if device is not None else get_default_device()
 
+        self.run_engines_concurrently = False
+        self.max_engine_threads = None
+        if "PAGE_PARSER" in config:
+            self.run_engines_concurrently = config["PAGE_PARSER"].getboolean("RUN_ENGINES_CONCURRENTLY", fallback=False)
+            self.max_engine_threads = config["PAGE_PARSER"].getint("MAX_ENGINE_THREADS", fallback=None)
+
         self.engines: list[LayoutProcessingEngine] = self.init_engines(config, config_path, operation_factory)
 
-    def process_page(self, image, page_layout):
-        for engine in self.engines:
+        self.executor = None
+        if self.run_engines_concurrently:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_engine_threads, thread_name_prefix="engine")
+
+    def process_page(self, image, page_layout, engines=None):
+        engines = self.engines if engines is None else engines
+
+        if self.executor is not None and len(engines) > 1:
+            return self.process_page_concurrently(image, page_layout, engines)
+
+        for engine in engines:
             self.logger.debug(f"Running {engine.__class__.__name__} engine")
             page_layout = engine.process_page(image, page_layout)
 
         return page_layout
 
+    def process_page_concurrently(self, image, page_layout, engines):
+        # Engines modify the page layout in place, each one is started as soon as all engines it depends on finish,
+        # e.g. the GPU embedding runs while the captioning engine waits for the LLM API.
+        dependencies = build_engine_dependencies(engines)
+        pending = list(range(len(engines)))
+        finished = set()
+        running = {}
+
+        try:
+            while pending or running:
+                for index in [index for index in pending if dependencies[index] <= finished]:
+                    self.logger.debug(f"Running {engines[index].__class__.__name__} engine")
+                    running[self.executor.submit(engines[index].process_page, image, page_layout)] = index
+                    pending.remove(index)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished.add(running.pop(future))
+                    future.result()
+        finally:
+            wait(running)
+
+        return page_layout
+
     def init_engines(self, config, config_path, engine_factory) -> list:
         engines = []
 
@@ -82,6 +120,34 @@ class PageParser:
 
         return engines
 
+    def get_dependent_engines(self, section_names) -> list[LayoutProcessingEngine]:
+        # Besides the engines of the changed sections, all engines depending on them (directly or not) are run again
+        dependencies = build_engine_dependencies(self.engines)
+
+        rerun = set()
+        for index, engine in enumerate(self.engines):
+            if engine.config.name in section_names or dependencies[index] & rerun:
+                rerun.add(index)
+
+        return [engine for index, engine in enumerate(self.engines) if index in rerun]
+
+    def get_rerun_engines(self, section_names) -> list[LayoutProcessingEngine] | None:
+        # The previous outputs can be reused only if the regions stay, engines detecting them (or not declaring their
+        # outputs) would add new regions next to the loaded ones, the page is then processed from scratch (None)
+        engines = self.get_dependent_engines(section_names)
+        if any(engine.outputs is None or LayoutData.REGIONS in engine.outputs for engine in engines):
+            return None
+
+        return engines
+
+    def close(self):
+        for engine in self.engines:
+            engine.close()
+
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
     @property
     def requires_lines(self):
         return any([engine.requires_lines for engine in self.engines])
@@ -0,0 +1,61 @@
+import os
+import hashlib
+import logging
+import functools
+import threading
+
+from jinja2 import Environment, BaseLoader, FileSystemBytecodeCache, Template, TemplateNotFound
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_CACHE_SIZE = 1024
+
+
+class SourceLoader(BaseLoader):
+    # Templates are named by the hash of their source, the bytecode cache then reuses the compiled code of the same
+    # source across the processes and runs
+    def __init__(self):
+        self.sources = {}
+
+    def get_source(self, environment, template):
+        if template not in self.sources:
+            raise TemplateNotFound(template)
+
+        return self.sources[template], None, lambda: True
+
+
+_environment = None
+_environment_lock = threading.Lock()
+
+
+def get_template_environment() -> Environment:
+    # Shared environment with the default settings of jinja2.Template, the bytecode is cached in the directory from
+    # ANNO_PAGE_TEMPLATE_CACHE_DIR or in the default temporary directory of Jinja
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            try:
+                bytecode_cache = FileSystemBytecodeCache(os.environ.get("ANNO_PAGE_TEMPLATE_CACHE_DIR", None))
+            except (OSError, RuntimeError) as e:
+                logger.warning(f"Template bytecode cache is not available: {e}")
+                bytecode_cache = None
+
+            _environment = Environment(loader=SourceLoader(), bytecode_cache=bytecode_cache, cache_size=0)
+
+        return _environment
+
+
+_template_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def get_template(source: str) -> Template:
+    environment = get_template_environment()
+    name = hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    with _template_lock:
+        environment.loader.sources[name] = source
+        try:
+            return environment.get_template(name)
+        finally:
+            del environment.loader.sources[name]
@@ -32,40 +32,58 @@ def config_get_list(config, key, fallback=None, make_lowercase=False):
     return value
 
 
-def find_textline(print_space_element, line, namespaces):
-    text_line_element = print_space_element.find(f".//TextLine[@ID='{line.id}']", namespaces)
-    if text_line_element is None:
-        text_line_element = find_textline_by_geometry_and_content(print_space_element, line, namespaces)
+class TextLineIndex:
+    def __init__(self, print_space_element):
+        self.print_space_element = print_space_element
 
-    return text_line_element
+        self._by_id = None
+        self._by_geometry_and_content = None
 
+    def find(self, line):
+        text_line_element = self.find_by_id(line.id)
+        if text_line_element is None:
+            text_line_element = self.find_by_geometry_and_content(line)
 
-def find_textline_by_geometry_and_content(print_space_element, line, namespaces):
-    result = None
+        return text_line_element
 
-    textline_elements = print_space_element.findall(".//TextLine", namespaces)
-    for textline_element in textline_elements:
-        vpos = int(textline_element.attrib.get("VPOS", 0))
-        hpos = int(textline_element.attrib.get("HPOS", 0))
-        width = int(textline_element.attrib.get("WIDTH", 0))
-        height = int(textline_element.attrib.get("HEIGHT", 0))
+    def find_by_id(self, line_id):
+        if self._by_id is None:
+            self._by_id = {}
+            for textline_element in self.print_space_element.iter("{*}TextLine"):
+                if "ID" in textline_element.attrib:
+                    self._by_id.setdefault(textline_element.attrib["ID"], textline_element)
 
-        polygon = np.asarray([[hpos, vpos],
-                              [hpos + width, vpos],
-                              [hpos + width, vpos + height],
-                              [hpos, vpos + height]])
+        return self._by_id.get(line_id, None)
 
-        transcription = ""
-        for child in textline_element.getchildren():
-            if child.tag.endswith("String"):
-                transcription += child.attrib.get("CONTENT", "")
-            elif child.tag.endswith("SP"):
-                transcription += " "
+    def find_by_geometry_and_content(self, line):
+        if self._by_geometry_and_content is None:
+            self._by_geometry_and_content = {}
+            for textline_element in self.print_space_element.iter("{*}TextLine"):
+                key = (get_textline_element_polygon_key(textline_element), get_textline_element_transcription(textline_element))
+                self._by_geometry_and_content.setdefault(key, textline_element)
 
-        transcription = transcription.strip()
+        polygon_key = tuple(tuple(point) for point in np.asarray(line.polygon).tolist())
+        return self._by_geometry_and_content.get((polygon_key, line.transcription), None)
 
-        if np.all(polygon == line.polygon) and transcription == line.transcription:
-            result = textline_element
-            break
 
-    return result
+def get_textline_element_polygon_key(textline_element):
+    vpos = int(textline_element.attrib.get("VPOS", 0))
+    hpos = int(textline_element.attrib.get("HPOS", 0))
+    width = int(textline_element.attrib.get("WIDTH", 0))
+    height = int(textline_element.attrib.get("HEIGHT", 0))
+
+    return ((hpos, vpos),
+            (hpos + width, vpos),
+            (hpos + width, vpos + height),
+            (hpos, vpos + height))
+
+
+def get_textline_element_transcription(textline_element):
+    transcription = ""
+    for child in textline_element.getchildren():
+        if child.tag.endswith("String"):
+            transcription += child.attrib.get("CONTENT", "")
+        elif child.tag.endswith("SP"):
+            transcription += " "
+
+    return transcription.strip()
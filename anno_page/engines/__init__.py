@@ -1,7 +1,24 @@
+import importlib
+
 from .base import BaseEngine, LayoutProcessingEngine
-from .captioning import (CaptionYoloNearestEngine, CaptionYoloOrganizerEngine, CaptionYoloKeypointsEngine,
-                         OpenAICompletionsImageCaptioningEngine)
-from .detection import YoloDetectionEngine
-from .embedding import HuggingfaceTextEmbeddingEngine, HuggingfaceImageEmbeddingEngine
-from .translation import TranslationEngine
-from .initial import InitialRecognitionEngine
+
+# The engine modules pull in heavy dependencies (torch, transformers, ultralytics), they are imported only when one
+# of their engines is accessed.
+_lazy_engines = {
+    "CaptionYoloNearestEngine": ".captioning",
+    "CaptionYoloOrganizerEngine": ".captioning",
+    "CaptionYoloKeypointsEngine": ".captioning",
+    "OpenAICompletionsImageCaptioningEngine": ".captioning",
+    "YoloDetectionEngine": ".detection",
+    "HuggingfaceTextEmbeddingEngine": ".embedding",
+    "HuggingfaceImageEmbeddingEngine": ".embedding",
+    "TranslationEngine": ".translation",
+    "InitialRecognitionEngine": ".initial",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_engines:
+        return getattr(importlib.import_module(_lazy_engines[name], __name__), name)
+
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
@@ -1,9 +1,17 @@
 import logging
+import threading
 
 from abc import ABC, abstractmethod
 
+_processing_info_lock = threading.Lock()
+
 
 class BaseEngine(ABC):
+    # Parts of the page layout the engine reads and writes (LayoutData), engines which do not declare them are run
+    # only after all previous engines finish and before any following engine starts.
+    inputs: frozenset | None = None
+    outputs: frozenset | None = None
+
     def __init__(self, config, device, config_path, requires_lines=False):
         self.config = config
         self.device = device
@@ -12,8 +20,18 @@ class BaseEngine(ABC):
 
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    def close(self):
+        pass
+
 
 class LayoutProcessingEngine(BaseEngine):
     @abstractmethod
     def process_page(self, image, page_layout):
         pass
+
+    def record_processing_info(self, page_layout, key, info):
+        # Engines of a page may run concurrently, the processing info they share in the page metadata is updated under
+        # a lock
+        with _processing_info_lock:
+            processing_info = page_layout.metadata.setdefault("anno_page_processing", {})
+            processing_info.setdefault(self.__class__.__name__, {})[key] = info
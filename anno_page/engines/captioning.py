@@ -1,28 +1,32 @@
 import os
-import cv2
 import json
 import torch
-import base64
-import requests
+import hashlib
 import numpy as np
 
 from abc import abstractmethod
 from json import JSONDecodeError
-from jinja2 import Template
 from pydantic import BaseModel, ValidationError
-from multiprocessing import Pool
 from urllib.parse import urljoin
 
 from anno_page.core.utils import compose_path, config_get_list
+from anno_page.core.crops import get_crop_store, DEFAULT_JPEG_QUALITY
+from anno_page.core.dedup import get_duplicate_index, hamming_distance
+from anno_page.core.image_tokens import ResolutionPolicy
+from anno_page.core.templates import get_template
 from anno_page.core.llm_api_aliases import get_llm_api_aliases
 from anno_page.core.metadata import GraphicalObjectMetadata, RelatedLinesMetadata
 from anno_page.engines import BaseEngine, LayoutProcessingEngine
 from anno_page.engines.detection import YoloDetector
-from anno_page.enums import Language, LineRelation
+from anno_page.engines.llm_client import OpenAICompletionsClient, LLMRequestExecutor, CompletionResponse, get_stream_speed
+from anno_page.enums import Language, LineRelation, LayoutData
 from anno_page.engines.helpers import find_nearest_region, find_lines_in_bbox
 
 
 class CaptionYoloNearestEngine(LayoutProcessingEngine):
+    inputs = frozenset({LayoutData.REGIONS, LayoutData.LINES})
+    outputs = frozenset({LayoutData.CAPTION_LINES})
+
     def __init__(self, config, device, config_path):
         super().__init__(config, device, config_path, requires_lines=True)
 
@@ -67,6 +71,9 @@ class CaptionYoloNearestEngine(LayoutProcessingEngine):
 
 
 class CaptionYoloKeypointsEngine(LayoutProcessingEngine):
+    inputs = frozenset({LayoutData.REGIONS, LayoutData.LINES})
+    outputs = frozenset({LayoutData.CAPTION_LINES})
+
     def __init__(self, config, device, config_path):
         super().__init__(config, device, config_path, requires_lines=True)
 
@@ -124,6 +131,9 @@ class CaptionYoloKeypointsEngine(LayoutProcessingEngine):
 
 
 class CaptionYoloOrganizerEngine(LayoutProcessingEngine):
+    inputs = frozenset({LayoutData.REGIONS, LayoutData.LINES})
+    outputs = frozenset({LayoutData.CAPTION_LINES})
+
     def __init__(self, config, device, config_path):
         super().__init__(config, device, config_path, requires_lines=True)
 
@@ -233,9 +243,26 @@ class PromptResult(BaseModel):
     color_en: str|None
 
 
+class RegionPromptResult(PromptResult):
+    region_id: str
+
+
+class PagePromptResult(BaseModel):
+    results: list[RegionPromptResult]
+
+
+PACKED_PROMPT_HEADER = ("The request contains {count} images of regions cropped from a single page, in the order "
+                        "listed below. Describe each image by the instructions given for it and return one result per "
+                        "image in 'results', with the 'region_id' of the image.")
+
+
 class PromptData:
-    def __init__(self, image=None, region=None, metadata=None, prompt=None, usage=None, result=None):
+    def __init__(self, image=None, region=None, metadata=None, prompt=None, usage=None, result=None, image_base64=None,
+                 image_hash=None, predicted_image_tokens=None):
         self.image = image
+        self.image_base64: str | None = image_base64
+        self.image_hash: int | None = image_hash
+        self.predicted_image_tokens: int | None = predicted_image_tokens
         self.region = region
         self.metadata = metadata
         self.prompt = prompt
@@ -254,16 +281,25 @@ class PromptBuilderEngine(BaseEngine):
         super().__init__(config=None, device=None, config_path=None)
 
     @staticmethod
-    def process(prompt: str|dict[str, str], element_category=None, element_caption=None, metadata=None) -> str:
+    def precompile(prompt: str|dict[str, str]):
+        for source in (prompt.values() if type(prompt) == dict else [prompt]):
+            get_template(source)
+
+    @staticmethod
+    def select_template(prompt: str|dict[str, str], element_category=None) -> str:
         if type(prompt) == dict:
             if element_category is not None and element_category.lower() in prompt:
-                prompt_template = Template(prompt[element_category.lower()])
+                return prompt[element_category.lower()]
             elif "default" in prompt:
-                prompt_template = Template(prompt["default"])
+                return prompt["default"]
             else:
                 raise ValueError(f"No prompt template found for category '{element_category}' and no default template provided.")
-        else:
-            prompt_template = Template(prompt)
+
+        return prompt
+
+    @staticmethod
+    def process(prompt: str|dict[str, str], element_category=None, element_caption=None, metadata=None) -> str:
+        prompt_template = get_template(PromptBuilderEngine.select_template(prompt, element_category))
 
         prompt_output = prompt_template.render(metadata if metadata else [],
                                                element_category=element_category,
@@ -273,6 +309,9 @@ class PromptBuilderEngine(BaseEngine):
 
 
 class BaseImageCaptioningEngine(LayoutProcessingEngine):
+    inputs = frozenset({LayoutData.REGIONS, LayoutData.CAPTION_LINES})
+    outputs = frozenset({LayoutData.IMAGE_CAPTIONS})
+
     def __init__(self, config, device, config_path):
         super().__init__(config, device, config_path)
 
@@ -283,16 +322,31 @@ class BaseImageCaptioningEngine(LayoutProcessingEngine):
         self.max_attempts = self.config.getint('max_attempts', fallback=3)
         self.only_prepare_prompts = self.config.getboolean('only_prepare_prompts', fallback=False)
 
+        # Captions of the crops (nearly) identical to the already captioned ones (repeated vignettes, initials, ...)
+        # are reused from the index
+        self.duplicate_index = None
+        if self.config.get('dedup_index', None) is not None:
+            self.duplicate_index = get_duplicate_index(compose_path(self.config['dedup_index'], self.config_path))
+        self.dedup_max_distance = self.config.getint('dedup_max_distance', fallback=4)
+
         with open(self.prompt_settings_path, 'r') as f:
             self.prompt_settings = json.load(f)
 
         self.prompt_model = self.prompt_settings["model"]
         self.prompt_text = self._normalize_category_names(self.prompt_settings["text"])
 
+        # Size and JPEG quality of the crops by the token budgets of their categories, only max_image_size applies without it
+        self.resolution_policy = None
+        if "image_resolution" in self.prompt_settings:
+            self.resolution_policy = ResolutionPolicy.from_settings(self.prompt_settings["image_resolution"],
+                                                                    model_name=self.prompt_model,
+                                                                    max_image_size=self.max_image_size)
+
         self.prompt_builder = PromptBuilderEngine()
+        self.prompt_builder.precompile(self.prompt_text)
 
     @abstractmethod
-    def generate_image_caption(self, prompt_data: PromptData) -> LLMResult:
+    def generate_image_captions(self, data: list[PromptData]) -> list[LLMResult]:
         pass
 
     @staticmethod
@@ -308,19 +362,24 @@ class BaseImageCaptioningEngine(LayoutProcessingEngine):
 
     def process_page(self, page_image, page_layout):
         data = []
+        crop_store = get_crop_store(page_layout, page_image)
 
         for region in page_layout.regions:
             if region.category is None or region.category.lower() == "text":
                 continue
 
             if self.categories is None or region.category.lower() in self.categories:
-                image = self.crop_region_image(page_image, region)
-
-                if image.size == 0:
+                if crop_store.crop(region).size == 0:
                     self.logger.warning(f"Empty region detected {region.id} ({region.category}), skipping captioning.")
 
                 else:
-                    data.append(self.prepare_prompt_data(image, region, page_layout))
+                    image_size, quality, predicted_image_tokens = self.select_image_size(region, crop_store.crop(region))
+                    item = self.prepare_prompt_data(crop_store.resized(region, image_size), region, page_layout,
+                                                    crop_store.base64(region, image_size, quality))
+                    item.predicted_image_tokens = predicted_image_tokens
+                    if self.duplicate_index is not None:
+                        item.image_hash = crop_store.perceptual_hash(region)
+                    data.append(item)
 
         if self.only_prepare_prompts:
             for item in data:
@@ -331,6 +390,10 @@ class BaseImageCaptioningEngine(LayoutProcessingEngine):
                     metadata.prompts.append(item.prompt)
 
         else:
+            page_duplicates = []
+            if self.duplicate_index is not None:
+                data, page_duplicates = self.reuse_duplicate_captions(data, page_layout)
+
             current_attempt = 0
 
             unfinished_data = data
@@ -348,39 +411,78 @@ class BaseImageCaptioningEngine(LayoutProcessingEngine):
                         self.logger.info(f"Captioning attempt #{current_attempt} failed for region {item.region.id}, will retry.")
                         print(item.usage)
                     else:
-                        if "anno_page_processing" not in page_layout.metadata:
-                            page_layout.metadata["anno_page_processing"] = {}
-
-                        if self.__class__.__name__ not in page_layout.metadata["anno_page_processing"]:
-                            page_layout.metadata["anno_page_processing"][self.__class__.__name__] = {}
-
-                        page_layout.metadata["anno_page_processing"][self.__class__.__name__][item.region.id] = item.usage
+                        self.record_usage(page_layout, item)
                         self.logger.info(f"Captioning attempt #{current_attempt} succeeded for region {item.region.id}.")
 
+                        # Only the captions obtained in this attempt are added to the index
+                        if self.duplicate_index is not None and item.usage["failed_attempts"] == current_attempt - 1:
+                            self.duplicate_index.add(self.get_dedup_key(item), item.image_hash, item.result.model_dump(),
+                                                     source=f"{page_layout.id}/{item.region.id}")
+
                 self.logger.info(f"Captioning attempt #{current_attempt} completed, {len(unfinished_data)} item{'s' if len(unfinished_data) != 1 else ''} remaining.")
 
+            for item, original, distance in page_duplicates:
+                if original.result is None:
+                    self.logger.warning(f"Region {item.region.id} is not captioned, captioning of its duplicate {original.region.id} failed.")
+                    continue
+
+                self.reuse_caption(item, original.result.model_dump(), f"{page_layout.id}/{original.region.id}", distance, page_layout)
+
         return page_layout
 
-    def crop_region_image(self, page_image, region):
-        x1, y1, x2, y2 = region.get_polygon_bounding_box()
+    def select_image_size(self, region, image):
+        if self.resolution_policy is None:
+            return self.max_image_size, DEFAULT_JPEG_QUALITY, None
 
-        original_width = x2 - x1
-        original_height = y2 - y1
+        height, width = image.shape[:2]
+        return self.resolution_policy.select(region.category, width, height)
 
-        image = page_image[y1:y2, x1:x2]
+    def record_usage(self, page_layout, item: PromptData):
+        self.record_processing_info(page_layout, item.region.id, get_stream_speed(item.usage))
 
-        if self.max_image_size is not None and image.size > 0:
-            if original_width > self.max_image_size or original_height > self.max_image_size:
-                if original_width > original_height:
-                    image = cv2.resize(image, (self.max_image_size,
-                                               round(self.max_image_size * original_height / original_width)))
-                else:
-                    image = cv2.resize(image, (round(self.max_image_size * original_width / original_height),
-                                               self.max_image_size))
+    def get_dedup_key(self, item: PromptData) -> str:
+        # Captions are reused only for the same model, category and rendered prompt, i.e. the same template with the
+        # same element caption and page metadata, as the caption depends on all of them
+        category = item.region.category.lower() if item.region.category else None
+        return f"caption:{self.prompt_model}:{category}:{hashlib.sha256(item.prompt.encode('utf-8')).hexdigest()}"
+
+    def reuse_duplicate_captions(self, data: list[PromptData], page_layout) -> tuple[list[PromptData], list[tuple[PromptData, PromptData, int]]]:
+        # Captions found in the index are reused right away, the duplicates within the page are captioned once, the
+        # rest of them get the caption of the first one afterwards as (item, original, distance)
+        remaining_data = []
+        page_duplicates = []
+        for item in data:
+            dedup_key = self.get_dedup_key(item)
+            duplicate = self.duplicate_index.find(dedup_key, item.image_hash, self.dedup_max_distance)
+            if duplicate is not None and self.reuse_caption(item, *duplicate, page_layout):
+                continue
 
-        return image
+            original = next((original for original in remaining_data if self.get_dedup_key(original) == dedup_key and
+                             hamming_distance(original.image_hash, item.image_hash) <= self.dedup_max_distance), None)
+            if original is not None:
+                page_duplicates.append((item, original, hamming_distance(original.image_hash, item.image_hash)))
+            else:
+                remaining_data.append(item)
+
+        return remaining_data, page_duplicates
+
+    def reuse_caption(self, item: PromptData, value, source, distance, page_layout) -> bool:
+        try:
+            item.result = PromptResult.model_validate(value)
+        except ValidationError:
+            self.logger.warning(f"Cached caption from {source} is not valid, region {item.region.id} is captioned again.")
+            return False
+
+        item.usage["deduplicated_from"] = source
+        item.usage["hash_distance"] = distance
+        self.process_image_captions([item])
+        item.region.graphical_metadata.used_ai_models["image-caption-deduplication"] = f"{source} (phash distance {distance})"
+        self.record_usage(page_layout, item)
 
-    def prepare_prompt_data(self, image, region, page_layout):
+        self.logger.info(f"Reused caption of {source} for region {item.region.id} (distance {distance}).")
+        return True
+
+    def prepare_prompt_data(self, image, region, page_layout, image_base64):
         page_metadata = page_layout.metadata.get("anno_page_metadata", None)
         prompt = self.prompt_builder.process(prompt=self.prompt_text,
                                              element_category=region.category,
@@ -392,7 +494,13 @@ class BaseImageCaptioningEngine(LayoutProcessingEngine):
             "completion_tokens": 0,
             "total_tokens": 0,
             "cost": 0,
-            "failed_attempts": 0
+            "failed_attempts": 0,
+            "predicted_image_tokens": 0,
+            "request_time": 0,
+            "time_to_first_token": 0,
+            "tokens_per_second": 0,
+            "streamed_requests": 0,
+            "aborted_streams": 0
         }
 
         return PromptData(
@@ -400,26 +508,17 @@ class BaseImageCaptioningEngine(LayoutProcessingEngine):
             region=region,
             metadata=page_metadata,
             prompt=prompt,
-            usage=usage
+            usage=usage,
+            image_base64=image_base64
         )
 
     def process_elements(self, data: list[PromptData]):
-        if self.num_processes > 1:
-            self.logger.debug(f"Processing image captions in parallel using {self.num_processes} processes.")
-            with Pool(self.num_processes) as p:
-                captioning_results = p.map(self.generate_image_caption, data)
-
-            for item, captioning_result in zip(data, captioning_results):
-                item.result = captioning_result.data
-                for key in item.usage.keys():
-                    item.usage[key] += captioning_result.usage.get(key, 0)
-        else:
-            self.logger.debug("Processing image captions sequentially.")
-            for item in data:
-                captioning_result = self.generate_image_caption(item)
-                item.result = captioning_result.data
-                for key in item.usage.keys():
-                    item.usage[key] += captioning_result.usage.get(key, 0)
+        captioning_results = self.generate_image_captions(data)
+
+        for item, captioning_result in zip(data, captioning_results):
+            item.result = captioning_result.data
+            for key in item.usage.keys():
+                item.usage[key] += captioning_result.usage.get(key, 0)
 
     def process_image_captions(self, data: list[PromptData]):
         for item in data:
@@ -461,12 +560,6 @@ class BaseImageCaptioningEngine(LayoutProcessingEngine):
 
             self.logger.info(f"Successfully processed caption for region {item.region.id}")
 
-    @staticmethod
-    def encode_image(image):
-        image_jpg = cv2.imencode('.jpg', image)[1]
-        image_base64 = base64.b64encode(image_jpg).decode('utf-8')
-        return image_base64
-
 
 class OpenAICompletionsImageCaptioningEngine(BaseImageCaptioningEngine):
     def __init__(self, config, device, config_path):
@@ -487,83 +580,167 @@ class OpenAICompletionsImageCaptioningEngine(BaseImageCaptioningEngine):
 
         self.prompt_max_tokens = self.prompt_settings.get("max_tokens", None)
 
-    def generate_image_caption(self, prompt_data: PromptData) -> LLMResult:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
+        # Several regions of a page are packed into a single request with an array of results keyed by the region id,
+        # the regions missing in the response are requested one by one
+        self.regions_per_request = self.config.getint('regions_per_request', fallback=1)
+        self.packed_prompt_header = self.prompt_settings.get("packed_prompt_header", PACKED_PROMPT_HEADER)
+        self.packed_response_schema = PagePromptResult.model_json_schema()
+
+        # Streamed responses are validated while they arrive, the ones leaving the schema or exceeding max_stream_chunks
+        # content chunks are aborted and retried in the next attempt
+        self.stream = self.config.getboolean('stream', fallback=False)
+        self.max_stream_chunks = self.config.getint('max_stream_chunks', fallback=None)
+
+        self.client = OpenAICompletionsClient(api_url=self.api_url,
+                                              api_key=self.api_key,
+                                              model=self.prompt_model,
+                                              response_schema=PromptResult.model_json_schema(),
+                                              max_tokens=self.prompt_max_tokens,
+                                              stream=self.stream,
+                                              max_stream_chunks=self.max_stream_chunks)
+        self.request_executor = LLMRequestExecutor(self.client, num_processes=self.num_processes)
+
+    def generate_image_captions(self, data: list[PromptData]) -> list[LLMResult]:
+        if self.regions_per_request <= 1 or len(data) <= 1:
+            return self.generate_region_captions(data)
+
+        batches = [data[start:start + self.regions_per_request] for start in range(0, len(data), self.regions_per_request)]
+        requests = []
+        for batch in batches:
+            max_tokens = self.prompt_max_tokens * len(batch) if self.prompt_max_tokens is not None else None
+            requests.append((self.build_packed_prompt(batch), [item.image_base64 for item in batch], self.packed_response_schema, max_tokens))
+
+        results = []
+        for batch, response in zip(batches, self.request_executor.map(requests)):
+            results.extend(self.parse_packed_response(batch, response))
+
+        missing = [index for index, result in enumerate(results) if result.data is None]
+        if missing:
+            self.logger.info(f"{len(missing)} of {len(data)} regions missing in the packed responses, requesting them one by one.")
+
+            for index, result in zip(missing, self.generate_region_captions([data[index] for index in missing])):
+                for key, value in results[index].usage.items():
+                    result.usage[key] += value
+                results[index] = result
+
+        return results
+
+    def build_packed_prompt(self, batch: list[PromptData]) -> str:
+        # The instructions shared by several regions (the same category and caption) are listed only once
+        instructions = {}
+        for index, item in enumerate(batch):
+            instructions.setdefault(item.prompt, []).append(f"image {index + 1} (region_id '{item.region.id}')")
+
+        parts = [self.packed_prompt_header.format(count=len(batch))]
+        for prompt, images in instructions.items():
+            parts.append(f"Instructions for {', '.join(images)}:\n{prompt}")
+
+        return "\n\n".join(parts)
+
+    def parse_packed_response(self, batch: list[PromptData], response: CompletionResponse) -> list[LLMResult]:
+        # The usage of the request is split evenly among its regions
+        results = [LLMResult(usage=self.create_usage(item, response, share=(index, len(batch)))) for index, item in enumerate(batch)]
+
+        if response.content is None:
+            return results
 
-        self.logger.debug(f"Generating caption for region {prompt_data.region.id} using {self.prompt_model} with prompt: {prompt_data.prompt}")
-
-        payload = {
-            "model": self.prompt_model,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt_data.prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{self.encode_image(prompt_data.image)}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            "text": {
-                "format": {
-                    "type": "json_schema",
-                    "name": "response_schema",
-                    "strict": True,
-                    "schema": PromptResult.model_json_schema()
-                }
-            }
-        }
+        try:
+            response_results = json.loads(response.content)["results"]
+        except (JSONDecodeError, KeyError, TypeError):
+            self.logger.info(f"Failed to parse packed response for {len(batch)} regions: {response.content}")
+            return results
+
+        region_results = {}
+        for response_result in response_results:
+            try:
+                region_result = RegionPromptResult.model_validate(response_result)
+            except ValidationError:
+                self.logger.info(f"Packed result does not conform to expected format: {response_result}")
+                continue
 
-        if self.prompt_max_tokens is not None:
-            payload["max_completion_tokens"] = self.prompt_max_tokens
+            region_results[region_result.region_id] = PromptResult.model_validate(region_result.model_dump(exclude={"region_id"}))
 
-        response = requests.post(self.api_url, headers=headers, json=payload)
-        if response.status_code != 200:
-            self.logger.warning(f"Request failed with status code {response.status_code}: {response.text}")
-            return None
+        for item, result in zip(batch, results):
+            result.data = region_results.get(item.region.id, None)
 
-        response_json = response.json()
+        return results
 
-        result = LLMResult()
-        result.usage = {
+    def generate_region_captions(self, data: list[PromptData]) -> list[LLMResult]:
+        for item in data:
+            self.logger.debug(f"Generating caption for region {item.region.id} using {self.prompt_model} with prompt: {item.prompt}")
+
+        responses = self.request_executor.map([(item.prompt, item.image_base64) for item in data])
+
+        return [self.parse_response(item, response) for item, response in zip(data, responses)]
+
+    def create_usage(self, prompt_data: PromptData, response: CompletionResponse, share=(0, 1)) -> dict:
+        # share is (index, count) of the region among the regions of a packed request
+        index, count = share
+        usage = {
             "prompt_tokens": 0,
             "completion_tokens": 0,
             "total_tokens": 0,
             "cost": 0,
-            "failed_attempts": 0
+            "failed_attempts": 0,
+            "predicted_image_tokens": 0,
+            "request_time": 0,
+            "time_to_first_token": 0,
+            "tokens_per_second": 0,
+            "streamed_requests": 0,
+            "aborted_streams": 0
         }
 
-        usage = response_json["usage"] if "usage" in response_json else None
+        if response.usage is not None:
+            for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                value = response.usage.get(key, 0)
+                usage[key] += value // count + (1 if index < value % count else 0)
+            usage["cost"] += response.usage.get("cost", 0) / count
+
+            # Counted only for the billed requests to be comparable with the prompt tokens
+            if prompt_data.predicted_image_tokens is not None:
+                usage["predicted_image_tokens"] += prompt_data.predicted_image_tokens
+                self.logger.debug(f"Region {prompt_data.region.id}: {prompt_data.predicted_image_tokens} image tokens "
+                                  f"predicted, {response.usage.get('prompt_tokens', 0)} prompt tokens billed.")
 
-        if usage is not None:
-            result.usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
-            result.usage["completion_tokens"] += usage.get("completion_tokens", 0)
-            result.usage["total_tokens"] += usage.get("total_tokens", 0)
-            result.usage["cost"] += usage.get("cost", 0)
+        # Times of the whole request are split among its regions as the tokens are, the speed is completion tokens per
+        # the request time after the first token, the same for all regions of the request
+        if response.timings is not None:
+            usage["request_time"] += response.timings.get("request_time", 0) / count
+            usage["time_to_first_token"] += (response.timings.get("time_to_first_token", None) or 0) / count
+
+            if response.timings.get("tokens_per_second", None) is not None:
+                usage["tokens_per_second"] += response.timings["tokens_per_second"]
+                usage["streamed_requests"] += 1
+
+        if response.aborted is not None:
+            usage["aborted_streams"] += 1
+            self.logger.info(f"Stream for region {prompt_data.region.id} aborted: {response.aborted}")
+
+        return usage
+
+    def parse_response(self, prompt_data: PromptData, response: CompletionResponse) -> LLMResult:
+        result = LLMResult()
+        result.usage = self.create_usage(prompt_data, response)
+
+        if response.content is None:
+            return result
 
         image_caption = None
 
         try:
-            response_content = json.loads(response_json["choices"][0]["message"]["content"])
+            response_content = json.loads(response.content)
             image_caption = PromptResult.model_validate(response_content)
             self.logger.info(f"Successfully parsed caption for region {prompt_data.region.id}")
         except JSONDecodeError:
-            self.logger.info(f"Failed to parse JSON for region {prompt_data.region.id}: {response.text}")
+            self.logger.info(f"Failed to parse JSON for region {prompt_data.region.id}: {response.content}")
         except ValidationError:
-            self.logger.info(f"Caption for region {prompt_data.region.id} does not conform to expected format: {result_json}")
+            self.logger.info(f"Caption for region {prompt_data.region.id} does not conform to expected format: {response_content}")
         except Exception as e:
             self.logger.info(f"Exception for region {prompt_data.region.id}: {e}")
 
         result.data = image_caption
 
         return result
+
+    def close(self):
+        self.request_executor.shutdown()
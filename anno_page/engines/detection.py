@@ -1,16 +1,22 @@
 import numpy as np
+import torch.nn.functional as F
 
 from ultralytics import YOLO
 
 from anno_page.core.utils import compose_path, config_get_list
+from anno_page.core.crops import get_crop_store
 from anno_page.core.layout import AnnoPageRegionLayout as RegionLayout
 from anno_page.core.metadata import GraphicalObjectMetadata
 from anno_page.core.services import UuidService
+from anno_page.core.id_allocator import get_id_allocator
 from anno_page.engines import LayoutProcessingEngine
-from anno_page.enums import Category, Language
+from anno_page.enums import Category, Language, LayoutData
 
 
 class YoloDetectionEngine(LayoutProcessingEngine):
+    inputs = frozenset()
+    outputs = frozenset({LayoutData.REGIONS})
+
     def __init__(self, config, device, config_path):
         super().__init__(config, device, config_path)
 
@@ -21,25 +27,36 @@ class YoloDetectionEngine(LayoutProcessingEngine):
                                      agnostic_nms=self.config.getboolean("AGNOSTIC_NMS", False))
 
         self.categories = config_get_list(self.config, key="categories", fallback=None, make_lowercase=True)
+        self.device_preprocessing = self.config.getboolean("DEVICE_PREPROCESSING", fallback=False)
 
         self.uuid_service = UuidService()
 
     def process_page(self, page_image, page_layout):
-        results = self.detector(page_image)
+        # Large pages are detected on their downscaled proxy, the boxes are scaled back to the page
+        crop_store = get_crop_store(page_layout, page_image)
+        detection_image, scale = crop_store.page_image(proxy=True)
+
+        if self.device_preprocessing:
+            boxes = self.detector.detect_on_device(crop_store.device_image(self.device, proxy=True))
+        else:
+            boxes = self.detector(detection_image).boxes.data
+
+        id_allocator = get_id_allocator(page_layout)
 
-        boxes = results.boxes.data.cpu()
+        boxes = boxes.cpu().clone()
+        boxes[:, :4] /= scale
         for box in boxes:
             x_min, y_min, x_max, y_max, conf, class_id = box.tolist()
             category = self.detector.names[int(class_id)]
 
             if self.categories is None or category.lower() in self.categories:
                 category_name = Category.from_string(category).to_string(Language.MODS_GENRE_EN)
-                region_id = self.get_next_region_id(page_layout, category, prefix=category_name)
+                region_id = id_allocator.next_id(prefix=f"{category_name}_", padding=3)
                 polygon = np.array([[x_min, y_min], [x_min, y_max], [x_max, y_max], [x_max, y_min], [x_min, y_min]])
 
                 region = RegionLayout(region_id, polygon, category=category, detection_confidence=conf)
 
-                mods_id = self.get_next_mods_id(page_layout)
+                mods_id = id_allocator.next_id(prefix="MODS_PICT_", padding=4)
                 region.graphical_metadata = GraphicalObjectMetadata(tag_id=region_id,
                                                                     mods_id=mods_id,
                                                                     mods_uuid=str(self.uuid_service()),
@@ -49,32 +66,6 @@ class YoloDetectionEngine(LayoutProcessingEngine):
 
         return page_layout
 
-    @staticmethod
-    def get_next_region_id(page_layout, category, prefix, padding=3):
-        existing_region_ids = set([region.id for region in page_layout.regions if region.category == category])
-
-        index = 1
-        new_id = f"{prefix}_{str(index).zfill(padding)}"
-
-        while new_id in existing_region_ids:
-            index += 1
-            new_id = f"{prefix}_{str(index).zfill(padding)}"
-
-        return new_id
-    
-    @staticmethod
-    def get_next_mods_id(page_layout, prefix="MODS_PICT", padding=4):
-        existing_mods_ids = set([region.graphical_metadata.mods_id for region in page_layout.regions if region.graphical_metadata and region.graphical_metadata.mods_id])
-
-        index = 1
-        new_id = f"{prefix}_{str(index).zfill(padding)}"
-
-        while new_id in existing_mods_ids:
-            index += 1
-            new_id = f"{prefix}_{str(index).zfill(padding)}"
-
-        return new_id
-
 
 class YoloDetector:
     def __init__(self, model_path, device, detection_threshold=0.2, image_size=640, agnostic_nms=False):
@@ -90,6 +81,36 @@ class YoloDetector:
         results = self.model(image, conf=self.detection_threshold, imgsz=self.image_size, verbose=False, agnostic_nms=self.agnostic_nms)
         return results[0]
 
+    def detect_on_device(self, image):
+        # YOLO does not letterbox tensor inputs, the image is resized and padded on the device here and the boxes
+        # (x_min, y_min, x_max, y_max, confidence, class) are mapped back to the page coordinates
+        tensor, scale, (pad_left, pad_top) = letterbox_tensor(image, self.image_size, stride=int(self.model.model.stride.max()))
+        results = self.model(tensor, conf=self.detection_threshold, verbose=False, agnostic_nms=self.agnostic_nms)
+
+        boxes = results[0].boxes.data.clone()
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_left) / scale).clamp(0, image.shape[1])
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_top) / scale).clamp(0, image.shape[0])
+
+        return boxes
+
     @property
     def names(self):
         return self.model.names
+
+
+def letterbox_tensor(image, image_size, stride=32, pad_value=114):
+    # Same as the ultralytics letterbox for the inference: the longer side is resized to image_size and the image is
+    # centered on the smallest canvas divisible by the stride, BGR uint8 HWC input produces RGB float BCHW in 0-1.
+    height, width = image.shape[:2]
+    scale = min(image_size / height, image_size / width)
+    resized_height, resized_width = round(height * scale), round(width * scale)
+
+    tensor = image.permute(2, 0, 1).flip(0).unsqueeze(0).float()
+    tensor = F.interpolate(tensor, size=(resized_height, resized_width), mode="bilinear", align_corners=False, antialias=True)
+
+    pad_height = (stride - resized_height % stride) % stride
+    pad_width = (stride - resized_width % stride) % stride
+    pad_top, pad_left = pad_height // 2, pad_width // 2
+    tensor = F.pad(tensor, (pad_left, pad_width - pad_left, pad_top, pad_height - pad_top), value=pad_value)
+
+    return tensor / 255.0, scale, (pad_left, pad_top)
@@ -1,19 +1,25 @@
 import torch
 import transformers
+import torch.nn.functional as F
 
 from PIL import Image
 from transformers import AutoModel, AutoProcessor
 
 from anno_page import globals
-from anno_page.core.utils import config_get_list
+from anno_page.core.utils import compose_path, config_get_list
+from anno_page.core.crops import get_crop_store
+from anno_page.core.dedup import get_duplicate_index
 from anno_page.core.services import DateTimeService, UuidService
 from anno_page.engines import BaseEngine, LayoutProcessingEngine
 from anno_page.engines.helpers import config_get_dtype
-from anno_page.enums import Category, Language
+from anno_page.enums import Category, Language, LayoutData
 from anno_page.core.embedding import ObjectEmbedding, ProcessingInfo
 
 
 class HuggingfaceImageEmbeddingEngine(LayoutProcessingEngine):
+    inputs = frozenset({LayoutData.REGIONS})
+    outputs = frozenset({LayoutData.EMBEDDINGS})
+
     def __init__(self, config, device, config_path):
         super().__init__(config, device, config_path)
 
@@ -21,6 +27,14 @@ class HuggingfaceImageEmbeddingEngine(LayoutProcessingEngine):
         self.decimal_places = self.config.getint("DECIMAL_PLACES", None)
         self.precision = config_get_dtype(self.config, key="PRECISION", fallback=torch.float16)
         self.categories = config_get_list(self.config, key="categories", fallback=None, make_lowercase=True)
+        self.device_preprocessing = self.config.getboolean("DEVICE_PREPROCESSING", fallback=False)
+
+        # Embeddings of the crops (nearly) identical to the already embedded ones are reused from the index
+        self.duplicate_index = None
+        if self.config.get("DEDUP_INDEX", None) is not None:
+            self.duplicate_index = get_duplicate_index(compose_path(self.config["DEDUP_INDEX"], self.config_path))
+        self.dedup_max_distance = self.config.getint("DEDUP_MAX_DISTANCE", fallback=4)
+        self.dedup_key = f"embedding:{self.model_name}:{self.precision}:{self.decimal_places}"
 
         self.model = AutoModel.from_pretrained(self.model_name, torch_dtype=self.precision).to(self.device).eval()
         self.processor = AutoProcessor.from_pretrained(self.model_name)
@@ -28,31 +42,70 @@ class HuggingfaceImageEmbeddingEngine(LayoutProcessingEngine):
         self.uuid_service = UuidService()
         self.date_time_service = DateTimeService()
 
+    def preprocess_on_device(self, image):
+        # Mirrors the resize, center crop, rescale and normalization of the model's image processor on the device
+        # crop of the page, the channels are passed in the same order as to the image processor on the CPU path.
+        image_processor = self.processor.image_processor
+        tensor = image.permute(2, 0, 1).unsqueeze(0).float()
+
+        if getattr(image_processor, "do_resize", False):
+            size = image_processor.size
+            if "height" in size and "width" in size:
+                target_size = (size["height"], size["width"])
+            else:
+                height, width = tensor.shape[-2:]
+                scale = size["shortest_edge"] / min(height, width)
+                target_size = (max(1, round(height * scale)), max(1, round(width * scale)))
+
+            mode = "bicubic" if int(getattr(image_processor, "resample", 2)) == 3 else "bilinear"
+            tensor = F.interpolate(tensor, size=target_size, mode=mode, align_corners=False, antialias=True).clamp(0, 255)
+
+        if getattr(image_processor, "do_center_crop", False):
+            crop_height, crop_width = image_processor.crop_size["height"], image_processor.crop_size["width"]
+            top = max(0, (tensor.shape[-2] - crop_height) // 2)
+            left = max(0, (tensor.shape[-1] - crop_width) // 2)
+            tensor = tensor[..., top:top + crop_height, left:left + crop_width]
+
+        if getattr(image_processor, "do_rescale", False):
+            tensor = tensor * image_processor.rescale_factor
+
+        if getattr(image_processor, "do_normalize", False):
+            mean = torch.tensor(image_processor.image_mean, device=tensor.device).view(1, -1, 1, 1)
+            std = torch.tensor(image_processor.image_std, device=tensor.device).view(1, -1, 1, 1)
+            tensor = (tensor - mean) / std
+
+        return {"pixel_values": tensor}
+
     def process_page(self, page_image, page_layout):
+        crop_store = get_crop_store(page_layout, page_image)
+
         for region in page_layout.regions:
             if region.category is None or region.category.lower() == "text":
                 continue
 
             if self.categories is None or region.category.lower() in self.categories:
-                x_min, y_min, x_max, y_max = region.get_polygon_bounding_box()
-                region_image = page_image[y_min:y_max, x_min:x_max]
+                region_image = crop_store.crop(region)
 
                 if region_image.size == 0:
                     continue
 
                 object_uuid = region.graphical_metadata.mods_uuid if region.graphical_metadata is not None else str(self.uuid_service())
 
-                image_inputs = self.processor(images=Image.fromarray(region_image), return_tensors="pt").to(self.device)
-                with torch.no_grad():
-                    region_embedding = self.model.get_image_features(**image_inputs)
+                duplicate = None
+                if self.duplicate_index is not None:
+                    duplicate = self.duplicate_index.find(self.dedup_key, crop_store.perceptual_hash(region), self.dedup_max_distance)
 
-                    if isinstance(region_embedding, transformers.modeling_outputs.BaseModelOutputWithPooling):
-                        region_embedding = region_embedding.pooler_output
+                deduplicated_from = None
+                if duplicate is not None:
+                    region_embedding, deduplicated_from, distance = duplicate
+                    self.logger.info(f"Reused embedding of {deduplicated_from} for region {region.id} (distance {distance}).")
 
-                    region_embedding = region_embedding.float().cpu().numpy()[0].tolist()
+                else:
+                    region_embedding = self.embed_region(crop_store, region, region_image)
 
-                if self.decimal_places is not None:
-                    region_embedding = [round(value, self.decimal_places) for value in region_embedding]
+                    if self.duplicate_index is not None:
+                        self.duplicate_index.add(self.dedup_key, crop_store.perceptual_hash(region), region_embedding,
+                                                 source=f"{page_layout.id}/{region.id}")
 
                 category_name = Category.from_string(region.category).to_string(Language.MODS_GENRE_EN)
 
@@ -68,7 +121,8 @@ class HuggingfaceImageEmbeddingEngine(LayoutProcessingEngine):
                         datetime=self.date_time_service().isoformat(),
                         model=self.model_name,
                         decimal_places=self.decimal_places,
-                        precision=str(self.precision)
+                        precision=str(self.precision),
+                        deduplicated_from=deduplicated_from
                     )
                 )
 
@@ -76,6 +130,24 @@ class HuggingfaceImageEmbeddingEngine(LayoutProcessingEngine):
 
         return page_layout
 
+    def embed_region(self, crop_store, region, region_image) -> list[float]:
+        if self.device_preprocessing:
+            image_inputs = self.preprocess_on_device(crop_store.device_crop(region, self.device))
+        else:
+            image_inputs = self.processor(images=Image.fromarray(region_image), return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            region_embedding = self.model.get_image_features(**image_inputs)
+
+            if isinstance(region_embedding, transformers.modeling_outputs.BaseModelOutputWithPooling):
+                region_embedding = region_embedding.pooler_output
+
+            region_embedding = region_embedding.float().cpu().numpy()[0].tolist()
+
+        if self.decimal_places is not None:
+            region_embedding = [round(value, self.decimal_places) for value in region_embedding]
+
+        return region_embedding
+
 
 class HuggingfaceTextEmbeddingEngine(BaseEngine):
     def __init__(self, config, device, config_path):
@@ -1,12 +1,12 @@
 import os
 import cv2
 import json
+import time
 import numpy as np
 import base64
 import requests
 
 from json import JSONDecodeError
-from jinja2 import Template
 from pydantic import BaseModel, ValidationError
 from shapely.geometry import Polygon
 
@@ -14,6 +14,9 @@ from anno_page.core.utils import compose_path, config_get_list
 from anno_page.engines.base import LayoutProcessingEngine
 from anno_page.core.metadata import GraphicalObjectMetadata
 from anno_page.core.llm_api_aliases import get_llm_api_aliases
+from anno_page.core.templates import get_template
+from anno_page.engines.llm_client import stream_completion, get_stream_speed
+from anno_page.enums import LayoutData
 
 
 class InitialRecognitionResult(BaseModel):
@@ -28,12 +31,20 @@ class LLMResult:
 
 
 class InitialRecognitionEngine(LayoutProcessingEngine):
+    inputs = frozenset({LayoutData.REGIONS, LayoutData.LINES})
+    outputs = frozenset({LayoutData.INITIALS})
+
     def __init__(self, config, device, config_path):
         super().__init__(config, device, config_path, requires_lines=True)
 
         self.categories = config_get_list(self.config, key="categories", fallback=["initial"], make_lowercase=True)
         self.max_attempts = config.getint("max_attempts", fallback=3)
 
+        # Streamed responses are validated while they arrive, the ones leaving the schema or exceeding max_stream_chunks
+        # content chunks are aborted and retried
+        self.stream = config.getboolean("stream", fallback=False)
+        self.max_stream_chunks = config.getint("max_stream_chunks", fallback=None)
+
         self.top_down_target_coefficient = 0.0
         self.left_right_target_coefficient = 2
         self.top_down_context_coefficient = 1.0
@@ -59,6 +70,9 @@ class InitialRecognitionEngine(LayoutProcessingEngine):
         self.prompt_model = self.prompt_settings["model"]
         self.prompt_text = self._normalize_category_names(self.prompt_settings["text"])
 
+        for prompt_template in (self.prompt_text.values() if isinstance(self.prompt_text, dict) else [self.prompt_text]):
+            get_template(prompt_template)
+
     @staticmethod
     def _normalize_category_names(prompt_text):
         if type(prompt_text) == dict:
@@ -81,13 +95,7 @@ class InitialRecognitionEngine(LayoutProcessingEngine):
                 llm_result = self._process_initial(region, initial_crop, context_crop, continuing_line)
                 result = llm_result.data
 
-                if "anno_page_processing" not in page_layout.metadata:
-                    page_layout.metadata["anno_page_processing"] = {}
-
-                if self.__class__.__name__ not in page_layout.metadata["anno_page_processing"]:
-                    page_layout.metadata["anno_page_processing"][str(self.__class__.__name__)] = {}
-
-                page_layout.metadata["anno_page_processing"][str(self.__class__.__name__)][region.id] = llm_result.usage
+                self.record_processing_info(page_layout, region.id, get_stream_speed(llm_result.usage))
 
                 if result is not None:
                     region.transcription = result.initial
@@ -108,7 +116,7 @@ class InitialRecognitionEngine(LayoutProcessingEngine):
         prompt_template = self.prompt_text
         if isinstance(prompt_template, dict):
             prompt_template = prompt_template[region.category.lower()]
-        prompt_template = Template(prompt_template)
+        prompt_template = get_template(prompt_template)
 
         prompt_text = prompt_template.render(example_output=example_output.model_dump_json(indent=4),
                                              continuing_line=continuing_line.transcription)
@@ -156,16 +164,53 @@ class InitialRecognitionEngine(LayoutProcessingEngine):
             "completion_tokens": 0,
             "total_tokens": 0,
             "cost": 0,
-            "failed_attempts": 0
+            "failed_attempts": 0,
+            "request_time": 0,
+            "time_to_first_token": 0,
+            "tokens_per_second": 0,
+            "streamed_requests": 0,
+            "aborted_streams": 0
         }
 
         for attempt in range(self.max_attempts):
             self.logger.info(f"Attempt {attempt + 1} for region {region.id}")
 
-            response = requests.post(self.api_url, headers=headers, json=request_args)
-            response_json = response.json()
+            if self.stream:
+                response = stream_completion(self.api_url, headers, request_args,
+                                             response_schema=InitialRecognitionResult.model_json_schema(),
+                                             max_stream_chunks=self.max_stream_chunks,
+                                             logger=self.logger)
+
+                if response.timings is not None:
+                    result.usage["request_time"] += response.timings["request_time"]
+                    result.usage["time_to_first_token"] += response.timings["time_to_first_token"] or 0
+
+                    if response.timings["tokens_per_second"] is not None:
+                        result.usage["tokens_per_second"] += response.timings["tokens_per_second"]
+                        result.usage["streamed_requests"] += 1
+
+                if response.status_code != 200 or response.aborted is not None:
+                    result.usage["aborted_streams"] += 1 if response.aborted is not None else 0
+                    result.usage["failed_attempts"] = attempt + 1
+                    continue
+
+                usage = response.usage
+                content = response_text = response.content
+
+            else:
+                start_time = time.perf_counter()
+                response = requests.post(self.api_url, headers=headers, json=request_args)
+                result.usage["request_time"] += time.perf_counter() - start_time
+
+                if response.status_code != 200:
+                    self.logger.warning(f"Request failed with status code {response.status_code}: {response.text}")
+                    result.usage["failed_attempts"] = attempt + 1
+                    continue
+
+                response_json = response.json()
 
-            usage = response_json["usage"] if "usage" in response_json else None
+                usage = response_json["usage"] if "usage" in response_json else None
+                content, response_text = None, response.text
 
             if usage is not None:
                 result.usage["prompt_tokens"] += usage.get("prompt_tokens", 0)
@@ -175,15 +220,15 @@ class InitialRecognitionEngine(LayoutProcessingEngine):
                 result.usage["failed_attempts"] = attempt
 
             try:
-                response_content = json.loads(response_json["choices"][0]["message"]["content"])
+                response_content = json.loads(content if self.stream else response_json["choices"][0]["message"]["content"])
                 result.data = InitialRecognitionResult.model_validate(response_content)
                 self.logger.info(f"Successfully parsed initial result for region {region.id}")
                 break
 
             except JSONDecodeError:
-                self.logger.info(f"Failed to parse JSON for region {region.id}: {response.text}")
+                self.logger.info(f"Failed to parse JSON for region {region.id}: {response_text}")
             except ValidationError:
-                self.logger.info(f"Initial result for region {region.id} does not conform to expected format: {result_json}")
+                self.logger.info(f"Initial result for region {region.id} does not conform to expected format: {response_content}")
             except Exception as e:
                 self.logger.info(f"Exception for region {region.id}: {e}")
 
@@ -0,0 +1,447 @@
+import json
+import time
+import logging
+import requests
+
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+
+class CompletionResponse:
+    def __init__(self, content: str | None = None, usage: dict | None = None, status_code: int | None = None,
+                 timings: dict | None = None, aborted: str | None = None):
+        self.content = content
+        self.usage = usage
+        self.status_code = status_code
+        self.timings = timings
+        self.aborted = aborted
+
+
+class StreamAborted(Exception):
+    pass
+
+
+class SchemaMismatchError(StreamAborted):
+    pass
+
+
+LITERAL_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzE0123456789+-.")
+LITERAL_WORDS = {"t": "true", "f": "false", "n": "null"}
+VALUE_TYPES = {"{": "object", "[": "array", "\"": "string", "t": "boolean", "f": "boolean", "n": "null"}
+
+
+class IncrementalJSONValidator:
+    # Checks the prefix of a streamed JSON document against the response schema: the syntax, the type of each value as
+    # soon as its first character arrives, the keys of the objects which do not allow additional properties and the
+    # required keys when an object is closed. The value constraints are left to the validation of the complete document.
+    def __init__(self, schema: dict | None):
+        self.schema = schema
+        self.definitions = schema.get("$defs", {}) if schema is not None else {}
+
+        # Frames of the open objects and arrays as [kind, state, properties, additional_properties, value_schema,
+        # missing_required_keys]
+        self.stack = []
+        self.done = False
+
+        self.in_string = False
+        self.string_is_key = False
+        self.escape = False
+        self.key = ""
+        self.literal = None
+
+    @property
+    def complete(self) -> bool:
+        if self.literal is not None and not self.stack:
+            try:
+                json.loads(self.literal)
+                return True
+            except ValueError:
+                return False
+
+        return self.done
+
+    def feed(self, text: str):
+        for char in text:
+            self.feed_char(char)
+
+    def feed_char(self, char):
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                if self.string_is_key:
+                    self.end_key()
+                else:
+                    self.end_value()
+                return
+
+            if self.string_is_key:
+                self.key += char
+            return
+
+        if self.literal is not None:
+            if char in LITERAL_CHARS:
+                self.literal += char
+                word = LITERAL_WORDS.get(self.literal[0], None)
+                if word is not None and not word.startswith(self.literal):
+                    raise SchemaMismatchError(f"Invalid literal '{self.literal}'.")
+                return
+
+            self.end_literal()
+
+        if char in " \t\r\n":
+            return
+
+        if not self.stack:
+            if self.done:
+                raise SchemaMismatchError(f"Unexpected '{char}' after the end of the document.")
+            self.start_value(char, self.schema)
+            return
+
+        frame = self.stack[-1]
+        kind, state = frame[0], frame[1]
+
+        if state in ("value", "value_or_end"):
+            if char == "]" and state == "value_or_end":
+                self.stack.pop()
+                self.end_value()
+            else:
+                self.start_value(char, frame[4])
+
+        elif state in ("key", "key_or_end"):
+            if char == "}" and state == "key_or_end":
+                self.end_object()
+            elif char == '"':
+                self.in_string, self.string_is_key, self.key = True, True, ""
+            else:
+                raise SchemaMismatchError(f"Unexpected '{char}', an object key expected.")
+
+        elif state == "colon":
+            if char != ":":
+                raise SchemaMismatchError(f"Unexpected '{char}', ':' expected.")
+            frame[1] = "value"
+
+        elif state == "comma_or_end":
+            if char == ",":
+                frame[1] = "key" if kind == "object" else "value"
+            elif char == "}" and kind == "object":
+                self.end_object()
+            elif char == "]" and kind == "array":
+                self.stack.pop()
+                self.end_value()
+            else:
+                raise SchemaMismatchError(f"Unexpected '{char}', ',' or the end of the {kind} expected.")
+
+    def start_value(self, char, schema):
+        value_type = VALUE_TYPES.get(char, "number" if char == "-" or char.isdigit() else None)
+        if value_type is None:
+            raise SchemaMismatchError(f"Unexpected '{char}', a value expected.")
+
+        alternatives = self.resolve(schema)
+        allowed_types = self.allowed_types(alternatives)
+        if allowed_types is not None and value_type not in allowed_types:
+            raise SchemaMismatchError(f"Value of type {value_type} where {', '.join(sorted(allowed_types))} expected.")
+
+        # An option without a type allows values of any type
+        options = [option for option in alternatives if self.allowed_types([option]) is None or value_type in self.allowed_types([option])] if alternatives else []
+
+        if value_type == "object":
+            properties, additional_properties, required = None, True, set()
+            if len(options) == 1:
+                properties = options[0].get("properties", None)
+                additional_properties = options[0].get("additionalProperties", True) is not False
+                required = set(options[0].get("required", []))
+            self.stack.append(["object", "key_or_end", properties, additional_properties, None, required])
+
+        elif value_type == "array":
+            items = options[0].get("items", None) if len(options) == 1 else None
+            self.stack.append(["array", "value_or_end", None, True, items, set()])
+
+        elif value_type == "string":
+            self.in_string, self.string_is_key = True, False
+
+        else:
+            self.literal = char
+
+    def end_key(self):
+        frame = self.stack[-1]
+        properties, additional_properties = frame[2], frame[3]
+
+        if properties is not None and self.key not in properties and not additional_properties:
+            raise SchemaMismatchError(f"Unexpected key '{self.key}'.")
+
+        frame[1] = "colon"
+        frame[4] = properties.get(self.key, None) if properties is not None else None
+        frame[5].discard(self.key)
+
+    def end_object(self):
+        missing_keys = self.stack.pop()[5]
+        if missing_keys:
+            raise SchemaMismatchError(f"Missing required keys {', '.join(sorted(missing_keys))}.")
+
+        self.end_value()
+
+    def end_literal(self):
+        try:
+            json.loads(self.literal)
+        except ValueError:
+            raise SchemaMismatchError(f"Invalid literal '{self.literal}'.")
+
+        self.literal = None
+        self.end_value()
+
+    def end_value(self):
+        if not self.stack:
+            self.done = True
+        else:
+            self.stack[-1][1] = "comma_or_end"
+
+    def resolve(self, schema) -> list[dict] | None:
+        # Alternatives of the schema with the references resolved, None if any value is allowed
+        if not schema:
+            return None
+
+        if "$ref" in schema:
+            return self.resolve(self.definitions.get(schema["$ref"].split("/")[-1], None))
+
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                alternatives = []
+                for option in schema[key]:
+                    resolved = self.resolve(option)
+                    if resolved is None:
+                        return None
+                    alternatives.extend(resolved)
+                return alternatives
+
+        return [schema]
+
+    @staticmethod
+    def allowed_types(alternatives) -> set[str] | None:
+        if alternatives is None:
+            return None
+
+        allowed_types = set()
+        for alternative in alternatives:
+            schema_type = alternative.get("type", None)
+            if schema_type is None:
+                return None
+
+            for item in (schema_type if isinstance(schema_type, list) else [schema_type]):
+                allowed_types.add("number" if item == "integer" else item)
+
+        return allowed_types
+
+
+def get_stream_speed(usage: dict) -> dict:
+    # The speeds of the streamed requests are summed with the rest of the usage, the recorded usage has their mean
+    if not usage.get("streamed_requests", 0):
+        return usage
+
+    return {**usage, "tokens_per_second": usage["tokens_per_second"] / usage["streamed_requests"]}
+
+
+def stream_completion(api_url, headers, payload, response_schema=None, max_stream_chunks=None, logger=None) -> CompletionResponse:
+    # Server-sent events of an OpenAI compatible endpoint; the stream is closed as soon as the content leaves the
+    # schema or exceeds max_stream_chunks content chunks (the tokens are known only from the final usage), the request
+    # is then failed with the reason in aborted
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    validator = IncrementalJSONValidator(response_schema) if response_schema is not None else None
+
+    start_time = time.perf_counter()
+    first_token_time = None
+    content_parts = []
+    streamed_chunks = 0
+    usage = None
+    aborted = None
+
+    try:
+        response = requests.post(api_url, headers=headers, json=payload, stream=True)
+    except requests.RequestException as e:
+        logger.warning(f"Request failed: {e}")
+        return CompletionResponse()
+
+    with response:
+        if response.status_code != 200:
+            logger.warning(f"Request failed with status code {response.status_code}: {response.text}")
+            return CompletionResponse(status_code=response.status_code)
+
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                if chunk.get("usage", None):
+                    usage = chunk["usage"]
+
+                for choice in chunk.get("choices", []):
+                    delta = (choice.get("delta", None) or {}).get("content", None)
+                    if not delta:
+                        continue
+
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+
+                    streamed_chunks += 1
+                    content_parts.append(delta)
+
+                    if validator is not None:
+                        validator.feed(delta)
+
+                    if max_stream_chunks is not None and streamed_chunks > max_stream_chunks:
+                        raise StreamAborted(f"Stream exceeded {max_stream_chunks} chunks.")
+
+        except StreamAborted as e:
+            aborted = str(e)
+            logger.info(f"Stream aborted after {streamed_chunks} chunks: {aborted}")
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Stream failed after {streamed_chunks} chunks: {e}")
+            aborted = str(e)
+
+    end_time = time.perf_counter()
+
+    # Without the usage (aborted streams), each chunk is counted as one token
+    completion_tokens = usage.get("completion_tokens", streamed_chunks) if usage is not None else streamed_chunks
+    timings = {
+        "request_time": end_time - start_time,
+        "time_to_first_token": first_token_time - start_time if first_token_time is not None else None,
+        "tokens_per_second": completion_tokens / (end_time - first_token_time) if first_token_time is not None and end_time > first_token_time else None
+    }
+    logger.debug(f"Stream of {completion_tokens} tokens, time to first token {timings['time_to_first_token']}, "
+                 f"{timings['tokens_per_second']} tokens/s.")
+
+    if aborted is not None:
+        return CompletionResponse(usage=usage, status_code=response.status_code, timings=timings, aborted=aborted)
+
+    return CompletionResponse(content="".join(content_parts), usage=usage, status_code=response.status_code, timings=timings)
+
+
+class OpenAICompletionsClient:
+    def __init__(self, api_url, api_key, model, response_schema, max_tokens=None, stream=False, max_stream_chunks=None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.response_schema = response_schema
+        self.max_tokens = max_tokens
+        self.stream = stream
+        self.max_stream_chunks = max_stream_chunks
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def complete(self, prompt: str, image_base64: str | list[str], response_schema=None, max_tokens=None) -> CompletionResponse:
+        # Several images (regions of one page) follow the prompt in the given order, the schema and the completion
+        # tokens of the client can be overridden for such requests
+        images_base64 = image_base64 if isinstance(image_base64, list) else [image_base64]
+        response_schema = response_schema if response_schema is not None else self.response_schema
+        max_tokens = max_tokens if max_tokens is not None else self.max_tokens
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+
+        payload = {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ] + [
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:image/jpeg;base64,{image}"
+                            }
+                        } for image in images_base64
+                    ]
+                }
+            ],
+            "text": {
+                "format": {
+                    "type": "json_schema",
+                    "name": "response_schema",
+                    "strict": True,
+                    "schema": response_schema
+                }
+            }
+        }
+
+        if max_tokens is not None:
+            payload["max_completion_tokens"] = max_tokens
+
+        if self.stream:
+            return stream_completion(self.api_url, headers, payload, response_schema=response_schema,
+                                     max_stream_chunks=self.max_stream_chunks, logger=self.logger)
+
+        start_time = time.perf_counter()
+        try:
+            response = requests.post(self.api_url, headers=headers, json=payload)
+        except requests.RequestException as e:
+            self.logger.warning(f"Request failed: {e}")
+            return CompletionResponse()
+
+        if response.status_code != 200:
+            self.logger.warning(f"Request failed with status code {response.status_code}: {response.text}")
+            return CompletionResponse(status_code=response.status_code)
+
+        try:
+            response_json = response.json()
+            content = response_json["choices"][0]["message"]["content"]
+        except Exception as e:
+            self.logger.info(f"Unexpected response: {e}")
+            return CompletionResponse(status_code=response.status_code)
+
+        return CompletionResponse(content=content, usage=response_json.get("usage", None), status_code=response.status_code,
+                                  timings={"request_time": time.perf_counter() - start_time})
+
+
+_worker_client: OpenAICompletionsClient | None = None
+
+
+def init_request_worker(client):
+    global _worker_client
+    _worker_client = client
+
+
+def complete_in_worker(request):
+    return _worker_client.complete(*request)
+
+
+class LLMRequestExecutor:
+    # The processes are created on the first request and kept for all the following pages and retries, they receive
+    # the client once and then only the prompts with base64 encoded JPEG images. They are spawned rather than forked,
+    # as the page parser may run engines on threads.
+    def __init__(self, client: OpenAICompletionsClient, num_processes=1):
+        self.client = client
+        self.num_processes = num_processes
+        self.executor: ProcessPoolExecutor | None = None
+
+    def map(self, requests: list[tuple]) -> list[CompletionResponse]:
+        if self.num_processes <= 1 or len(requests) <= 1:
+            return [self.client.complete(*request) for request in requests]
+
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.num_processes,
+                                                mp_context=get_context("spawn"),
+                                                initializer=init_request_worker,
+                                                initargs=(self.client,))
+
+        return list(self.executor.map(complete_in_worker, requests))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
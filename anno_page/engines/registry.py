@@ -0,0 +1,57 @@
+import logging
+import importlib
+
+from importlib.metadata import entry_points
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = "anno_page.engines"
+
+BUILTIN_ENGINES = {
+    "YOLO_DETECTION": "anno_page.engines.detection:YoloDetectionEngine",
+    "HUGGINGFACE_IMAGE_EMBEDDING": "anno_page.engines.embedding:HuggingfaceImageEmbeddingEngine",
+    "OPENAI_COMPLETIONS_IMAGE_CAPTIONING": "anno_page.engines.captioning:OpenAICompletionsImageCaptioningEngine",
+    "CAPTION_YOLO_NEAREST": "anno_page.engines.captioning:CaptionYoloNearestEngine",
+    "CAPTION_YOLO_ORGANIZER": "anno_page.engines.captioning:CaptionYoloOrganizerEngine",
+    "CAPTION_YOLO_KEYPOINTS": "anno_page.engines.captioning:CaptionYoloKeypointsEngine",
+    "INITIAL_RECOGNITION": "anno_page.engines.initial:InitialRecognitionEngine",
+}
+
+_engine_registry: dict | None = None
+
+
+def get_engine_registry() -> dict:
+    global _engine_registry
+
+    if _engine_registry is None:
+        registry = dict(BUILTIN_ENGINES)
+
+        # Third-party packages register their engines under the METHOD name, e.g. in pyproject.toml:
+        # [project.entry-points."anno_page.engines"]
+        # MY_METHOD = "my_package.engines:MyEngine"
+        for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+            if entry_point.name in registry and registry[entry_point.name] != entry_point.value:
+                logger.warning(f"Engine '{entry_point.value}' registered for method '{entry_point.name}' is ignored, "
+                               f"the method is already registered for '{registry[entry_point.name]}'.")
+                continue
+
+            registry[entry_point.name] = entry_point.value
+
+        _engine_registry = registry
+
+    return _engine_registry
+
+
+def register_engine(method, engine):
+    get_engine_registry()[method] = engine
+
+
+def load_engine_class(method):
+    engine = get_engine_registry().get(method, None)
+
+    if isinstance(engine, str):
+        module_name, _, class_name = engine.partition(":")
+        engine = getattr(importlib.import_module(module_name), class_name)
+        _engine_registry[method] = engine
+
+    return engine
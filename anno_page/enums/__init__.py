@@ -1,3 +1,4 @@
 from .category import Category
 from .language import Language
 from .line_relation import LineRelation
+from .layout_data import LayoutData
@@ -0,0 +1,10 @@
+from enum import IntEnum
+
+
+class LayoutData(IntEnum):
+    REGIONS = 1
+    LINES = 2
+    CAPTION_LINES = 3
+    IMAGE_CAPTIONS = 4
+    INITIALS = 5
+    EMBEDDINGS = 6
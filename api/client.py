@@ -1,7 +1,13 @@
 import os
 import json
+import time
+import shutil
+import hashlib
 import logging
 import argparse
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from doc_api.adapter import Adapter
 from doc_api.connector import Connector
@@ -36,6 +42,9 @@ def parse_args():
     parser.add_argument("--output-image-captioning-prompts", action="store_true", help="Whether to output image captioning prompts.")
     parser.add_argument("--image-captioning-settings", type=str, help="Path to image captioning settings JSON or JSON string.", required=False, default=None)
 
+    parser.add_argument("--chunk-size", type=int, default=None, help="If set, the images are submitted as jobs of at most this many pages, the jobs are uploaded, processed and downloaded concurrently and the finished ones are not submitted again when the client is restarted.")
+    parser.add_argument("--parallel-jobs", type=int, default=4, help="Number of chunk jobs transferred and processed concurrently.")
+
     parser.add_argument("--polling-interval", help="Time in seconds to wait between result checks.", required=False, default=1.0, type=float)
     parser.add_argument("--logging-level", help="Logging level.", required=False, type=str, choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default="INFO")
 
@@ -47,6 +56,257 @@ class AnnoPageClient(DocClientWrapper):
     pass
 
 
+CHUNKS_DIR = ".annopage_chunks"
+CHUNKS_STATE_FILE = "state.json"
+CHUNKS_SIGNATURES_FILE = "signatures.json"
+CHUNK_LINKS_FILE = "links.sha256"
+SIGNATURE_BLOCK_SIZE = 1024 ** 2
+
+
+def file_signature(path, signature_cache: dict | None = None) -> str:
+    # SHA-256 of the file content read in blocks. The cache maps the absolute paths to the size and modification time
+    # the hash was computed for, the files that did not change since are not read again
+    stat = os.stat(path)
+    cache_key = os.path.abspath(path)
+    if signature_cache is not None and signature_cache.get(cache_key, [None, None])[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return signature_cache[cache_key][2]
+
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(SIGNATURE_BLOCK_SIZE), b""):
+            file_hash.update(block)
+
+    signature = file_hash.hexdigest()
+    if signature_cache is not None:
+        signature_cache[cache_key] = [stat.st_size, stat.st_mtime_ns, signature]
+
+    return signature
+
+
+def write_json_atomic(path, data):
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+class TransferProgress:
+    # Pages and bytes of the finished chunk jobs, reported with the throughput since the start
+    def __init__(self, total_pages: int, total_bytes: int):
+        self.total_pages = total_pages
+        self.total_bytes = total_bytes
+        self.done_pages = 0
+        self.done_bytes = 0
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def add(self, pages: int, size: int):
+        with self.lock:
+            self.done_pages += pages
+            self.done_bytes += size
+
+            elapsed = max(time.time() - self.start_time, 1e-6)
+            self.logger.info(f"Done {self.done_pages}/{self.total_pages} page(s) "
+                             f"({100 * self.done_pages / max(self.total_pages, 1):.2f} %), "
+                             f"{self.done_bytes / 1024 ** 2:.1f}/{self.total_bytes / 1024 ** 2:.1f} MB of images, "
+                             f"{self.done_pages / elapsed:.2f} pages/s, {self.done_bytes / 1024 ** 2 / elapsed:.2f} MB/s.")
+
+
+def create_chunks(images_dir: str, chunk_size: int, chunks_dir: str,
+                  alto_dir: str | None = None,
+                  page_xml_dir: str | None = None,
+                  meta_file: str | None = None,
+                  signature_cache: dict | None = None) -> list[dict]:
+    # Chunk directories link the images and their XML files, the checksum of a chunk covers the content of its inputs,
+    # so that a chunk is submitted again if they changed since it was processed. Only the chunk directories whose
+    # links or metadata changed are created again.
+    image_names = sorted(file for file in os.listdir(images_dir) if os.path.isfile(os.path.join(images_dir, file)))
+
+    metadata = None
+    if meta_file is not None:
+        with open(meta_file, "r", encoding="utf-8") as file:
+            metadata = json.load(file)
+
+    xml_dir = alto_dir if alto_dir is not None else page_xml_dir
+
+    chunks = []
+    for chunk_index, chunk_start in enumerate(range(0, len(image_names), chunk_size)):
+        chunk_name = f"chunk_{chunk_index:06d}"
+        chunk_dir = os.path.join(chunks_dir, chunk_name)
+        chunk_images = image_names[chunk_start:chunk_start + chunk_size]
+
+        chunk = {
+            "name": chunk_name,
+            "images_dir": os.path.join(chunk_dir, "images"),
+            "xml_dir": os.path.join(chunk_dir, "xml") if xml_dir is not None else None,
+            "meta_file": os.path.join(chunk_dir, "metadata.json") if metadata is not None else None,
+            "result_dir": os.path.join(chunk_dir, "result"),
+            "page_ids": [os.path.splitext(name)[0] for name in chunk_images],
+            "pages": len(chunk_images),
+            "size": sum(os.path.getsize(os.path.join(images_dir, name)) for name in chunk_images)
+        }
+
+        chunk_hash = hashlib.sha256()
+        links = []
+        for image_name in chunk_images:
+            links.append((os.path.abspath(os.path.join(images_dir, image_name)), os.path.join(chunk["images_dir"], image_name)))
+            chunk_hash.update(f"{image_name}:{file_signature(links[-1][0], signature_cache)}\n".encode("utf-8"))
+
+            xml_name = os.path.splitext(image_name)[0] + ".xml"
+            if xml_dir is not None and os.path.isfile(os.path.join(xml_dir, xml_name)):
+                links.append((os.path.abspath(os.path.join(xml_dir, xml_name)), os.path.join(chunk["xml_dir"], xml_name)))
+                chunk_hash.update(f"{xml_name}:{file_signature(links[-1][0], signature_cache)}\n".encode("utf-8"))
+
+        chunk_metadata = None
+        if metadata is not None:
+            chunk_metadata = {name: metadata[name] for name in chunk_images if name in metadata}
+            chunk_hash.update(json.dumps(chunk_metadata, sort_keys=True).encode("utf-8"))
+
+        chunk["checksum"] = chunk_hash.hexdigest()
+        chunks.append(chunk)
+
+        links_file = os.path.join(chunk_dir, CHUNK_LINKS_FILE)
+        links_checksum = hashlib.sha256(json.dumps([chunk["checksum"], links, chunk["meta_file"]]).encode("utf-8")).hexdigest()
+        if os.path.isfile(links_file):
+            with open(links_file, "r", encoding="utf-8") as file:
+                if file.read() == links_checksum:
+                    continue
+
+        for directory in (chunk["images_dir"], chunk["xml_dir"]):
+            if directory is not None:
+                shutil.rmtree(directory, ignore_errors=True)
+                os.makedirs(directory)
+
+        for target_path, link_path in links:
+            os.symlink(target_path, link_path)
+
+        if chunk_metadata is not None:
+            with open(chunk["meta_file"], "w", encoding="utf-8") as file:
+                json.dump(chunk_metadata, file, ensure_ascii=False)
+
+        with open(links_file, "w", encoding="utf-8") as file:
+            file.write(links_checksum)
+
+    return chunks
+
+
+def is_page_file(file_name, page_ids) -> bool:
+    # Page outputs are named by the page ID ('{id}.xml', '{id}_{region}.jpg', ...), the rest are per job files
+    return any(file_name.startswith(page_id) and file_name[len(page_id):len(page_id) + 1] in ("", ".", "_", "-")
+               for page_id in page_ids)
+
+
+def merge_chunk_result(chunk_result_dir: str, result_dir: str, chunk_name: str, page_ids: list[str],
+                       merged_files: dict[str, str]):
+    # Results of the chunks are moved into the output directory as they finish. Per job files and files already merged
+    # from another chunk are namespaced by the chunk name ('summary.chunk_000001.json'); merged_files maps the merged
+    # paths to their chunks.
+    logger = logging.getLogger(__name__)
+
+    for root, _, file_names in os.walk(chunk_result_dir):
+        target_root = os.path.join(result_dir, os.path.relpath(root, chunk_result_dir))
+        os.makedirs(target_root, exist_ok=True)
+
+        for file_name in file_names:
+            target_path = os.path.join(target_root, file_name)
+
+            collision = merged_files.get(target_path, chunk_name) != chunk_name
+            if collision:
+                logger.warning(f"'{target_path}' is in the results of chunks '{merged_files[target_path]}' and "
+                               f"'{chunk_name}', keeping both.")
+
+            if collision or not is_page_file(file_name, page_ids):
+                stem, extension = os.path.splitext(file_name)
+                target_path = os.path.join(target_root, f"{stem}.{chunk_name}{extension}")
+
+            os.replace(os.path.join(root, file_name), target_path)
+            merged_files[target_path] = chunk_name
+
+    return merged_files
+
+
+def run_chunked_job_pipeline(api_url: str,
+                             api_key: str,
+                             images_dir: str,
+                             result_dir: str,
+                             chunk_size: int,
+                             parallel_jobs: int = 4,
+                             polling_interval: float = 1.0,
+                             alto_dir: str | None = None,
+                             page_xml_dir: str | None = None,
+                             meta_file: str | None = None,
+                             engine_name: str | None = None,
+                             engine_settings: dict | None = None):
+    logger = logging.getLogger(__name__)
+
+    chunks_dir = os.path.join(result_dir, CHUNKS_DIR)
+    os.makedirs(chunks_dir, exist_ok=True)
+
+    state_path = os.path.join(chunks_dir, CHUNKS_STATE_FILE)
+    state = {}
+    if os.path.isfile(state_path):
+        with open(state_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+
+    signatures_path = os.path.join(chunks_dir, CHUNKS_SIGNATURES_FILE)
+    signature_cache = {}
+    if os.path.isfile(signatures_path):
+        with open(signatures_path, "r", encoding="utf-8") as file:
+            signature_cache = json.load(file)
+
+    chunks = create_chunks(images_dir, chunk_size, chunks_dir, alto_dir=alto_dir, page_xml_dir=page_xml_dir,
+                           meta_file=meta_file, signature_cache=signature_cache)
+    write_json_atomic(signatures_path, signature_cache)
+    settings_checksum = hashlib.sha256(json.dumps([engine_name, engine_settings], sort_keys=True).encode("utf-8")).hexdigest()
+
+    pending_chunks = [chunk for chunk in chunks if state.get(chunk["name"], None) != [chunk["checksum"], settings_checksum]]
+    logger.info(f"Submitting {len(pending_chunks)} of {len(chunks)} chunk job(s), the others are already done.")
+
+    progress = TransferProgress(sum(chunk["pages"] for chunk in pending_chunks), sum(chunk["size"] for chunk in pending_chunks))
+    state_lock = threading.Lock()
+    merged_files = {}
+
+    def run_chunk(chunk):
+        # Every chunk has its own client (and connection), the jobs are uploaded, polled and downloaded independently
+        connector = Connector(api_key, user_agent="AnnoPageClient/1.0")
+        client = AnnoPageClient(api_url=api_url, connector=connector, polling_interval=polling_interval)
+
+        shutil.rmtree(chunk["result_dir"], ignore_errors=True)
+        client.run_job_pipeline(
+            images_dir=chunk["images_dir"],
+            result_dir=chunk["result_dir"],
+            alto_dir=chunk["xml_dir"] if alto_dir is not None else None,
+            page_xml_dir=chunk["xml_dir"] if page_xml_dir is not None else None,
+            meta_file=chunk["meta_file"],
+            engine_name=engine_name,
+            engine_settings=engine_settings
+        )
+
+        with state_lock:
+            merge_chunk_result(chunk["result_dir"], result_dir, chunk["name"], chunk["page_ids"], merged_files)
+
+            state[chunk["name"]] = [chunk["checksum"], settings_checksum]
+            write_json_atomic(state_path, state)
+
+        progress.add(chunk["pages"], chunk["size"])
+
+    failed_chunks = []
+    with ThreadPoolExecutor(max_workers=parallel_jobs) as executor:
+        futures = {executor.submit(run_chunk, chunk): chunk for chunk in pending_chunks}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Chunk job '{futures[future]['name']}' failed: {e}")
+                failed_chunks.append(futures[future]["name"])
+
+    if failed_chunks:
+        logger.error(f"{len(failed_chunks)} chunk job(s) failed, run the client again to submit them.")
+
+    return len(failed_chunks) == 0
+
+
 def setup_logging(logging_level):
     level = logging.getLevelName(logging_level)
 
@@ -143,6 +403,21 @@ def main():
                                                 output_image_captioning_prompts=args.output_image_captioning_prompts,
                                                 image_captioning_settings=args.image_captioning_settings)
 
+        if args.chunk_size is not None:
+            succeeded = run_chunked_job_pipeline(api_url=args.api_url,
+                                                 api_key=args.api_key,
+                                                 images_dir=args.images,
+                                                 result_dir=args.output,
+                                                 chunk_size=args.chunk_size,
+                                                 parallel_jobs=args.parallel_jobs,
+                                                 polling_interval=args.polling_interval,
+                                                 alto_dir=args.alto_xmls,
+                                                 page_xml_dir=args.page_xmls,
+                                                 meta_file=args.metadata,
+                                                 engine_name=args.engine_name,
+                                                 engine_settings=engine_settings)
+            return 0 if succeeded else 1
+
         client = AnnoPageClient(api_url=args.api_url,
                                 connector=connector,
                                 polling_interval=args.polling_interval)
@@ -4,13 +4,21 @@ import configparser
 import json
 import os
 import sys
+import queue
+import itertools
 import subprocess
 import shutil
+import threading
+import time
 
 from typing import Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
 from logging.handlers import TimedRotatingFileHandler
 
 from anno_page.core.utils import compose_path
+from anno_page.core.engine_packages import create_engine_overlay, verify_engine_dir, EngineVerificationError
 
 from doc_api.api.schemas.base_objects import Job
 from doc_api.connector import Connector
@@ -18,6 +26,16 @@ from doc_worker.doc_worker_wrapper import DocWorkerWrapper, WorkerResponse
 
 logger = logging.getLogger(__name__)
 
+# Jobs with these engines spend most of their time waiting for the LLM APIs, the others on the GPU (the network-bound
+# jobs still run their detection on the GPU)
+NETWORK_BOUND_METHODS = {"OPENAI_COMPLETIONS_IMAGE_CAPTIONING"}
+
+JOB_KIND_GPU = "gpu"
+JOB_KIND_NETWORK = "network"
+
+# The job slots may use the same engine, its recorded hashes are written by one of them at a time
+_engine_verification_lock = threading.Lock()
+
 
 def parse_arguments():
     logger.info(' '.join(sys.argv))
@@ -40,6 +58,13 @@ def parse_arguments():
     parser.add_argument("--log-file-path", type=str, default=None, required=False, help="Path to a directory where log files will be stored")
 
     parser.add_argument("--device", choices=["gpu", "cpu"], default="gpu")
+    parser.add_argument("--job-slots", type=int, default=1, help="Number of jobs processed concurrently, each slot polls the API for jobs on its own.")
+    parser.add_argument("--gpu-jobs", type=int, default=1, help="Maximal number of concurrently processed GPU-bound jobs (detection, embedding, ...), a slot polls for a job only when one of them is free.")
+    parser.add_argument("--gpu-ids", type=str, default=None, help="Comma separated GPU IDs assigned to the jobs (round-robin), without them each job claims a free GPU on its own.")
+    parser.add_argument("--network-jobs", type=int, default=None, help="Maximal number of concurrently processed jobs dominated by LLM captioning, they run next to the GPU-bound jobs only on the CPU or with --gpu-ids. Defaults to the number of job slots.")
+    parser.add_argument("--min-available-memory", type=int, default=0, help="Available system memory in MB required to start a job.")
+    parser.add_argument("--verify-engines", action="store_true", help="If set, the content hashes of the engine files are recorded on their first use and the later jobs fail if the files do not match them.")
+    parser.add_argument("--log-tail-lines", type=int, default=200, help="Number of the last log lines of the processing kept in memory and reported when a job fails.")
 
     return parser.parse_args()
 
@@ -68,6 +93,153 @@ def setup_logging(logging_level, logging_format="", logging_date_format=None, lo
         root_handler.setFormatter(console_log_formatter)
 
 
+def get_job_kind(config_path: str) -> str:
+    config = configparser.ConfigParser()
+    config.read(config_path)
+
+    methods = {config[section_name]["method"] for section_name in config.sections() if "method" in config[section_name]}
+    return JOB_KIND_NETWORK if methods & NETWORK_BOUND_METHODS else JOB_KIND_GPU
+
+
+def get_available_memory() -> Optional[int]:
+    # In MB, None where /proc/meminfo is not available
+    try:
+        with open("/proc/meminfo", "r") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+
+    return None
+
+
+class JobReservation:
+    def __init__(self, gpu_id: Optional[int]):
+        self.gpu_id = gpu_id
+        self.active = True
+
+
+class JobAdmission:
+    # Shared by the job slots of the worker. The kind of a job is known only after it is taken from the API, so a slot
+    # reserves a GPU place (and waits for enough available memory) before it polls, the jobs are never left waiting
+    # on this node. The place of the next job is reserved only after the previous job released its own one. A network-bound job returns the place to the other slots if it can run next to the GPU-bound jobs,
+    # i.e. on the CPU or on an explicitly assigned GPU. Otherwise it would claim a whole free GPU on its own, so it
+    # keeps the place. The memory is checked by one slot at a time, the starting job is not accounted for by the next
+    # check.
+    def __init__(self, gpu_jobs: int = 1, network_jobs: int = 1, min_available_memory: int = 0,
+                 gpu_ids: Optional[list[int]] = None, share_gpus: bool = False, check_interval: float = 5.0):
+        self.gpu_places = queue.Queue()
+        for index in range(gpu_jobs):
+            self.gpu_places.put(gpu_ids[index % len(gpu_ids)] if gpu_ids else None)
+
+        self.network_semaphore = threading.BoundedSemaphore(network_jobs)
+        self.share_gpus = share_gpus
+        self.shared_gpu_ids = itertools.cycle(gpu_ids) if gpu_ids else None
+        self.shared_gpu_ids_lock = threading.Lock()
+
+        self.min_available_memory = min_available_memory
+        self.check_interval = check_interval
+        self.memory_lock = threading.Lock()
+
+    def reserve(self) -> JobReservation:
+        reservation = JobReservation(self.gpu_places.get())
+
+        with self.memory_lock:
+            while True:
+                available_memory = get_available_memory()
+                if available_memory is None or available_memory >= self.min_available_memory:
+                    break
+
+                logger.info(f"Waiting for memory to poll for a job: {available_memory} MB available, "
+                            f"{self.min_available_memory} MB required.")
+                time.sleep(self.check_interval)
+
+        return reservation
+
+    def release(self, reservation: JobReservation):
+        if reservation.active:
+            reservation.active = False
+            self.gpu_places.put(reservation.gpu_id)
+
+    @contextmanager
+    def admit(self, reservation: JobReservation, job_kind: str):
+        # Yields the GPU ID for the job (None for any free GPU or the CPU)
+        if job_kind == JOB_KIND_NETWORK and self.share_gpus and self.network_semaphore.acquire(blocking=False):
+            self.release(reservation)
+            try:
+                if self.shared_gpu_ids is None:
+                    yield None
+                else:
+                    with self.shared_gpu_ids_lock:
+                        gpu_id = next(self.shared_gpu_ids)
+                    yield gpu_id
+            finally:
+                self.network_semaphore.release()
+        else:
+            try:
+                yield reservation.gpu_id
+            finally:
+                self.release(reservation)
+
+
+class JobProcessMonitor:
+    # Reads the page progress lines (standard output) and the logs (standard error) of the processing while it runs.
+    # All log lines are passed to the logger as they come, only the last ones are kept in memory for the failure report.
+    def __init__(self, process: subprocess.Popen, on_page_done=None, log_tail_lines=200):
+        self.process = process
+        self.on_page_done = on_page_done
+        self.log_tail = deque(maxlen=log_tail_lines)
+
+        self.done_count = 0
+        self.succeeded_count = 0
+        self.total_count = None
+
+    def read_progress(self):
+        for line in self.process.stdout:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.debug(f"Stdout: {line.rstrip()}")
+                continue
+
+            # A line that is not a progress record or a failing callback must not stop the reading, the processing
+            # would block on the full pipe
+            try:
+                done, total, succeeded = record["done"], record["total"], record["succeeded"]
+            except (TypeError, KeyError, IndexError):
+                logger.debug(f"Stdout: {line.rstrip()}")
+                continue
+
+            self.done_count = done
+            self.total_count = total
+            self.succeeded_count += 1 if succeeded else 0
+
+            if self.on_page_done is not None:
+                try:
+                    self.on_page_done(record)
+                except Exception as e:
+                    logger.error(f"Handling of the progress record '{line.rstrip()}' failed: {e}")
+
+    def read_logs(self):
+        for line in self.process.stderr:
+            line = line.rstrip()
+            self.log_tail.append(line)
+            logger.debug(f"Stderr: {line}")
+
+    def wait(self) -> int:
+        threads = [threading.Thread(target=self.read_progress, daemon=True),
+                   threading.Thread(target=self.read_logs, daemon=True)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return self.process.wait()
+
+
 class AnnoPageWorker(DocWorkerWrapper):
     def __init__(self,
                  api_url: str,
@@ -79,7 +251,10 @@ class AnnoPageWorker(DocWorkerWrapper):
                  cleanup_job_dir: bool = False,
                  cleanup_old_engines: bool = False,
                  download_engine_using_stream: bool = False,
-                 device="cpu"):
+                 device="cpu",
+                 log_tail_lines: int = 200,
+                 admission: Optional[JobAdmission] = None,
+                 verify_engines: bool = False):
         super().__init__(
             api_url=api_url,
             connector=connector,
@@ -93,6 +268,18 @@ class AnnoPageWorker(DocWorkerWrapper):
         )
 
         self.device = device
+        self.log_tail_lines = log_tail_lines
+        self.admission = admission if admission is not None else JobAdmission()
+        self.verify_engines = verify_engines
+        self.reservation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job_reservation")
+        self.next_reservation: Optional[Future] = None
+
+    def start(self):
+        # The slot polls for the first job only with a reserved place. The place of the next job is reserved in the
+        # background once a job finishes, its response, result upload and status report do not wait for it.
+        self.next_reservation = self.reservation_executor.submit(self.admission.reserve)
+        self.next_reservation.result()
+        super().start()
 
     def process_job(self,
                     job: Job,
@@ -105,21 +292,33 @@ class AnnoPageWorker(DocWorkerWrapper):
                     engine_dir: Optional[str] = None) -> WorkerResponse:
         config_path = os.path.join(engine_dir, "config.ini")
 
+        if self.verify_engines:
+            try:
+                with _engine_verification_lock:
+                    verify_engine_dir(engine_dir)
+            except EngineVerificationError as e:
+                logger.error(f"Job {job.id}: {e}")
+                return WorkerResponse.fail(f"Engine verification failed: {e}")
+
         engine_settings = job.engine_settings if job.engine_settings else {}
         outputs_settings = engine_settings.get("outputs", {})
         image_captioning_settings = engine_settings.get("image_captioning", {})
 
         if image_captioning_settings:
-            config_path = self.copy_engine_to_job_dir(engine_dir)
+            config_path = self.create_engine_overlay_in_job_dir(engine_dir)
             self.update_image_captioning_config(image_captioning_settings, config_path)
 
+        # The manifest in the job directory lets a job that failed midway continue from its last finished page
         process_env = os.environ.copy()
         process_params = [
             "annopage",
             "--config", config_path,
             "--input-image-path", images_dir,
             "--logging-level", logging.getLevelName(logger.getEffectiveLevel()),
-            "--device", self.device
+            "--device", self.device,
+            "--manifest-path", os.path.join(self.get_job_data_path(), "manifest.sqlite"),
+            "--skip-processed",
+            "--progress-jsonl"
         ]
 
         if job.alto_required:
@@ -149,25 +348,54 @@ class AnnoPageWorker(DocWorkerWrapper):
         if outputs_settings.get("image_captioning_prompts", False):
             process_params += ["--output-image-captioning-prompts-path", os.path.join(result_dir, "image_captioning_prompts")]
 
+        job_kind = get_job_kind(config_path)
+
+        # DocWorkerWrapper has no hook before it leases the next job, a job leased before its place is free waits here
+        reservation = self.next_reservation.result()
+        try:
+            with self.admission.admit(reservation, job_kind) as gpu_id:
+                logger.info(f"Job {job.id} is {job_kind}-bound, started on {'GPU ' + str(gpu_id) if gpu_id is not None else self.device}.")
+                if gpu_id is not None:
+                    process_params += ["--gpu-id", str(gpu_id)]
+
+                return self.run_processing(job, process_params, process_env)
+        finally:
+            self.admission.release(reservation)
+            self.next_reservation = self.reservation_executor.submit(self.admission.reserve)
+
+    def run_processing(self, job: Job, process_params: list[str], process_env: dict) -> WorkerResponse:
         process = subprocess.Popen(
             process_params,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             env=process_env,
-            text=True
+            text=True,
+            bufsize=1
         )
 
-        stdout, stderr = process.communicate()
-
-        if process.returncode != 0:
-            logger.error(f"Job {job.id} processing failed with return code {process.returncode}")
-            logger.error(f"Stdout: {stdout}")
-            logger.error(f"Stderr: {stderr}")
-            result = WorkerResponse.fail(f"AnnoPage processing failed with return code {process.returncode}")
+        os.makedirs(self.get_job_data_path(), exist_ok=True)
+        completed_pages_path = os.path.join(self.get_job_data_path(), "completed_pages.jsonl")
+        with open(completed_pages_path, "a", encoding="utf-8") as completed_pages_file:
+            def on_page_done(record):
+                # The list of finished pages with their outputs is kept up to date in the job data, so that they can
+                # be recovered from a job that fails later
+                completed_pages_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                completed_pages_file.flush()
+
+                logger.info(f"Job {job.id}: {record['done']}/{record['total']} page(s) processed "
+                            f"({100 * record['done'] / record['total']:.2f} %), last: '{record['file_id']}'"
+                            f"{'' if record['succeeded'] else ' (failed)'}.")
+
+            monitor = JobProcessMonitor(process, on_page_done=on_page_done, log_tail_lines=self.log_tail_lines)
+            return_code = monitor.wait()
+
+        if return_code != 0:
+            logger.error(f"Job {job.id} processing failed with return code {return_code} after {monitor.done_count} page(s)")
+            logger.error("Last log lines:\n" + "\n".join(monitor.log_tail))
+            result = WorkerResponse.fail(f"AnnoPage processing failed with return code {return_code} "
+                                         f"after {monitor.succeeded_count} successfully processed page(s)")
         else:
-            logger.info(f"Job {job.id} processed successfully.")
-            logger.debug(f"Stdout: {stdout}")
-            logger.debug(f"Stderr: {stderr}")
+            logger.info(f"Job {job.id} processed successfully ({monitor.succeeded_count}/{monitor.done_count} page(s)).")
             result = WorkerResponse.ok()
 
         return result
@@ -207,15 +435,36 @@ class AnnoPageWorker(DocWorkerWrapper):
                         if key in config_prompt_settings:
                             config_prompt_settings[key] = value
 
+                    # Prompt settings outside of the engine directory are shared, the job gets a copy of its own
+                    if os.path.relpath(os.path.abspath(config_prompt_settings_path), os.path.abspath(engine_dir)).startswith(os.pardir):
+                        config_prompt_settings_filename = f"{section_name}_{os.path.basename(config_prompt_settings_path)}"
+                        config_prompt_settings_path = os.path.join(engine_dir, config_prompt_settings_filename)
+                        config.set(section_name, "PROMPT_SETTINGS", config_prompt_settings_filename)
+
                     with open(config_prompt_settings_path, "w", encoding="utf-8") as prompt_file:
                         json.dump(config_prompt_settings, prompt_file, indent=4)
 
         with open(config_path, "w", encoding="utf-8") as config_file:
             config.write(config_file)
 
-    def copy_engine_to_job_dir(self, engine_dir: str) -> str:
+    def create_engine_overlay_in_job_dir(self, engine_dir: str) -> str:
+        # Only the config and the prompt settings inside the engine directory are copied (they are rewritten with the
+        # job settings), the models and weights are linked
+        config = configparser.ConfigParser()
+        config.read(os.path.join(engine_dir, "config.ini"))
+
+        overridden_files = ["config.ini"]
+        for section_name in config.sections():
+            prompt_settings_filename = config[section_name].get("PROMPT_SETTINGS", None)
+            if prompt_settings_filename is not None and not os.path.isabs(prompt_settings_filename) \
+                    and not os.path.normpath(prompt_settings_filename).startswith(os.pardir):
+                overridden_files.append(prompt_settings_filename)
+
         local_engine_dir = os.path.join(self.get_job_data_path(), "engine")
-        shutil.copytree(engine_dir, local_engine_dir)
+        if os.path.exists(local_engine_dir):
+            shutil.rmtree(local_engine_dir)
+
+        create_engine_overlay(engine_dir, local_engine_dir, overridden_files)
         local_config_path = os.path.join(local_engine_dir, "config.ini")
         return local_config_path
 
@@ -240,25 +489,45 @@ def main():
                   logging_date_format=args.logging_date_format,
                   log_file_path=args.log_file_path)
 
-    connector = Connector(args.api_key, user_agent="AnnoPageWorker/1.0")
-    logger.debug("Connector initialized.")
-
-    worker = AnnoPageWorker(
-        api_url=args.api_url,
-        connector=connector,
-        base_dir=args.base_dir,
-        jobs_dir=args.jobs_dir,
-        engines_dir=args.engines_dir,
-        polling_interval=args.polling_interval,
-        cleanup_job_dir=args.cleanup_job_dir,
-        cleanup_old_engines=args.cleanup_old_engines,
-        download_engine_using_stream=True,
-        device=args.device
-    )
-    logger.debug("AnnoPageWorker initialized.")
+    gpu_ids = [int(gpu_id) for gpu_id in args.gpu_ids.split(",")] if args.gpu_ids else None
+    admission = JobAdmission(gpu_jobs=args.gpu_jobs,
+                             network_jobs=args.network_jobs if args.network_jobs is not None else args.job_slots,
+                             min_available_memory=args.min_available_memory,
+                             gpu_ids=gpu_ids if args.device == "gpu" else None,
+                             share_gpus=args.device == "cpu" or gpu_ids is not None)
+
+    # Every slot is a worker of its own (polling, job directory, connector), they share only the admission
+    workers = []
+    for slot_index in range(args.job_slots):
+        connector = Connector(args.api_key, user_agent="AnnoPageWorker/1.0")
+
+        workers.append(AnnoPageWorker(
+            api_url=args.api_url,
+            connector=connector,
+            base_dir=args.base_dir,
+            jobs_dir=args.jobs_dir,
+            engines_dir=args.engines_dir,
+            polling_interval=args.polling_interval,
+            cleanup_job_dir=args.cleanup_job_dir,
+            cleanup_old_engines=args.cleanup_old_engines,
+            download_engine_using_stream=True,
+            device=args.device,
+            log_tail_lines=args.log_tail_lines,
+            admission=admission,
+            verify_engines=args.verify_engines
+        ))
+    logger.debug(f"{len(workers)} AnnoPageWorker(s) initialized.")
 
     logger.debug("Starting worker ...")
-    worker.start()
+    if len(workers) == 1:
+        workers[0].start()
+    else:
+        threads = [threading.Thread(target=worker.start, name=f"job_slot_{slot_index}") for slot_index, worker in enumerate(workers)]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
     logger.debug("Worker finished.")
 
     return 0
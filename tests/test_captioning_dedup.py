@@ -0,0 +1,58 @@
+import os
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("torch")
+
+from anno_page.core.dedup import DuplicateIndex
+from anno_page.engines.captioning import OpenAICompletionsImageCaptioningEngine, PromptBuilderEngine, PromptData
+
+CAPTION = {"caption_cz": None, "caption_en": "Vignette", "description_cz": None, "description_en": None,
+           "topics_cz": None, "topics_en": None, "color_cz": None, "color_en": None}
+
+
+def create_engine(tmp_path):
+    engine = OpenAICompletionsImageCaptioningEngine.__new__(OpenAICompletionsImageCaptioningEngine)
+    engine.logger = SimpleNamespace(info=lambda message: None, warning=lambda message: None)
+    engine.duplicate_index = DuplicateIndex(os.path.join(tmp_path, "dedup.sqlite"))
+    engine.dedup_max_distance = 4
+    engine.prompt_model = "model"
+    engine.prompt_text = {"default": "Describe the {{ element_category }}, page metadata: {{ title }}"}
+    engine.prompt_builder = PromptBuilderEngine()
+    engine.process_image_captions = lambda items: None
+    return engine
+
+
+def create_item(region_id, image_hash, category="Image", prompt=None):
+    region = SimpleNamespace(id=region_id, category=category, graphical_metadata=SimpleNamespace(used_ai_models={}))
+    return PromptData(region=region, image_hash=image_hash, prompt=prompt or "Describe the image.", usage={})
+
+
+def test_dedup_key_depends_on_rendered_prompt(tmp_path):
+    engine = create_engine(tmp_path)
+
+    assert engine.get_dedup_key(create_item("a", 0)) == engine.get_dedup_key(create_item("b", 1))
+    assert engine.get_dedup_key(create_item("a", 0, prompt="Title A")) != engine.get_dedup_key(create_item("b", 0, prompt="Title B"))
+    assert engine.get_dedup_key(create_item("a", 0)) != engine.get_dedup_key(create_item("b", 0, category="Map"))
+
+
+def test_duplicates_within_page_are_captioned_once(tmp_path):
+    engine = create_engine(tmp_path)
+    page_layout = SimpleNamespace(id="page_2", metadata={})
+
+    cached = create_item("cached", 0x00FF00FF00FF00FF)
+    engine.duplicate_index.add(engine.get_dedup_key(cached), cached.image_hash, CAPTION, source="page_1/Image_001")
+
+    data = [create_item("reused", 0x00FF00FF00FF00FE), create_item("first", 0xFFFF0000FFFF0000),
+            create_item("second", 0xFFFF0000FFFF0001), create_item("map", 0xFFFF0000FFFF0000, category="Map"),
+            create_item("captioned", 0xFFFF0000FFFF0000, prompt="Describe the image captioned 'Fig. 1'.")]
+    remaining_data, page_duplicates = engine.reuse_duplicate_captions(data, page_layout)
+
+    assert [item.region.id for item in remaining_data] == ["first", "map", "captioned"]
+    assert [(item.region.id, original.region.id, distance) for item, original, distance in page_duplicates] == [("second", "first", 1)]
+    assert data[0].result.caption_en == "Vignette"
+    assert page_layout.metadata["anno_page_processing"]["OpenAICompletionsImageCaptioningEngine"]["reused"]["deduplicated_from"] == "page_1/Image_001"
+
+    engine.duplicate_index.close()
@@ -0,0 +1,113 @@
+import os
+import json
+
+import pytest
+
+pytest.importorskip("doc_api")
+
+from api import client
+
+
+def create_images(path, names):
+    os.makedirs(path, exist_ok=True)
+    for name in names:
+        with open(os.path.join(path, name), "wb") as file:
+            file.write(name.encode("utf-8"))
+
+
+def test_create_chunks_splits_inputs_and_tracks_changes(tmp_path):
+    create_images(tmp_path / "images", ["a.jpg", "b.jpg", "c.jpg"])
+    with open(tmp_path / "metadata.json", "w", encoding="utf-8") as file:
+        json.dump({"a.jpg": {"title": "A"}, "c.jpg": {"title": "C"}}, file)
+
+    chunks = client.create_chunks(str(tmp_path / "images"), 2, str(tmp_path / "chunks"), meta_file=str(tmp_path / "metadata.json"))
+
+    assert [chunk["page_ids"] for chunk in chunks] == [["a", "b"], ["c"]]
+    assert sorted(os.listdir(chunks[0]["images_dir"])) == ["a.jpg", "b.jpg"]
+    with open(chunks[1]["meta_file"], "r", encoding="utf-8") as file:
+        assert json.load(file) == {"c.jpg": {"title": "C"}}
+
+    # Touched files keep their checksum, the unchanged chunk directories are not created again
+    stat = os.stat(tmp_path / "images" / "c.jpg")
+    os.utime(tmp_path / "images" / "c.jpg", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    link_inodes = [os.lstat(os.path.join(chunk["images_dir"], os.listdir(chunk["images_dir"])[0])).st_ino for chunk in chunks]
+    signature_cache = {}
+    touched_chunks = client.create_chunks(str(tmp_path / "images"), 2, str(tmp_path / "chunks"),
+                                          meta_file=str(tmp_path / "metadata.json"), signature_cache=signature_cache)
+
+    assert [chunk["checksum"] for chunk in touched_chunks] == [chunk["checksum"] for chunk in chunks]
+    assert [os.lstat(os.path.join(chunk["images_dir"], os.listdir(chunk["images_dir"])[0])).st_ino for chunk in chunks] == link_inodes
+    assert len(signature_cache) == 3
+
+    with open(tmp_path / "images" / "c.jpg", "wb") as file:
+        file.write(b"changed")
+    changed_chunks = client.create_chunks(str(tmp_path / "images"), 2, str(tmp_path / "chunks"),
+                                          meta_file=str(tmp_path / "metadata.json"), signature_cache=signature_cache)
+
+    assert changed_chunks[0]["checksum"] == chunks[0]["checksum"]
+    assert changed_chunks[1]["checksum"] != chunks[1]["checksum"]
+
+
+def test_merge_chunk_result_namespaces_per_job_files(tmp_path):
+    merged_files = {}
+    for chunk_name, page_ids in (("chunk_000000", ["a"]), ("chunk_000001", ["b"])):
+        chunk_result_dir = tmp_path / chunk_name
+        os.makedirs(chunk_result_dir / "alto")
+        for name in [f"alto/{page_ids[0]}.xml", "alto/shared.xml", "completed_pages.jsonl"]:
+            with open(chunk_result_dir / name, "w", encoding="utf-8") as file:
+                file.write(chunk_name)
+
+        client.merge_chunk_result(str(chunk_result_dir), str(tmp_path / "result"), chunk_name, page_ids, merged_files)
+
+    assert sorted(os.listdir(tmp_path / "result" / "alto")) == ["a.xml", "b.xml", "shared.chunk_000000.xml", "shared.chunk_000001.xml"]
+    assert sorted(name for name in os.listdir(tmp_path / "result") if name.endswith(".jsonl")) == [
+        "completed_pages.chunk_000000.jsonl", "completed_pages.chunk_000001.jsonl"]
+
+    # A page file merged again from the same chunk (resubmitted chunk) replaces the previous version
+    os.makedirs(tmp_path / "again" / "alto")
+    with open(tmp_path / "again" / "alto" / "a.xml", "w", encoding="utf-8") as file:
+        file.write("again")
+    client.merge_chunk_result(str(tmp_path / "again"), str(tmp_path / "result"), "chunk_000000", ["a"], merged_files)
+
+    with open(tmp_path / "result" / "alto" / "a.xml", "r", encoding="utf-8") as file:
+        assert file.read() == "again"
+
+
+def test_chunked_pipeline_resubmits_only_unfinished_chunks(tmp_path, monkeypatch):
+    create_images(tmp_path / "images", ["a.jpg", "b.jpg", "c.jpg"])
+    submitted = []
+    failing = {"c.jpg"}
+
+    class MockClient:
+        def __init__(self, **kwargs):
+            pass
+
+        def run_job_pipeline(self, images_dir, result_dir, **kwargs):
+            image_names = sorted(os.listdir(images_dir))
+            submitted.append(image_names)
+            if failing.intersection(image_names):
+                raise RuntimeError("Job failed.")
+
+            os.makedirs(os.path.join(result_dir, "alto"))
+            for image_name in image_names:
+                with open(os.path.join(result_dir, "alto", os.path.splitext(image_name)[0] + ".xml"), "w") as file:
+                    file.write(image_name)
+
+    monkeypatch.setattr(client, "Connector", lambda *args, **kwargs: None)
+    monkeypatch.setattr(client, "AnnoPageClient", MockClient)
+
+    arguments = dict(api_url="http://localhost", api_key="key", images_dir=str(tmp_path / "images"),
+                     result_dir=str(tmp_path / "result"), chunk_size=2, parallel_jobs=2)
+
+    assert not client.run_chunked_job_pipeline(**arguments)
+    assert sorted(os.listdir(tmp_path / "result" / "alto")) == ["a.xml", "b.xml"]
+
+    submitted.clear()
+    failing.clear()
+    assert client.run_chunked_job_pipeline(**arguments)
+    assert submitted == [["c.jpg"]]
+    assert sorted(os.listdir(tmp_path / "result" / "alto")) == ["a.xml", "b.xml", "c.xml"]
+
+    submitted.clear()
+    assert client.run_chunked_job_pipeline(**arguments)
+    assert submitted == []
@@ -0,0 +1,79 @@
+import cv2
+import base64
+import threading
+import numpy as np
+
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from anno_page.core.crops import get_crop_store
+
+
+class Region:
+    def __init__(self, id, bounding_box):
+        self.id = id
+        self.bounding_box = bounding_box
+
+    def get_polygon_bounding_box(self):
+        return self.bounding_box
+
+
+class PageLayout:
+    pass
+
+
+def test_crop_store_creates_each_variant_once():
+    image = np.random.default_rng(0).integers(0, 255, size=(400, 300, 3), dtype=np.uint8)
+    page_layout = PageLayout()
+    region = Region("region_1", (10, 20, 210, 120))
+
+    crop_store = get_crop_store(page_layout, image)
+    assert get_crop_store(page_layout, image) is crop_store
+    assert crop_store.crop(region).shape == (100, 200, 3)
+
+    resized = crop_store.resized(region, max_size=50)
+    assert resized.shape == (25, 50, 3)
+    assert crop_store.resized(region, max_size=50) is resized
+    assert crop_store.resized(region, max_size=500) is crop_store.crop(region)
+
+    jpeg = crop_store.jpeg(region, max_size=50)
+    assert crop_store.jpeg(region, max_size=50) is jpeg
+    assert cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), 1).shape == (25, 50, 3)
+    assert base64.b64decode(crop_store.base64(region, max_size=50)) == jpeg
+
+    assert get_crop_store(page_layout, image.copy()) is not crop_store
+
+
+def test_crop_store_variants_are_created_once_by_concurrent_engines():
+    image = np.random.default_rng(0).integers(0, 255, size=(400, 300, 3), dtype=np.uint8)
+    page_layout = PageLayout()
+    region = Region("region_1", (10, 20, 210, 120))
+    barrier = threading.Barrier(8)
+
+    def encode(_):
+        barrier.wait()
+        crop_store = get_crop_store(page_layout, image)
+        return crop_store, crop_store.base64(region, max_size=50)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(encode, range(8)))
+
+    assert all(crop_store is results[0][0] for crop_store, _ in results)
+    assert all(encoded is results[0][1] for _, encoded in results)
+
+
+def test_device_crop_of_large_page_uploads_only_the_crop():
+    torch = pytest.importorskip("torch")
+
+    image = np.random.default_rng(0).integers(0, 255, size=(400, 300, 3), dtype=np.uint8)
+    region = Region("region_1", (10, 20, 210, 120))
+
+    crop_store = get_crop_store(PageLayout(), image)
+    assert torch.equal(crop_store.device_crop(region, "cpu"), torch.from_numpy(crop_store.crop(region)))
+    assert ("cpu", False) in crop_store.device_images
+
+    crop_store = get_crop_store(PageLayout(), image)
+    crop_store.set_proxy(image[::2, ::2], 0.5)
+    assert torch.equal(crop_store.device_crop(region, "cpu"), torch.from_numpy(crop_store.crop(region)))
+    assert ("cpu", False) not in crop_store.device_images
@@ -0,0 +1,61 @@
+import os
+import cv2
+import numpy as np
+
+from anno_page.core.dedup import perceptual_hash, hamming_distance, BKTree, DuplicateIndex
+from anno_page.core.embedding import ProcessingInfo
+
+
+def create_vignette(seed):
+    image = np.full((200, 300, 3), 255, dtype=np.uint8)
+    rng = np.random.default_rng(seed)
+    for _ in range(12):
+        center = tuple(int(value) for value in rng.integers(0, 300, size=2))
+        cv2.circle(image, center, int(rng.integers(10, 60)), (0, 0, 0), thickness=-1)
+
+    return image
+
+
+def test_perceptual_hash_matches_rescanned_copies():
+    image = create_vignette(0)
+
+    rescanned = cv2.resize(image, (450, 300), interpolation=cv2.INTER_CUBIC)
+    rescanned = cv2.imdecode(cv2.imencode('.jpg', rescanned, [int(cv2.IMWRITE_JPEG_QUALITY), 60])[1], 1)
+
+    assert hamming_distance(perceptual_hash(image), perceptual_hash(rescanned)) <= 4
+    assert hamming_distance(perceptual_hash(image), perceptual_hash(create_vignette(1))) > 10
+
+
+def test_bk_tree_search():
+    tree = BKTree()
+    for value in (0b0000, 0b0001, 0b0011, 0b1111, 0b0001):
+        tree.add(value, f"value_{value:04b}")
+
+    assert tree.search(0b0000, 0) == [(0, "value_0000")]
+    assert tree.search(0b0000, 1) == [(0, "value_0000"), (1, "value_0001"), (1, "value_0001")]
+    assert sorted(value for _, value in tree.search(0b0111, 1)) == ["value_0011", "value_1111"]
+
+
+def test_duplicate_index_is_shared_through_the_file(tmp_path):
+    path = os.path.join(tmp_path, "dedup.sqlite")
+    first_index = DuplicateIndex(path)
+    second_index = DuplicateIndex(path)
+
+    first_index.add("caption:model", 0xFFFF0000FFFF0000, {"caption_en": "Vignette"}, source="page_1/Image_001")
+
+    assert second_index.find("caption:model", 0xFFFF0000FFFF0001, max_distance=2) == ({"caption_en": "Vignette"}, "page_1/Image_001", 1)
+    assert second_index.find("caption:other_model", 0xFFFF0000FFFF0000, max_distance=2) is None
+    assert second_index.find("caption:model", 0x0000FFFF0000FFFF, max_distance=2) is None
+
+    first_index.close()
+    second_index.close()
+
+
+def test_deduplicated_from_is_written_only_for_reused_embeddings():
+    processing_info = ProcessingInfo(datetime="2026-01-01T00:00:00", model="model", decimal_places=None, precision="float16")
+    assert "deduplicated_from" not in processing_info.model_dump()
+    assert "deduplicated_from" not in processing_info.model_dump_json()
+    assert processing_info.model_dump()["decimal_places"] is None
+
+    processing_info.deduplicated_from = "page_1/Image_001"
+    assert ProcessingInfo.model_validate_json(processing_info.model_dump_json()).deduplicated_from == "page_1/Image_001"
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("ultralytics")
+pytest.importorskip("transformers")
+
+from PIL import Image
+from ultralytics.data.augment import LetterBox
+from transformers import CLIPImageProcessor
+
+from anno_page.engines.detection import YoloDetector, letterbox_tensor
+from anno_page.engines.embedding import HuggingfaceImageEmbeddingEngine
+
+
+def create_page(height=1000, width=720):
+    # Smooth background with a bright rectangle at x 200-500, y 300-600 (BGR, uint8)
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.stack([x * 100 // width, y * 100 // height, (x + y) * 50 // (width + height)], axis=-1).astype(np.uint8)
+    image[300:600, 200:500] = 240
+    return image
+
+
+class RectangleModel:
+    # Stands in for YOLO, "detects" the bright rectangle in the letterboxed tensor (RGB, 0-1) or in the page itself
+    model = SimpleNamespace(stride=torch.tensor([8.0, 16.0, 32.0]))
+
+    def __call__(self, image, **kwargs):
+        mask = image[0].mean(0) > 0.8 if isinstance(image, torch.Tensor) else torch.from_numpy(image.mean(-1) > 200)
+        ys, xs = torch.nonzero(mask, as_tuple=True)
+        box = torch.tensor([[xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, 0.9, 0]], dtype=torch.float32)
+        return [SimpleNamespace(boxes=SimpleNamespace(data=box))]
+
+
+def test_letterbox_tensor_matches_ultralytics_letterbox():
+    image = create_page()
+
+    tensor, scale, (pad_left, pad_top) = letterbox_tensor(torch.from_numpy(image), 640, stride=32)
+    expected = LetterBox(new_shape=(640, 640), auto=True, stride=32)(image=image)
+    expected = torch.from_numpy(np.ascontiguousarray(expected[..., ::-1].transpose(2, 0, 1))).float() / 255.0
+
+    assert tensor.shape[1:] == expected.shape
+    assert (pad_left, pad_top) == (9, 0)
+    assert (tensor[0] - expected).abs().mean() < 0.01
+
+
+def test_detect_on_device_maps_boxes_as_cpu_detection():
+    image = create_page()
+
+    detector = YoloDetector.__new__(YoloDetector)
+    detector.model = RectangleModel()
+    detector.detection_threshold = 0.2
+    detector.image_size = 640
+    detector.agnostic_nms = False
+
+    device_boxes = detector.detect_on_device(torch.from_numpy(image))
+    cpu_boxes = detector.detect(image).boxes.data
+
+    assert cpu_boxes[0, :4].tolist() == [200, 300, 500, 600]
+    assert (device_boxes[:, :4] - cpu_boxes[:, :4]).abs().max() <= 2
+    assert device_boxes[:, 4:].tolist() == cpu_boxes[:, 4:].tolist()
+
+
+def test_preprocess_on_device_matches_image_processor():
+    image = create_page(300, 500)
+
+    engine = HuggingfaceImageEmbeddingEngine.__new__(HuggingfaceImageEmbeddingEngine)
+    engine.processor = SimpleNamespace(image_processor=CLIPImageProcessor())
+
+    device_inputs = engine.preprocess_on_device(torch.from_numpy(image))
+    cpu_inputs = CLIPImageProcessor()(images=Image.fromarray(image), return_tensors="pt")
+
+    assert device_inputs["pixel_values"].shape == cpu_inputs["pixel_values"].shape
+    assert (device_inputs["pixel_values"] - cpu_inputs["pixel_values"]).abs().mean() < 0.05
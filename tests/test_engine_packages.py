@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from anno_page.core.engine_packages import create_engine_overlay, verify_engine_dir, EngineVerificationError
+
+
+@pytest.fixture
+def engine_dir(tmp_path):
+    engine_dir = os.path.join(tmp_path, "engine")
+    os.makedirs(os.path.join(engine_dir, "prompts"))
+    os.makedirs(os.path.join(engine_dir, "models"))
+
+    files = {
+        "config.ini": "[DETECTION]\nMETHOD = YOLO_DETECTION\n",
+        "prompts/settings.json": "{}",
+        "prompts/template.j2": "{{ caption }}",
+        "models/weights.pt": "weights",
+    }
+
+    for name, content in files.items():
+        with open(os.path.join(engine_dir, name), 'w') as file:
+            file.write(content)
+
+    return engine_dir
+
+
+def test_overlay_copies_only_overridden_files(tmp_path, engine_dir):
+    overlay_dir = create_engine_overlay(engine_dir, os.path.join(tmp_path, "overlay"), ["config.ini", "prompts/settings.json"])
+
+    assert not os.path.islink(os.path.join(overlay_dir, "config.ini"))
+    assert not os.path.islink(os.path.join(overlay_dir, "prompts"))
+    assert not os.path.islink(os.path.join(overlay_dir, "prompts", "settings.json"))
+    assert os.path.islink(os.path.join(overlay_dir, "prompts", "template.j2"))
+    assert os.path.islink(os.path.join(overlay_dir, "models"))
+
+    with open(os.path.join(overlay_dir, "prompts", "settings.json"), 'w') as file:
+        file.write('{"language": "en"}')
+
+    with open(os.path.join(engine_dir, "prompts", "settings.json")) as file:
+        assert file.read() == "{}"
+
+    with open(os.path.join(overlay_dir, "models", "weights.pt")) as file:
+        assert file.read() == "weights"
+
+
+def test_verification_detects_changed_files(engine_dir):
+    hashes = verify_engine_dir(engine_dir)
+    assert sorted(hashes.keys()) == ["config.ini", "models/weights.pt", "prompts/settings.json", "prompts/template.j2"]
+    assert verify_engine_dir(engine_dir) == hashes
+
+    # Only the modification time changed
+    os.utime(os.path.join(engine_dir, "config.ini"), (0, 0))
+    verify_engine_dir(engine_dir)
+
+    with open(os.path.join(engine_dir, "models", "weights.pt"), 'w') as file:
+        file.write("corrupted")
+
+    with pytest.raises(EngineVerificationError):
+        verify_engine_dir(engine_dir)
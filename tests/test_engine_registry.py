@@ -0,0 +1,22 @@
+from anno_page.engines.base import LayoutProcessingEngine
+from anno_page.engines.registry import BUILTIN_ENGINES, get_engine_registry, load_engine_class, register_engine
+
+
+class DummyEngine(LayoutProcessingEngine):
+    def process_page(self, image, page_layout):
+        return page_layout
+
+
+def test_builtin_engines_are_registered():
+    registry = get_engine_registry()
+
+    assert set(BUILTIN_ENGINES.keys()) <= set(registry.keys())
+    assert load_engine_class("UNKNOWN_METHOD") is None
+
+
+def test_registered_engine_is_loaded():
+    register_engine("DUMMY", DummyEngine)
+    assert load_engine_class("DUMMY") is DummyEngine
+
+    register_engine("DUMMY_PATH", f"{__name__}:DummyEngine")
+    assert load_engine_class("DUMMY_PATH") is DummyEngine
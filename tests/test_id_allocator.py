@@ -0,0 +1,63 @@
+from lxml import etree as ET
+
+import pytest
+
+from anno_page.core.id_allocator import IdAllocator, get_element_id_allocator, element_id_allocators
+
+
+def test_next_id_fills_gaps_in_existing_ids():
+    allocator = IdAllocator(existing_ids=["image_001", "image_003"])
+
+    assert allocator.next_id(prefix="image_", padding=3) == "image_002"
+    assert allocator.next_id(prefix="image_", padding=3) == "image_004"
+    assert allocator.next_id(prefix="image_", padding=3) == "image_005"
+
+
+def test_next_id_keeps_prefixes_independent():
+    allocator = IdAllocator()
+
+    assert allocator.next_id(prefix="MODS_PICT_", padding=4) == "MODS_PICT_0001"
+    assert allocator.next_id(prefix="map_", padding=3) == "map_001"
+    assert allocator.next_id(prefix="MODS_PICT_", padding=4) == "MODS_PICT_0002"
+
+
+def test_next_id_respects_ids_reserved_after_allocation():
+    allocator = IdAllocator()
+
+    assert allocator.next_id(prefix="page_CB", padding=4) == "page_CB0001"
+    allocator.reserve("page_CB0002")
+    assert allocator.next_id(prefix="page_CB", padding=4) == "page_CB0003"
+
+
+def test_from_element_collects_ids_in_single_pass():
+    print_space = ET.Element("PrintSpace")
+    composed_block = ET.SubElement(print_space, "ComposedBlock", ID="page_CB0001")
+    ET.SubElement(composed_block, "GraphicalElement", ID="page_GE0001")
+    ET.SubElement(print_space, "ComposedBlock", ID="page_CB0002")
+
+    allocator = IdAllocator.from_element(print_space)
+
+    assert allocator.next_id(prefix="page_CB", padding=4) == "page_CB0003"
+    assert allocator.next_id(prefix="page_GE", padding=4) == "page_GE0002"
+
+
+def test_element_allocators_are_kept_per_print_space_within_export():
+    first_print_space = ET.Element("PrintSpace")
+    ET.SubElement(first_print_space, "ComposedBlock", ID="page_CB0001")
+    second_print_space = ET.Element("PrintSpace")
+
+    with element_id_allocators():
+        allocator = get_element_id_allocator(first_print_space)
+        assert get_element_id_allocator(first_print_space) is allocator
+        assert allocator.next_id(prefix="page_CB", padding=4) == "page_CB0002"
+        assert get_element_id_allocator(second_print_space).next_id(prefix="page_CB", padding=4) == "page_CB0001"
+
+    assert get_element_id_allocator(first_print_space) is not allocator
+
+    with pytest.raises(RuntimeError):
+        with element_id_allocators():
+            allocator = get_element_id_allocator(first_print_space)
+            raise RuntimeError("Export failed.")
+
+    with element_id_allocators():
+        assert get_element_id_allocator(first_print_space) is not allocator
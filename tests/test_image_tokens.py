@@ -0,0 +1,47 @@
+from anno_page.core.image_tokens import TileTokenModel, PatchTokenModel, ResolutionPolicy, fit_to_token_budget
+
+
+def test_tile_token_model_matches_provider_resize():
+    token_model = TileTokenModel()
+
+    assert token_model.provider_size(4096, 8192) == (768, 1536)
+    assert token_model.tokens(4096, 8192) == 85 + 170 * 2 * 3
+    assert token_model.tokens(100, 60) == 85 + 170
+
+
+def test_patch_token_model_caps_patches():
+    token_model = PatchTokenModel(patch_size=32, max_patches=1536, token_multiplier=1.62)
+
+    width, height = token_model.provider_size(1800, 2400)
+    assert token_model.patches(width, height) <= 1536
+    assert token_model.tokens(1800, 2400) <= round(1536 * 1.62)
+    assert token_model.tokens(64, 32) == 4
+
+
+def test_fit_to_token_budget_snaps_to_tiles():
+    token_model = PatchTokenModel(patch_size=32, max_patches=None)
+
+    assert fit_to_token_budget(token_model, 100, 50, max_tokens=None) == (100, 50, 8)
+
+    width, height, tokens = fit_to_token_budget(token_model, 1000, 500, max_tokens=100)
+    assert tokens <= 100
+    assert width % 32 == 0 or height % 32 == 0
+    assert fit_to_token_budget(token_model, width + 32, height + 16, max_tokens=100)[2] <= 100
+
+
+def test_resolution_policy_per_category_and_model():
+    settings = {
+        "token_model": {"type": "tiles"},
+        "max_tokens": 765,
+        "jpeg_quality": 90,
+        "categories": {"Initial": {"max_tokens": 255, "jpeg_quality": 80}},
+        "models": {"small-model": {"token_model": {"type": "patches"}, "categories": {"Initial": {"max_tokens": 64}}}}
+    }
+
+    policy = ResolutionPolicy.from_settings(settings, model_name="large-model")
+    assert policy.select("initial", 300, 300) == ((300, 300), 80, 255)
+    assert policy.select("map", 3000, 2000)[2] <= 765
+
+    policy = ResolutionPolicy.from_settings(settings, model_name="small-model", max_image_size=200)
+    (width, height), quality, tokens = policy.select("Initial", 600, 600)
+    assert (width, height, quality, tokens) == (200, 200, 80, 49)
@@ -0,0 +1,69 @@
+import os
+import cv2
+import tifffile
+import numpy as np
+
+from PIL import Image
+
+from anno_page.core.images import get_image_size, get_cache_file_name, load_large_image
+
+
+def test_large_image_is_memory_mapped_with_proxy(tmp_path):
+    image = np.random.default_rng(0).integers(0, 255, size=(600, 1000, 3), dtype=np.uint8)
+    image_path = os.path.join(tmp_path, "page.png")
+    cv2.imwrite(image_path, image)
+
+    max_image_pixels = Image.MAX_IMAGE_PIXELS
+    assert get_image_size(image_path) == (600, 1000)
+    assert Image.MAX_IMAGE_PIXELS == max_image_pixels
+
+    cache_path = os.path.join(tmp_path, "cache")
+    os.makedirs(cache_path)
+
+    large_image = load_large_image(image_path, page_size=(600, 1000), proxy_max_size=250, cache_path=cache_path)
+    assert isinstance(large_image.image, np.memmap)
+    assert np.array_equal(large_image.image[10:20, 30:40], image[10:20, 30:40])
+    assert large_image.proxy.shape == (150, 250, 3)
+    assert large_image.proxy_scale == 0.25
+    large_image.close()
+
+    assert os.path.isfile(os.path.join(cache_path, get_cache_file_name(image_path)))
+    assert get_cache_file_name(image_path) != get_cache_file_name(os.path.join(tmp_path, "other", "page.png"))
+
+    large_image = load_large_image(image_path, page_size=(300, 500), proxy_max_size=1000)
+    assert large_image.image.shape == (300, 500, 3)
+    assert large_image.proxy.shape == (300, 500, 3)
+
+    cache_file = large_image.cache_file
+    large_image.close()
+    assert not os.path.isfile(cache_file)
+
+
+def test_large_image_decodes_tiff_to_cache_and_jpeg_proxy_reduced(tmp_path):
+    y, x = np.mgrid[0:800, 0:1200]
+    image = np.stack([x % 256, y % 256, (x + y) % 256], axis=-1).astype(np.uint8)
+
+    tiff_path = os.path.join(tmp_path, "page.tif")
+    tifffile.imwrite(tiff_path, image[..., ::-1], photometric="rgb", compression="zlib", rowsperstrip=64)
+
+    large_image = load_large_image(tiff_path, page_size=(800, 1200), proxy_max_size=300)
+    assert np.array_equal(large_image.image, image)
+    assert large_image.proxy.shape == (200, 300, 3)
+
+    # The temporary cache file is kept while a view of the mapped image is alive
+    view = large_image.image[100:200]
+    cache_file = large_image.cache_file
+    large_image.close()
+    assert os.path.isfile(cache_file)
+    del view
+    assert not os.path.isfile(cache_file)
+
+    jpeg_path = os.path.join(tmp_path, "page.jpg")
+    cv2.imwrite(jpeg_path, image, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+
+    with open(jpeg_path, "rb") as file:
+        large_image = load_large_image("page.jpg", page_size=(800, 1200), proxy_max_size=300, data=file.read())
+    expected_proxy = cv2.resize(cv2.imread(jpeg_path), (300, 200), interpolation=cv2.INTER_AREA)
+    assert large_image.proxy.shape == (200, 300, 3)
+    assert np.abs(large_image.proxy.astype(int) - expected_proxy).mean() < 3
+    large_image.close()
@@ -0,0 +1,35 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("torch", "transformers", "ultralytics", "pero_ocr", "cv2", "shapely", "jinja2")
+IMPORT_TIME_BUDGET_US = int(os.environ.get("ANNO_PAGE_IMPORT_TIME_BUDGET_US", 1_000_000))
+
+
+def measure_import(module_name):
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                             cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True)
+
+    # Lines in format 'import time: self [us] | cumulative | imported package'
+    imported_modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imported_modules[name.strip()] = int(cumulative)
+
+    return imported_modules
+
+
+@pytest.mark.parametrize("module_name", ["anno_page.engines", "anno_page.core.page_parser", "user_scripts.parse_folder"])
+def test_import_does_not_load_heavy_dependencies(module_name):
+    imported_modules = measure_import(module_name)
+
+    heavy_modules = [name for name in imported_modules if name.split(".")[0] in HEAVY_MODULES]
+    assert heavy_modules == []
+    assert imported_modules[module_name] < IMPORT_TIME_BUDGET_US
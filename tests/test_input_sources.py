@@ -0,0 +1,105 @@
+import os
+import json
+import tarfile
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from anno_page.core.input_sources import open_input_source, DirectorySource, ZipSource, TarSource, ManifestSource, ReadAheadReader
+
+FILES = {
+    "images/page_2.jpg": b"second",
+    "images/page_1.jpg": b"first",
+    "alto/page_1.xml": b"<alto/>",
+}
+
+
+@pytest.fixture
+def files_directory(tmp_path):
+    directory = os.path.join(tmp_path, "files")
+    for name, data in FILES.items():
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(data)
+
+    return directory
+
+
+def check_source(source, expected_class):
+    assert isinstance(source, expected_class)
+    assert source.names() == ["page_2.jpg", "page_1.jpg", "page_1.xml"]
+    assert source.exists("page_1.xml")
+    assert not source.exists("page_3.jpg")
+    assert source.read("page_1.jpg") == b"first"
+    assert source.read("page_2.jpg") == b"second"
+    source.close()
+
+
+def test_zip_source(tmp_path, files_directory):
+    archive_path = os.path.join(tmp_path, "files.zip")
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        for name in FILES:
+            archive.write(os.path.join(files_directory, name), name)
+
+    check_source(open_input_source(archive_path), ZipSource)
+
+
+def test_tar_source(tmp_path, files_directory, monkeypatch):
+    archive_path = os.path.join(tmp_path, "files.tar.gz")
+    with tarfile.open(archive_path, 'w:gz') as archive:
+        for name in FILES:
+            archive.add(os.path.join(files_directory, name), name)
+
+    check_source(open_input_source(archive_path), TarSource)
+
+    # Workers reuse the members listed by the parent, the reads of several threads are serialized
+    index = open_input_source(archive_path).index()
+    monkeypatch.setattr(tarfile.TarFile, "getmembers", lambda archive: pytest.fail("Archive listed again."))
+    source = open_input_source(archive_path, index=index)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        names = ["page_1.jpg", "page_2.jpg", "page_1.xml"] * 20
+        assert list(executor.map(source.read, names)) == [FILES[name] for name in ["images/page_1.jpg", "images/page_2.jpg", "alto/page_1.xml"]] * 20
+
+    check_source(source, TarSource)
+
+
+def test_manifest_source(tmp_path, files_directory):
+    manifest_path = os.path.join(tmp_path, "manifest.jsonl")
+    with open(manifest_path, 'w') as file:
+        file.write(json.dumps(os.path.join("files", "images/page_2.jpg")) + "\n")
+        file.write(json.dumps({"path": os.path.join(files_directory, "images/page_1.jpg")}) + "\n")
+        file.write("\n")
+        file.write(json.dumps(os.path.join("files", "alto/page_1.xml")) + "\n")
+
+    check_source(open_input_source(manifest_path), ManifestSource)
+
+
+def test_directory_source_is_sorted(files_directory):
+    source = open_input_source(os.path.join(files_directory, "images"))
+
+    assert isinstance(source, DirectorySource)
+    assert source.names() == ["page_1.jpg", "page_2.jpg"]
+    assert source.local_path("page_1.jpg") == os.path.join(files_directory, "images", "page_1.jpg")
+
+
+def test_read_ahead_reads_in_order(files_directory):
+    class RecordingSource(DirectorySource):
+        def __init__(self, path):
+            super().__init__(path)
+            self.reads = []
+
+        def read(self, name):
+            self.reads.append(name)
+            return super().read(name)
+
+    source = RecordingSource(os.path.join(files_directory, "images"))
+    reader = ReadAheadReader(source, ["page_2.jpg", "page_1.jpg"], depth=1)
+
+    assert reader.read("page_2.jpg") == b"second"
+    assert reader.read("page_1.jpg") == b"first"
+    reader.close()
+
+    assert source.reads == ["page_2.jpg", "page_1.jpg"]
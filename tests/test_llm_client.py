@@ -0,0 +1,133 @@
+import json
+import threading
+
+import pytest
+
+from user_scripts.mock_llm_server import MockCompletionsSettings, create_server
+from anno_page.engines.llm_client import OpenAICompletionsClient, LLMRequestExecutor, IncrementalJSONValidator, SchemaMismatchError
+
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "caption_en": {"type": "string"},
+        "topics_en": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["caption_en", "topics_en"]
+}
+
+
+def test_request_executor_reuses_worker_processes():
+    server = create_server("127.0.0.1", 0, MockCompletionsSettings(seed=0))
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    try:
+        client = OpenAICompletionsClient(api_url=f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions",
+                                         api_key="key",
+                                         model="mock",
+                                         response_schema=RESPONSE_SCHEMA)
+        executor = LLMRequestExecutor(client, num_processes=2)
+
+        worker_executors = []
+        for _ in range(2):
+            responses = executor.map([(f"Describe image {index}.", b"\xff\xd8\xff\xd9") for index in range(3)])
+
+            assert len(responses) == 3
+            for response in responses:
+                assert response.status_code == 200
+                assert set(json.loads(response.content).keys()) == {"caption_en", "topics_en"}
+                assert response.usage["prompt_tokens"] > 0
+
+            worker_executors.append(executor.executor)
+
+        assert worker_executors[0] is not None and worker_executors[0] is worker_executors[1]
+
+        executor.shutdown()
+        assert executor.executor is None
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_client_sends_several_images_with_overridden_schema():
+    server = create_server("127.0.0.1", 0, MockCompletionsSettings(seed=0, image_tokens=100))
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    try:
+        client = OpenAICompletionsClient(api_url=f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions",
+                                         api_key="key",
+                                         model="mock",
+                                         response_schema=RESPONSE_SCHEMA)
+
+        packed_schema = {"type": "object", "properties": {"results": {"type": "array", "items": RESPONSE_SCHEMA}}}
+        single_response = client.complete("Describe.", "image")
+        packed_response = client.complete("Describe.", ["image", "image", "image"], response_schema=packed_schema)
+
+        assert packed_response.usage["prompt_tokens"] - single_response.usage["prompt_tokens"] == 200
+        assert set(json.loads(packed_response.content).keys()) == {"results"}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_incremental_validator_rejects_off_schema_prefixes():
+    validator = IncrementalJSONValidator(RESPONSE_SCHEMA)
+    for chunk in ['{"capt', 'ion_en": "A \\"quoted\\" map", ', '"topics_en": ["map"', ', "city"]', '}']:
+        validator.feed(chunk)
+        assert not validator.complete or chunk == '}'
+    assert validator.complete
+
+    for prefix in ['```json', '{"caption_en": 1', '{"topics_en": ["map", null', '{"caption_en" "', '{} {']:
+        with pytest.raises(SchemaMismatchError):
+            IncrementalJSONValidator(RESPONSE_SCHEMA).feed(prefix)
+
+    # Options without a type allow any value
+    schema = {"type": "object", "properties": {"value": {"anyOf": [{"enum": [1, "x"]}, {"type": "null"}]}}}
+    for document in ['{"value": 1}', '{"value": "x"}', '{"value": null}']:
+        validator = IncrementalJSONValidator(schema)
+        validator.feed(document)
+        assert validator.complete
+
+
+def test_streamed_completion_is_aborted_early():
+    settings = MockCompletionsSettings(seed=0)
+    server = create_server("127.0.0.1", 0, settings)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    try:
+        def create_client(max_stream_chunks=None):
+            return OpenAICompletionsClient(api_url=f"http://127.0.0.1:{server.server_address[1]}/v1/chat/completions",
+                                           api_key="key",
+                                           model="mock",
+                                           response_schema=RESPONSE_SCHEMA,
+                                           stream=True,
+                                           max_stream_chunks=max_stream_chunks)
+
+        response = create_client().complete("Describe.", "image")
+        assert response.aborted is None
+        assert set(json.loads(response.content).keys()) == {"caption_en", "topics_en"}
+        assert response.usage["completion_tokens"] > 0
+        assert response.timings["time_to_first_token"] is not None and response.timings["tokens_per_second"] > 0
+
+        response = create_client(max_stream_chunks=2).complete("Describe.", "image")
+        assert response.content is None and "exceeded" in response.aborted
+
+        settings.invalid_schema_rate = 1.0
+        response = create_client().complete("Describe.", "image")
+        assert response.content is None and "caption_en" in response.aborted
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.parametrize("distribution", ["uniform", "normal", "lognormal"])
+def test_mock_latency_has_requested_mean_and_std(distribution):
+    settings = MockCompletionsSettings(latency_distribution=distribution, latency_mean=2.0, latency_std=0.5, seed=0)
+    latencies = [settings.sample_latency() for _ in range(20000)]
+
+    mean = sum(latencies) / len(latencies)
+    std = (sum((latency - mean) ** 2 for latency in latencies) / len(latencies)) ** 0.5
+    assert abs(mean - 2.0) < 0.05 and abs(std - 0.5) < 0.05
@@ -0,0 +1,57 @@
+import os
+
+from configparser import ConfigParser
+
+from anno_page.core.manifest import ProcessingManifest, config_fingerprints
+
+
+def create_config(prompt_settings_path):
+    config = ConfigParser()
+    config.read_dict({
+        "PARSE_FOLDER": {"OUTPUT_ALTO_PATH": "alto"},
+        "DETECTION": {"METHOD": "YOLO_DETECTION", "DETECTION_THRESHOLD": "0.2"},
+        "CAPTIONING": {"METHOD": "OPENAI_COMPLETIONS_IMAGE_CAPTIONING", "PROMPT_SETTINGS": prompt_settings_path}
+    })
+    return config
+
+
+def test_config_fingerprints_follow_referenced_files(tmp_path):
+    prompt_settings_path = os.path.join(tmp_path, "prompt.json")
+    with open(prompt_settings_path, "w") as file:
+        file.write('{"model": "a", "text": "Describe the image."}')
+
+    config = create_config(prompt_settings_path)
+    config_hash, engine_hashes = config_fingerprints(config)
+    assert set(engine_hashes.keys()) == {"DETECTION", "CAPTIONING"}
+
+    config["PARSE_FOLDER"]["OUTPUT_ALTO_PATH"] = "other_alto"
+    assert config_fingerprints(config) == (config_hash, engine_hashes)
+
+    with open(prompt_settings_path, "w") as file:
+        file.write('{"model": "a", "text": "Describe the image briefly."}')
+
+    changed_config_hash, changed_engine_hashes = config_fingerprints(config)
+    assert changed_config_hash != config_hash
+    assert changed_engine_hashes["DETECTION"] == engine_hashes["DETECTION"]
+    assert changed_engine_hashes["CAPTIONING"] != engine_hashes["CAPTIONING"]
+
+
+def test_manifest_records_pages(tmp_path):
+    output_file = os.path.join(tmp_path, "page_1.xml")
+    with open(output_file, "w") as file:
+        file.write("<alto/>")
+
+    manifest = ProcessingManifest(os.path.join(tmp_path, "manifest.sqlite"))
+    manifest.record("page_1", ProcessingManifest.STATE_DONE, "hash_a", {"DETECTION": "x"}, [output_file], 1.5)
+    manifest.record("page_2", ProcessingManifest.STATE_FAILED, "hash_a", {"DETECTION": "x"}, [], 0.5)
+    manifest.record("page_3", ProcessingManifest.STATE_DONE, "hash_b", {"DETECTION": "y"}, [], 0.5)
+    manifest.close()
+
+    manifest = ProcessingManifest(os.path.join(tmp_path, "manifest.sqlite"))
+    assert manifest.get_done_file_ids("hash_a") == {"page_1"}
+
+    record = manifest.get("page_1")
+    assert record["engine_hashes"] == {"DETECTION": "x"}
+    assert list(record["outputs"].keys()) == [output_file]
+    assert manifest.get("page_4") is None
+    manifest.close()
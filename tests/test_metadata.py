@@ -0,0 +1,39 @@
+from lxml import etree as ET
+
+from anno_page.core.metadata import GraphicalObjectMetadata, RelatedLinesMetadata
+from anno_page.enums import Language, LineRelation
+
+
+MODS_NAMESPACE = "http://www.loc.gov/mods/v3"
+
+
+def test_graphical_object_metadata_altoxml_round_trip():
+    caption_lines_metadata = RelatedLinesMetadata(tag_id="CAPTION_001",
+                                                  mods_id="MODS_PICT_0001_CAPTION_0001",
+                                                  lines=[],
+                                                  relation=LineRelation.CAPTION,
+                                                  title="Old castle")
+
+    metadata = GraphicalObjectMetadata(tag_id="Photograph_001",
+                                       mods_id="MODS_PICT_0001",
+                                       caption={Language.ENGLISH: "A castle", Language.CZECH: "Hrad"},
+                                       description="A castle on a hill.",
+                                       topics={Language.ENGLISH: ["castle", "hill"], Language.CZECH: ["hrad", "kopec"]},
+                                       color={Language.ENGLISH: "black and white", Language.CZECH: "černobílá"},
+                                       caption_lines_metadata=caption_lines_metadata,
+                                       used_ai_models={"element-detection": "yolo"})
+
+    tags = ET.Element("Tags")
+    metadata.to_altoxml(tags, MODS_NAMESPACE, category="Photograph", bounding_box=(10, 20, 110, 220), confidence=0.75)
+
+    caption_tag = tags.find("StructureTag")
+    loaded_caption_lines_metadata = RelatedLinesMetadata.from_altoxml(caption_tag, lines=[])
+    assert loaded_caption_lines_metadata.relation == LineRelation.CAPTION
+    assert loaded_caption_lines_metadata.mods_uuid == caption_lines_metadata.mods_uuid
+    assert loaded_caption_lines_metadata.title == "Old castle"
+
+    loaded_metadata, confidence = GraphicalObjectMetadata.from_altoxml(tags.find("LayoutTag"), loaded_caption_lines_metadata)
+    assert confidence == 0.75
+    assert loaded_metadata.to_dict() == metadata.to_dict()
+    assert loaded_metadata.record_identifier == metadata.record_identifier
+    assert loaded_metadata.used_ai_models == metadata.used_ai_models
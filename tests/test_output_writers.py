@@ -0,0 +1,84 @@
+import os
+import hashlib
+import tarfile
+
+from anno_page.core.output_writers import DirectoryOutputWriter, ShardedOutputWriter, ShardedOutputReader
+
+
+def test_sharded_output_is_indexed_by_page(tmp_path):
+    writer = ShardedOutputWriter(str(tmp_path), max_shard_pages=2)
+
+    for page_index in range(3):
+        file_id = f"page_{page_index}"
+        writer.write("alto", f"{file_id}.xml", f"<alto id='{file_id}'/>".encode())
+        writer.write("crops", f"{file_id}_{'x' * 150}.jpg", bytes([page_index]) * 1000)
+        writer.commit_page(file_id)
+
+    writer.write("alto", "failed.xml", b"<alto/>")
+    writer.discard_page()
+    writer.close()
+
+    assert sorted(file for file in os.listdir(tmp_path) if file.endswith(".tar")) == ["shard-000000.tar", "shard-000001.tar"]
+
+    # Shards are valid TAR archives
+    with tarfile.open(os.path.join(tmp_path, "shard-000000.tar")) as archive:
+        assert archive.getnames() == ["alto/page_0.xml", f"crops/page_0_{'x' * 150}.jpg", "alto/page_1.xml", f"crops/page_1_{'x' * 150}.jpg"]
+
+    reader = ShardedOutputReader(str(tmp_path))
+    assert reader.file_ids() == {"page_0", "page_1", "page_2"}
+    assert reader.read("alto/page_2.xml") == b"<alto id='page_2'/>"
+    assert reader.read(f"crops/page_1_{'x' * 150}.jpg") == bytes([1]) * 1000
+    assert not reader.exists("alto/failed.xml")
+    assert sorted(reader.page_names("page_0")) == ["alto/page_0.xml", f"crops/page_0_{'x' * 150}.jpg"]
+
+
+def test_sharded_output_continues_after_existing_shards(tmp_path):
+    writer = ShardedOutputWriter(str(tmp_path))
+    writer.write("alto", "page.xml", b"first")
+    writer.commit_page("page")
+    writer.close()
+
+    writer = ShardedOutputWriter(str(tmp_path))
+    assert writer.read("alto", "page.xml") == b"first"
+    writer.write("alto", "page.xml", b"second")
+    writer.commit_page("page")
+    writer.close()
+
+    assert os.path.isfile(os.path.join(tmp_path, "shard-000001.tar"))
+    assert ShardedOutputReader(str(tmp_path)).read("alto/page.xml") == b"second"
+
+
+def test_sharded_output_skips_shard_created_concurrently(tmp_path):
+    writer = ShardedOutputWriter(str(tmp_path))
+    writer.write("alto", "first.xml", b"first")
+
+    # Another writer with the same prefix takes the next shard number before this one rotates
+    open(os.path.join(tmp_path, "shard-000001.tar"), 'xb').close()
+    writer.commit_page("first")
+    writer.close_shard()
+
+    writer.write("alto", "second.xml", b"second")
+    writer.commit_page("second")
+    writer.close()
+
+    assert os.path.getsize(os.path.join(tmp_path, "shard-000001.tar")) == 0
+    assert ShardedOutputReader(str(tmp_path)).read("alto/second.xml") == b"second"
+    assert os.path.isfile(os.path.join(tmp_path, "shard-000002.tar"))
+
+
+def test_streamed_writes_return_path_and_hash(tmp_path):
+    writer = DirectoryOutputWriter({"alto": str(tmp_path)})
+    path, sha256 = writer.write_stream("alto", "page.xml", lambda file: (file.write(b"<alto>"), file.write(b"</alto>")))
+
+    with open(path, 'rb') as file:
+        assert file.read() == b"<alto></alto>"
+    assert sha256 == hashlib.sha256(b"<alto></alto>").hexdigest()
+
+    writer = ShardedOutputWriter(str(tmp_path / "shards"))
+    os.makedirs(writer.path)
+    path, sha256 = writer.write_stream("alto", "page.xml", lambda file: file.write(b"<alto/>"))
+    writer.commit_page("page")
+    writer.close()
+
+    assert path.endswith("shard-000000.tar/alto/page.xml")
+    assert sha256 == hashlib.sha256(b"<alto/>").hexdigest()
@@ -0,0 +1,115 @@
+import threading
+
+from configparser import ConfigParser
+
+from anno_page.core import page_parser
+from anno_page.engines import LayoutProcessingEngine
+from anno_page.core.page_parser import PageParser, build_engine_dependencies
+from anno_page.enums import LayoutData
+
+
+class Engine:
+    def __init__(self, inputs, outputs):
+        self.inputs = frozenset(inputs) if inputs is not None else None
+        self.outputs = frozenset(outputs) if outputs is not None else None
+
+
+def test_engine_dependencies_follow_declared_layout_data():
+    detection = Engine([], [LayoutData.REGIONS])
+    caption_assignment = Engine([LayoutData.REGIONS, LayoutData.LINES], [LayoutData.CAPTION_LINES])
+    embedding = Engine([LayoutData.REGIONS], [LayoutData.EMBEDDINGS])
+    captioning = Engine([LayoutData.REGIONS, LayoutData.CAPTION_LINES], [LayoutData.IMAGE_CAPTIONS])
+
+    dependencies = build_engine_dependencies([detection, caption_assignment, embedding, captioning])
+    assert dependencies == [set(), {0}, {0}, {0, 1}]
+
+
+def test_undeclared_engine_is_a_barrier():
+    detection = Engine([], [LayoutData.REGIONS])
+    custom = Engine(None, None)
+    embedding = Engine([LayoutData.REGIONS], [LayoutData.EMBEDDINGS])
+
+    dependencies = build_engine_dependencies([detection, custom, embedding])
+    assert dependencies == [set(), {0}, {0, 1}]
+
+
+class Page:
+    def __init__(self, regions=None):
+        self.regions = list(regions) if regions is not None else []
+        self.metadata = {}
+
+
+class DetectionEngine(Engine):
+    def __init__(self, config):
+        super().__init__([], [LayoutData.REGIONS])
+        self.config = config
+
+    def process_page(self, image, page_layout):
+        page_layout.regions.extend(["region_1", "region_2"])
+        return page_layout
+
+
+class EmbeddingEngine(Engine):
+    def __init__(self, config):
+        super().__init__([LayoutData.REGIONS], [LayoutData.EMBEDDINGS])
+        self.config = config
+
+    def process_page(self, image, page_layout):
+        return page_layout
+
+
+def test_rerun_of_detection_processes_page_from_scratch(monkeypatch):
+    engine_classes = {"DETECTION": DetectionEngine, "EMBEDDING": EmbeddingEngine}
+    monkeypatch.setattr(page_parser, "operation_factory",
+                        lambda config, config_path, device: engine_classes[config.name](config))
+
+    config = ConfigParser()
+    config.read_dict({"DETECTION": {"METHOD": "detection"}, "EMBEDDING": {"METHOD": "embedding"}})
+    parser = PageParser(config, device="cpu")
+
+    def rerun(section_names):
+        # Mirrors parse_folder: the regions of the previous ALTO are loaded only for the partial reruns
+        engines = parser.get_rerun_engines(section_names)
+        page = Page(["region_1", "region_2"] if engines is not None else [])
+        return engines, parser.process_page(None, page, engines=engines)
+
+    engines, page = rerun({"DETECTION"})
+    assert engines is None
+    assert len(page.regions) == 2
+
+    engines, page = rerun({"EMBEDDING"})
+    assert [engine.__class__ for engine in engines] == [EmbeddingEngine]
+    assert len(page.regions) == 2
+
+
+def test_concurrent_engines_record_processing_info(monkeypatch):
+    barrier = threading.Barrier(2)
+
+    class RecordingEngine(LayoutProcessingEngine):
+        def process_page(self, image, page_layout):
+            barrier.wait()
+            for index in range(500):
+                self.record_processing_info(page_layout, f"region_{index}", {"index": index})
+            return page_layout
+
+    class CaptioningEngine(RecordingEngine):
+        inputs = frozenset({LayoutData.REGIONS})
+        outputs = frozenset({LayoutData.IMAGE_CAPTIONS})
+
+    class ImageEmbeddingEngine(RecordingEngine):
+        inputs = frozenset({LayoutData.REGIONS})
+        outputs = frozenset({LayoutData.EMBEDDINGS})
+
+    engine_classes = {"CAPTIONING": CaptioningEngine, "EMBEDDING": ImageEmbeddingEngine}
+    monkeypatch.setattr(page_parser, "operation_factory",
+                        lambda config, config_path, device: engine_classes[config.name](config, device, config_path))
+
+    config = ConfigParser()
+    config.read_dict({"PAGE_PARSER": {"RUN_ENGINES_CONCURRENTLY": "yes"}, "CAPTIONING": {}, "EMBEDDING": {}})
+    parser = PageParser(config, device="cpu")
+
+    page = parser.process_page(None, Page())
+    parser.close()
+
+    assert set(page.metadata["anno_page_processing"]) == {"CaptioningEngine", "ImageEmbeddingEngine"}
+    assert all(len(info) == 500 for info in page.metadata["anno_page_processing"].values())
@@ -0,0 +1,37 @@
+from user_scripts.parse_folder import parse_gpu_ids, get_worker_devices, get_worker_shards_prefix, summarize_processing_info
+
+
+def test_parse_gpu_ids():
+    assert parse_gpu_ids("0,1, 3,") == [0, 1, 3]
+    assert parse_gpu_ids(None) == []
+    assert parse_gpu_ids(None, gpu_id=2) == [2]
+    assert parse_gpu_ids("0,1", gpu_id=2) == [0, 1]
+
+
+def test_worker_devices_are_assigned_round_robin():
+    assert get_worker_devices(5, [0, 1]) == [(0, 0), (1, 1), (2, 0), (3, 1), (4, 0)]
+    assert get_worker_devices(3, parse_gpu_ids(None, gpu_id=2)) == [(0, 2), (1, 2), (2, 2)]
+    assert get_worker_devices(2, []) == [(0, None), (1, None)]
+
+
+def test_worker_shards_prefixes_are_unique():
+    prefixes = [get_worker_shards_prefix("shard", worker_index) for worker_index, _ in get_worker_devices(12, [0, 1])]
+    assert prefixes[:2] == ["shard-0", "shard-1"]
+    assert len(set(prefixes)) == len(prefixes)
+
+
+def test_summary_averages_stream_speed_over_requests():
+    processing_info = {
+        "page": {
+            "captioning": {
+                "r1": {"completion_tokens": 100, "tokens_per_second": 30.0, "streamed_requests": 2, "deduplicated_from": None},
+                "r2": {"completion_tokens": 50, "tokens_per_second": 60.0, "streamed_requests": 1},
+                "r3": {"completion_tokens": 0, "tokens_per_second": 0, "streamed_requests": 0}
+            }
+        }
+    }
+
+    summary = summarize_processing_info(processing_info)["summary"]
+    assert summary["total"] == {"completion_tokens": 150, "tokens_per_second": 40.0, "streamed_requests": 3}
+    assert summary["per_element"]["page_r1"]["tokens_per_second"] == 30.0
+    assert summary["per_element"]["page_r3"]["tokens_per_second"] == 0
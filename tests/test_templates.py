@@ -0,0 +1,14 @@
+from jinja2 import Template
+
+from anno_page.core.templates import get_template
+
+
+def test_template_cache_is_keyed_by_source():
+    source = "{{ element_category }}: {{ element_caption | default('none') }}"
+
+    template = get_template(source)
+    assert get_template(source) is template
+    assert get_template(source + " ") is not template
+
+    assert template.render(element_category="Map") == Template(source).render(element_category="Map")
+    assert get_template("Text\n").render() == Template("Text\n").render()
@@ -0,0 +1,53 @@
+import numpy as np
+
+from lxml import etree as ET
+
+from anno_page.core.utils import TextLineIndex
+
+
+ALTO_NAMESPACE = "http://www.loc.gov/standards/alto/ns-v4#"
+
+
+class Line:
+    def __init__(self, id, polygon, transcription):
+        self.id = id
+        self.polygon = np.asarray(polygon)
+        self.transcription = transcription
+
+
+def create_print_space(namespace=None):
+    def tag(name):
+        return f"{{{namespace}}}{name}" if namespace is not None else name
+
+    print_space = ET.Element(tag("PrintSpace"))
+    text_block = ET.SubElement(print_space, tag("TextBlock"), ID="block_1")
+
+    for index, (vpos, words) in enumerate([(10, ["First", "line"]), (30, ["Second", "line"])]):
+        text_line = ET.SubElement(text_block, tag("TextLine"), ID=f"line_{index + 1}",
+                                  HPOS="10", VPOS=str(vpos), WIDTH="100", HEIGHT="15")
+        for word_index, word in enumerate(words):
+            if word_index > 0:
+                ET.SubElement(text_line, tag("SP"))
+            ET.SubElement(text_line, tag("String"), CONTENT=word)
+
+    return print_space
+
+
+def test_textline_index_finds_lines_by_id_in_any_namespace():
+    for namespace in (None, ALTO_NAMESPACE):
+        index = TextLineIndex(create_print_space(namespace))
+
+        assert index.find_by_id("line_2").attrib["VPOS"] == "30"
+        assert index.find_by_id("line_3") is None
+
+
+def test_textline_index_falls_back_to_geometry_and_content():
+    print_space = create_print_space()
+    index = TextLineIndex(print_space)
+
+    line = Line(id="unknown", polygon=[[10, 30], [110, 30], [110, 45], [10, 45]], transcription="Second line")
+    assert index.find(line).attrib["ID"] == "line_2"
+    assert index.find_by_geometry_and_content(line).attrib["ID"] == "line_2"
+
+    line.transcription = "Other line"
+    assert index.find(line) is None
@@ -0,0 +1,45 @@
+import sys
+import json
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("doc_worker")
+
+from api.worker import JobProcessMonitor, JobAdmission
+
+
+def test_job_process_monitor_skips_invalid_progress_lines():
+    lines = ["not json", json.dumps([1, 2]), json.dumps({"done": 1}),
+             json.dumps({"done": 1, "total": 3, "succeeded": True, "file_id": "a"}),
+             json.dumps({"done": 2, "total": 3, "succeeded": False, "file_id": "b"}),
+             json.dumps({"done": 3, "total": 3, "succeeded": True, "file_id": "c"})]
+    script = "import sys\nfor line in sys.argv[1:]:\n    print(line, flush=True)\n"
+    process = subprocess.Popen([sys.executable, "-c", script, *lines], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    records = []
+
+    def on_page_done(record):
+        records.append(record["file_id"])
+        if record["file_id"] == "a":
+            raise RuntimeError("Callback failed.")
+
+    monitor = JobProcessMonitor(process, on_page_done=on_page_done)
+    assert monitor.wait() == 0
+    assert records == ["a", "b", "c"]
+    assert (monitor.done_count, monitor.succeeded_count, monitor.total_count) == (3, 2, 3)
+
+
+def test_job_admission_reserves_after_release():
+    admission = JobAdmission(gpu_jobs=1, network_jobs=1, gpu_ids=[0], check_interval=0.01)
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    reservation = admission.reserve()
+    next_reservation = executor.submit(admission.reserve)
+    assert not next_reservation.done()
+
+    admission.release(reservation)
+    assert next_reservation.result(timeout=5).gpu_id == 0
+    executor.shutdown()
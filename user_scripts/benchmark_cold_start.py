@@ -0,0 +1,97 @@
+import sys
+import time
+import json
+import argparse
+import statistics
+import subprocess
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Measures the cold start of the AnnoPage CLI and the import time of its modules.")
+    parser.add_argument("--command", nargs=argparse.REMAINDER, default=None,
+                        help="Command to measure, defaults to 'python -m anno_page.user_scripts.parse_folder --help'. Must be the last argument.")
+    parser.add_argument("--repeats", type=int, default=5, help="Number of measured runs.")
+    parser.add_argument("--warmup", type=int, default=1, help="Number of runs before the measurement (to fill the OS file cache).")
+    parser.add_argument("--import-module", default="anno_page.user_scripts.parse_folder", help="Module whose import time is broken down with 'python -X importtime'.")
+    parser.add_argument("--top", type=int, default=15, help="Number of the slowest imported modules to report.")
+    parser.add_argument("--output-path", default=None, help="If set, the results are saved to this JSON file.")
+
+    args = parser.parse_args()
+    return args
+
+
+def measure_command(command, repeats, warmup):
+    for _ in range(warmup):
+        subprocess.run(command, capture_output=True, check=True)
+
+    durations = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        subprocess.run(command, capture_output=True, check=True)
+        durations.append(time.perf_counter() - start_time)
+
+    return {
+        "command": command,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "max": max(durations),
+        "runs": durations
+    }
+
+
+def measure_imports(module_name, top):
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+                             capture_output=True, text=True, check=True)
+
+    imported_modules = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        self_time, cumulative_time, name = line[len("import time:"):].split("|")
+        imported_modules.append({
+            "module": name.strip(),
+            "self": int(self_time) / 1e6,
+            "cumulative": int(cumulative_time) / 1e6
+        })
+
+    total_time = next((item["cumulative"] for item in imported_modules if item["module"] == module_name), None)
+    top_level_modules = sorted([item for item in imported_modules if "." not in item["module"]],
+                               key=lambda item: item["cumulative"], reverse=True)
+
+    return {
+        "module": module_name,
+        "total": total_time,
+        "modules_count": len(imported_modules),
+        "slowest": top_level_modules[:top]
+    }
+
+
+def main():
+    args = parse_arguments()
+
+    command = args.command if args.command else [sys.executable, "-m", "anno_page.user_scripts.parse_folder", "--help"]
+
+    results = {
+        "cold_start": measure_command(command, args.repeats, args.warmup),
+        "imports": measure_imports(args.import_module, args.top)
+    }
+
+    cold_start = results["cold_start"]
+    print(f"Command: {' '.join(command)}")
+    print(f"Cold start: min {cold_start['min']:.3f} s, median {cold_start['median']:.3f} s, max {cold_start['max']:.3f} s ({args.repeats} runs)")
+
+    imports = results["imports"]
+    print(f"Import of '{imports['module']}': {imports['total']:.3f} s, {imports['modules_count']} modules")
+    for item in imports["slowest"]:
+        print(f"  {item['cumulative']:8.3f} s  {item['module']}")
+
+    if args.output_path is not None:
+        with open(args.output_path, 'w') as file:
+            json.dump(results, file, indent=4)
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
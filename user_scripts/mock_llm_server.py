@@ -0,0 +1,339 @@
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Local stand-in for OpenAI-compatible chat completions endpoint.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind the server to.")
+    parser.add_argument("--port", type=int, default=8090, help="Port to bind the server to.")
+
+    parser.add_argument("--latency-distribution", choices=["constant", "uniform", "normal", "lognormal"], default="constant",
+                        help="Distribution of the response latency.")
+    parser.add_argument("--latency-mean", type=float, default=0.0, help="Mean response latency in seconds, the same for all distributions.")
+    parser.add_argument("--latency-std", type=float, default=0.0, help="Standard deviation of the response latency in seconds, the same for all distributions.")
+
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of responding with HTTP 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Probability of responding with HTTP 429.")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Probability of returning content which is not a valid JSON.")
+    parser.add_argument("--invalid-schema-rate", type=float, default=0.0, help="Probability of returning JSON content which does not conform to the requested schema.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Value of the 'Retry-After' header sent with HTTP 429 responses.")
+
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Delay in seconds between the streamed content chunks (streaming requests only).")
+
+    parser.add_argument("--image-tokens", type=int, default=765, help="Number of prompt tokens reported for each image in the request.")
+    parser.add_argument("--cost-per-token", type=float, default=0.0, help="Cost reported in usage per one token.")
+    parser.add_argument("--api-key", default=None, help="If set, requests without this bearer token are rejected with HTTP 401.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for deterministic behaviour.")
+
+    parser.add_argument("--logging-level", default="WARNING", help="Logging level. Possible values: DEBUG, INFO, WARNING, ERROR, CRITICAL")
+
+    args = parser.parse_args()
+    return args
+
+
+class MockCompletionsSettings:
+    def __init__(self,
+                 latency_distribution="constant",
+                 latency_mean=0.0,
+                 latency_std=0.0,
+                 error_rate=0.0,
+                 rate_limit_rate=0.0,
+                 malformed_rate=0.0,
+                 invalid_schema_rate=0.0,
+                 retry_after=1.0,
+                 token_latency=0.0,
+                 image_tokens=765,
+                 cost_per_token=0.0,
+                 api_key=None,
+                 seed=None):
+        self.latency_distribution = latency_distribution
+        self.latency_mean = latency_mean
+        self.latency_std = latency_std
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.invalid_schema_rate = invalid_schema_rate
+        self.retry_after = retry_after
+        self.token_latency = token_latency
+        self.image_tokens = image_tokens
+        self.cost_per_token = cost_per_token
+        self.api_key = api_key
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def get_latency_parameters(self):
+        # The mean and the standard deviation of the latency are converted to the parameters of the distribution: the
+        # bounds of the uniform one, mu and sigma of the normal distribution underlying the lognormal one
+        mean, std = self.latency_mean, self.latency_std
+
+        if self.latency_distribution == "uniform":
+            return mean - math.sqrt(3) * std, mean + math.sqrt(3) * std
+
+        if self.latency_distribution == "lognormal":
+            if mean <= 0:
+                return None
+            sigma_squared = math.log(1 + (std / mean) ** 2)
+            return math.log(mean) - sigma_squared / 2, math.sqrt(sigma_squared)
+
+        return mean, std
+
+    def sample_latency(self):
+        parameters = self.get_latency_parameters()
+
+        with self._lock:
+            if self.latency_distribution == "uniform":
+                latency = self._random.uniform(*parameters)
+            elif self.latency_distribution == "normal":
+                latency = self._random.gauss(*parameters)
+            elif self.latency_distribution == "lognormal" and parameters is not None:
+                latency = self._random.lognormvariate(*parameters)
+            else:
+                latency = self.latency_mean
+
+        return max(latency, 0.0)
+
+
+def get_response_schema(payload):
+    """Returns the JSON schema requested by the client, supporting both the `response_format` and `text.format` forms."""
+    response_format = payload.get("response_format", None)
+    if isinstance(response_format, dict) and "json_schema" in response_format:
+        return response_format["json_schema"].get("schema", None)
+
+    text_format = payload.get("text", {}).get("format", None)
+    if isinstance(text_format, dict):
+        return text_format.get("schema", None)
+
+    return None
+
+
+def generate_from_schema(schema, name="value", definitions=None):
+    if definitions is None:
+        definitions = schema.get("$defs", {})
+
+    if "$ref" in schema:
+        schema = definitions[schema["$ref"].split("/")[-1]]
+
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type", None) != "null"]
+        schema = options[0] if options else {"type": "null"}
+
+    schema_type = schema.get("type", "string")
+    if isinstance(schema_type, list):
+        schema_type = [item for item in schema_type if item != "null"][0]
+
+    if "enum" in schema:
+        return schema["enum"][0]
+
+    if schema_type == "object":
+        return {key: generate_from_schema(value, name=key, definitions=definitions)
+                for key, value in schema.get("properties", {}).items()}
+    elif schema_type == "array":
+        return [generate_from_schema(schema.get("items", {}), name=f"{name}_{index + 1}", definitions=definitions)
+                for index in range(max(schema.get("minItems", 2), 1))]
+    elif schema_type == "boolean":
+        return True
+    elif schema_type == "integer":
+        return 1
+    elif schema_type == "number":
+        return 1.0
+    elif schema_type == "null":
+        return None
+
+    value = f"Mock {name}"
+    if "maxLength" in schema:
+        value = value[:schema["maxLength"]]
+
+    return value
+
+
+def count_tokens(text):
+    return max(len(text) // 4, 1)
+
+
+def build_completion(payload, settings: MockCompletionsSettings):
+    prompt_tokens = 0
+    for message in payload.get("messages", []):
+        content = message.get("content", "")
+        if isinstance(content, str):
+            prompt_tokens += count_tokens(content)
+            continue
+
+        for part in content:
+            if part.get("type") == "text":
+                prompt_tokens += count_tokens(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                prompt_tokens += settings.image_tokens
+
+    schema = get_response_schema(payload)
+    content = generate_from_schema(schema) if schema is not None else {"content": "Mock content"}
+
+    if settings.random() < settings.invalid_schema_rate:
+        content = {"unexpected": "Mock content"}
+
+    content = json.dumps(content, ensure_ascii=False)
+
+    if settings.random() < settings.malformed_rate:
+        content = content[:len(content) // 2]
+
+    completion_tokens = count_tokens(content)
+    total_tokens = prompt_tokens + completion_tokens
+
+    return {
+        "id": f"mock-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "mock"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": content
+                },
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "cost": total_tokens * settings.cost_per_token
+        }
+    }
+
+
+class MockCompletionsRequestHandler(BaseHTTPRequestHandler):
+    settings: MockCompletionsSettings = MockCompletionsSettings()
+    logger = logging.getLogger("MockCompletionsRequestHandler")
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown endpoint: {self.path}"}})
+            return
+
+        if self.settings.api_key is not None and self.headers.get("Authorization", "") != f"Bearer {self.settings.api_key}":
+            self.send_json(401, {"error": {"message": "Invalid API key."}})
+            return
+
+        content_length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(content_length))
+        except json.JSONDecodeError:
+            self.send_json(400, {"error": {"message": "Request body is not a valid JSON."}})
+            return
+
+        time.sleep(self.settings.sample_latency())
+
+        if self.settings.random() < self.settings.rate_limit_rate:
+            self.send_json(429, {"error": {"message": "Rate limit exceeded."}},
+                           headers={"Retry-After": str(self.settings.retry_after)})
+            return
+
+        if self.settings.random() < self.settings.error_rate:
+            self.send_json(500, {"error": {"message": "Internal server error."}})
+            return
+
+        completion = build_completion(payload, self.settings)
+        if payload.get("stream", False):
+            self.send_stream(completion, include_usage=payload.get("stream_options", {}).get("include_usage", False))
+        else:
+            self.send_json(200, completion)
+
+    def send_stream(self, completion, include_usage=False):
+        # Server-sent events with the content in chunks of about one token, the connection is closed at the end
+        content = completion["choices"][0]["message"]["content"]
+        chunks = [{"choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}]
+        chunks += [{"choices": [{"index": 0, "delta": {"content": content[start:start + 4]}, "finish_reason": None}]}
+                   for start in range(0, len(content), 4)]
+        chunks.append({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if include_usage:
+            chunks.append({"choices": [], "usage": completion["usage"]})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        try:
+            for chunk in chunks:
+                chunk = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"],
+                         "model": completion["model"], **chunk}
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(self.settings.token_latency)
+
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.logger.debug("Stream closed by the client.")
+
+    def send_json(self, status_code, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.logger.debug(format % args)
+
+
+def create_server(host, port, settings: MockCompletionsSettings) -> ThreadingHTTPServer:
+    handler = type("ConfiguredMockCompletionsRequestHandler", (MockCompletionsRequestHandler,), {"settings": settings})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    args = parse_arguments()
+
+    logging.basicConfig(level=logging.getLevelName(args.logging_level),
+                        format='[%(levelname)s|%(asctime)s|%(filename)s:%(name)s]: %(message)s',
+                        datefmt="%Y-%m-%d_%H-%M-%S")
+    logger = logging.getLogger(__name__)
+
+    settings = MockCompletionsSettings(latency_distribution=args.latency_distribution,
+                                       latency_mean=args.latency_mean,
+                                       latency_std=args.latency_std,
+                                       error_rate=args.error_rate,
+                                       rate_limit_rate=args.rate_limit_rate,
+                                       malformed_rate=args.malformed_rate,
+                                       invalid_schema_rate=args.invalid_schema_rate,
+                                       retry_after=args.retry_after,
+                                       token_latency=args.token_latency,
+                                       image_tokens=args.image_tokens,
+                                       cost_per_token=args.cost_per_token,
+                                       api_key=args.api_key,
+                                       seed=args.seed)
+
+    server = create_server(args.host, args.port, settings)
+    logger.warning(f"Mock completions server listening on http://{args.host}:{args.port}/v1/chat/completions")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.warning("Terminated by user.")
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
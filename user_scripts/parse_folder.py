@@ -1,32 +1,36 @@
+import io
 import os
 import re
-import cv2
 import json
+import hashlib
 import time
-import torch
 import logging
 import argparse
 import traceback
 import configparser
 
-from lxml import etree as ET
-from safe_gpu import safe_gpu
-from multiprocessing import Pool
-from pero_ocr.core.layout import PageLayout, ALTOVersion
+from multiprocessing import get_context
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-from anno_page.core.layout import render_to_image, add_page_layout_to_alto, set_handlers
+# torch, OpenCV and pero-ocr (with the AnnoPage layout built on it) take seconds to import, they are imported only
+# where they are used, so that e.g. '--help' or a sharded run's parent process do not pay for them.
+from anno_page.core.input_sources import get_input_source, close_input_sources, get_input_source_indices, set_input_source_indices, ReadAheadReader
 from anno_page.core.llm_api_aliases import load_llm_api_aliases
+from anno_page.core.manifest import ProcessingManifest, config_fingerprints
+from anno_page.core.output_writers import DirectoryOutputWriter, ShardedOutputWriter, ShardedOutputReader
 from anno_page.core.page_parser import PageParser
+from anno_page.enums import LayoutData
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", help="Path to config file.", required=True)
-    parser.add_argument("--input-image-path", help="Path to directory with images to process.")
+    parser.add_argument("--input-image-path", help="Path to directory, ZIP or TAR archive or JSON Lines manifest (one path per line) with images to process.")
 
     group1 = parser.add_mutually_exclusive_group()
-    group1.add_argument("--input-xml-path", help="Path to directory with PAGE XML files", required=False, default=None)
-    group1.add_argument("--input-alto-path", help="Path to directory with ALTO XML files", required=False, default=None)
+    group1.add_argument("--input-xml-path", help="Path to directory, archive or JSON Lines manifest with PAGE XML files", required=False, default=None)
+    group1.add_argument("--input-alto-path", help="Path to directory, archive or JSON Lines manifest with ALTO XML files", required=False, default=None)
 
     parser.add_argument("--input-metadata-path", help="Path to JSON file with metadata for input images.", required=False, default=None)
 
@@ -37,15 +41,29 @@ def parse_arguments():
     parser.add_argument("--output-image-captioning-prompts-path", help="Path to directory where image captioning prompts will be saved.")
     parser.add_argument("--output-processing-info-path", help="Path to JSON file where processing info will be saved.")
     parser.add_argument("--output-embeddings-path", help="Path to directory where embeddings will be saved.")
+    parser.add_argument("--read-ahead", type=int, default=4, help="Number of images read ahead of the processed one on a background thread (only without --process-count, 0 disables it).")
+    parser.add_argument("--large-image-threshold", type=float, default=None, help="If set, images with at least this many megapixels are processed in the large image mode: the full resolution image is memory-mapped from a raw cache and the detection and renders use its downscaled proxy.")
+    parser.add_argument("--large-image-proxy-size", type=int, default=4096, help="Maximal size of the longer side of the proxy image in the large image mode.")
+    parser.add_argument("--large-image-cache-path", default=None, help="Path to directory where the raw images of the large image mode are cached, if not set, temporary files are used and removed once the page and all its crops are done.")
+    parser.add_argument("--output-shards-path", help="Path to directory where the outputs are bundled into TAR shards with indices, instead of one file per artifact in the output directories. The output path options still select the produced artifacts.")
+    parser.add_argument("--shard-max-size", type=int, default=1024, help="Size in MB at which an output shard is closed and the next one started.")
+    parser.add_argument("--shard-max-pages", type=int, default=None, help="If set, number of pages after which an output shard is closed and the next one started.")
     parser.add_argument("--embeddings-jsonlines", action='store_true', help="If set, the embedding output is saved in JSON Lines format instead of a single JSON array.")
     parser.add_argument('-s', '--skip-processed', action='store_true', required=False, help='If set, already processed files are skipped.')
+    parser.add_argument("--manifest-path", help="Path to SQLite file where the state of processed pages is recorded. If set, --skip-processed skips the pages recorded as done with the same engine configuration.", required=False, default=None)
+
+    parser.add_argument("--incremental", action='store_true', help="If set, the pages recorded as done in the manifest are not processed from scratch, their previous ALTO outputs are loaded and only the engines with changed configuration (and the engines after them) are run. Requires --manifest-path and the output ALTO path.")
+
+    parser.add_argument("--progress-jsonl", action='store_true', help="If set, a JSON line with the state and output files of every finished page is printed to the standard output (the logs go to the standard error).")
 
     parser.add_argument("--llm-api-aliases-path", help="Path to JSON file with LLM API aliases.", required=False, default=None)
 
     parser.add_argument("--device", choices=["gpu", "cpu"], default="gpu")
-    parser.add_argument("--gpu-id", type=int, default=None, help="If set, the computation runs of the specified GPU, otherwise safe-gpu is used to allocate first unused GPU.")
+    parser.add_argument("--gpu-id", type=int, default=None, help="If set, the computation runs of the specified GPU (all the processes with --process-count and without --gpu-ids), otherwise safe-gpu is used to allocate first unused GPU.")
+    parser.add_argument("--gpu-ids", type=str, default=None, help="Comma separated list of GPU indices (e.g. '0,1,2'). The worker processes are assigned to the GPUs in a round-robin fashion.")
 
-    parser.add_argument("--process-count", type=int, default=1, help="Number of parallel processes.")
+    parser.add_argument("--process-count", type=int, default=1, help="Number of parallel processes, each with its own page parser. Defaults to the number of GPUs if --gpu-ids is set.")
+    parser.add_argument("--threads-per-process", type=int, default=None, help="If set, limits the number of torch CPU threads in each process.")
 
     parser.add_argument("--logging-level", default="WARNING", help="Logging level. Possible values: DEBUG, INFO, WARNING, ERROR, CRITICAL")
 
@@ -61,12 +79,19 @@ def setup_logging(logging_level):
     root_logger = logging.getLogger()
     root_logger.setLevel(level)
 
+    if not root_logger.handlers:
+        root_logger.addHandler(logging.StreamHandler())
+
     root_handler = root_logger.handlers[0]
     root_handler.setFormatter(log_formatter)
 
     root_logger.info("Logging initialized")
 
+
 def get_device(device, gpu_index=None, logger=None):
+    import torch
+    from safe_gpu import safe_gpu
+
     if gpu_index is None:
         if device == "gpu":
             safe_gpu.claim_gpus(logger=logger)
@@ -79,6 +104,29 @@ def get_device(device, gpu_index=None, logger=None):
     return torch_device
 
 
+def set_num_threads(threads_count):
+    import torch
+
+    torch.set_num_threads(threads_count)
+
+
+def parse_gpu_ids(gpu_ids, gpu_id=None):
+    # A single --gpu-id is the one GPU of all worker processes
+    if gpu_ids is None:
+        return [gpu_id] if gpu_id is not None else []
+
+    return [int(gpu_id) for gpu_id in gpu_ids.split(",") if gpu_id.strip()]
+
+
+def get_worker_devices(process_count, gpu_ids):
+    # (worker index, GPU index) of the worker processes, the GPUs are assigned in a round-robin fashion
+    return [(worker_index, gpu_ids[worker_index % len(gpu_ids)] if gpu_ids else None) for worker_index in range(process_count)]
+
+
+def get_worker_shards_prefix(prefix, worker_index):
+    return f"{prefix}-{worker_index}"
+
+
 def get_value_or_none(config, section, key, getboolean: bool = False):
     if config.has_option(section, key):
         if getboolean:
@@ -127,6 +175,36 @@ def load_already_processed_files(directories):
     return already_processed
 
 
+def get_rerun_sections(record, config_hash, engine_hashes):
+    # None means the page is processed from scratch, an empty set means there is nothing to process
+    if record is None or record["state"] != ProcessingManifest.STATE_DONE:
+        return None
+
+    if record["config_hash"] == config_hash:
+        return set()
+
+    if set(record["engine_hashes"].keys()) - set(engine_hashes.keys()):
+        return None
+
+    return {section for section, engine_hash in engine_hashes.items() if record["engine_hashes"].get(section, None) != engine_hash}
+
+
+def add_to_summary(summary, element_info):
+    for key, value in element_info.items():
+        # The recorded speed is the mean over the streamed requests of the element, it is weighted by their count
+        if key == "tokens_per_second":
+            value *= element_info.get("streamed_requests", 0)
+
+        if key not in summary:
+            summary[key] = 0
+        summary[key] += value
+
+
+def finish_summary(summary):
+    if "tokens_per_second" in summary:
+        summary["tokens_per_second"] = summary["tokens_per_second"] / summary["streamed_requests"] if summary.get("streamed_requests", 0) else 0
+
+
 def summarize_processing_info(processing_info):
     total_summary = {}
     per_engine_summary = {}
@@ -138,38 +216,18 @@ def summarize_processing_info(processing_info):
             for element_id, element_info in engine_info.items():
                 full_element_id = f"{page_id}_{element_id}"
 
-                # Update total summary
-                for key, value in element_info.items():
-                    if key not in total_summary:
-                        total_summary[key] = 0
-                    total_summary[key] += value
-
-                # Update per engine summary
-                if engine_name not in per_engine_summary:
-                    per_engine_summary[engine_name] = {}
-
-                for key, value in element_info.items():
-                    if key not in per_engine_summary[engine_name]:
-                        per_engine_summary[engine_name][key] = 0
-                    per_engine_summary[engine_name][key] += value
-
-                # Update per page summary
-                if page_id not in per_page_summary:
-                    per_page_summary[page_id] = {}
-
-                for key, value in element_info.items():
-                    if key not in per_page_summary[page_id]:
-                        per_page_summary[page_id][key] = 0
-                    per_page_summary[page_id][key] += value
+                # Only the counters are summed, not the notes like the source of a deduplicated caption
+                element_info = {key: value for key, value in element_info.items() if isinstance(value, (int, float))}
 
-                # Update per element summary
-                if full_element_id not in per_element_summary:
-                    per_element_summary[full_element_id] = {}
+                add_to_summary(total_summary, element_info)
+                add_to_summary(per_engine_summary.setdefault(engine_name, {}), element_info)
+                add_to_summary(per_page_summary.setdefault(page_id, {}), element_info)
+                add_to_summary(per_element_summary.setdefault(full_element_id, {}), element_info)
 
-                for key, value in element_info.items():
-                    if key not in per_element_summary[full_element_id]:
-                        per_element_summary[full_element_id][key] = 0
-                    per_element_summary[full_element_id][key] += value
+    finish_summary(total_summary)
+    for summaries in (per_engine_summary, per_page_summary, per_element_summary):
+        for summary in summaries.values():
+            finish_summary(summary)
 
     result = {
         "summary": {
@@ -184,6 +242,13 @@ def summarize_processing_info(processing_info):
     return result
 
 
+def summarize_processing_times(processing_times):
+    return {
+        "total": sum(processing_times.values()),
+        "per_page": processing_times
+    }
+
+
 def save_processing_info(processing_info, output_processing_info_path):
     with open(output_processing_info_path, 'w', encoding='utf-8') as file:
         json.dump(processing_info, file, ensure_ascii=False, indent=4)
@@ -201,7 +266,14 @@ class Computator:
                  output_render_path,
                  output_crops_path,
                  output_image_captioning_prompts_path,
-                 embeddings_jsonlines=False):
+                 embeddings_jsonlines=False,
+                 large_image_threshold=None,
+                 large_image_proxy_size=4096,
+                 large_image_cache_path=None,
+                 output_shards_path=None,
+                 output_shards_prefix="shard",
+                 shard_max_size=1024,
+                 shard_max_pages=None):
         self.page_parser = page_parser
         self.input_image_path = input_image_path
         self.input_xml_path = input_xml_path
@@ -213,25 +285,133 @@ class Computator:
         self.output_crops_path = output_crops_path
         self.output_image_captioning_prompts_path = output_image_captioning_prompts_path
         self.embeddings_jsonlines = embeddings_jsonlines
+        self.large_image_threshold = large_image_threshold
+        self.large_image_proxy_size = large_image_proxy_size
+        self.large_image_cache_path = large_image_cache_path
+
+        if output_shards_path is not None:
+            self.output_writer = ShardedOutputWriter(output_shards_path,
+                                                     prefix=output_shards_prefix,
+                                                     max_shard_bytes=shard_max_size * 1024 * 1024,
+                                                     max_shard_pages=shard_max_pages)
+        else:
+            self.output_writer = DirectoryOutputWriter({
+                "page_xml": output_xml_path,
+                "alto": output_alto_path,
+                "embeddings": output_embeddings_path,
+                "renders": output_render_path,
+                "crops": output_crops_path,
+                "image_captioning_prompts": output_image_captioning_prompts_path
+            })
 
         self.logger = logging.getLogger(self.__class__.__name__)
 
         self.processing_info = {}
+        self.image_reader = None
+
+    def enable_read_ahead(self, image_file_names, depth):
+        self.image_reader = ReadAheadReader(get_input_source(self.input_image_path), image_file_names, depth)
+
+    def close(self):
+        if self.image_reader is not None:
+            self.image_reader.close()
+            self.image_reader = None
+
+        self.output_writer.close()
+
+    def read_image(self, image_file_name):
+        if self.image_reader is not None:
+            return self.image_reader.read(image_file_name)
+
+        return get_input_source(self.input_image_path).read(image_file_name)
+
+    def load_previous_outputs(self, page_layout, file_id, engines):
+        from anno_page.core.layout import load_alto_tree, load_annopage_regions_from_alto
+        from anno_page.core.embedding import ObjectEmbedding
+
+        previous_alto = self.output_writer.read("alto", file_id + '.xml')
+        if previous_alto is None:
+            self.logger.warning(f"Previous ALTO output of '{file_id}' does not exist, processing the page from scratch.")
+            return False
+
+        regions = load_annopage_regions_from_alto(page_layout, load_alto_tree(io.BytesIO(previous_alto)).getroot())
+        self.logger.info(f"Loaded {len(regions)} region(s) from previous ALTO output of '{file_id}'.")
+
+        if self.output_embeddings_path is None or any(engine.outputs is None or LayoutData.EMBEDDINGS in engine.outputs for engine in engines):
+            return True
+
+        extension = 'jsonl' if self.embeddings_jsonlines else 'json'
+        previous_embeddings = self.output_writer.read("embeddings", f"{file_id}.{extension}")
+        if previous_embeddings is not None:
+            if self.embeddings_jsonlines:
+                embeddings = [ObjectEmbedding.model_validate_json(line) for line in previous_embeddings.splitlines() if line.strip()]
+            else:
+                embeddings = [ObjectEmbedding.model_validate(embedding) for embedding in json.loads(previous_embeddings)]
+
+            regions_by_id = {region.id: region for region in regions}
+            for embedding in embeddings:
+                if embedding.tag_id in regions_by_id:
+                    regions_by_id[embedding.tag_id].embeddings.append(embedding)
+
+        return True
+
+    def write_output(self, output_files, kind, name, data: bytes):
+        output_files[self.output_writer.write(kind, name, data)] = hashlib.sha256(data).hexdigest()
+
+    def write_output_stream(self, output_files, kind, name, write_data):
+        path, sha256 = self.output_writer.write_stream(kind, name, write_data)
+        output_files[path] = sha256
+
+    def __call__(self, image_file_name, file_id, index, ids_count, file_metadata=None, rerun_sections=None):
+        import cv2
+        import numpy as np
+        from pero_ocr.core.layout import PageLayout, ALTOVersion
+        from anno_page.core.layout import render_to_image, add_page_layout_to_alto, set_handlers, load_alto_tree, write_alto_tree
+        from anno_page.core.crops import get_crop_store
+        from anno_page.core.images import get_image_size, load_large_image
+        from anno_page.core.id_allocator import element_id_allocators
 
-    def __call__(self, image_file_name, file_id, index, ids_count, file_metadata=None):
         self.logger.info(f"Processing {file_id}")
         start_time = time.time()
+        page_processing_info = None
+        output_files = {}
+        succeeded = False
+        large_image_path = None
+        large_image = None
 
         try:
+            image = None
+            image_data = None
+            image_size = None
+
             if self.input_image_path is not None:
-                image = cv2.imread(os.path.join(self.input_image_path, image_file_name), 1)
-                if image is None:
-                    raise Exception(f'Unable to read image "{os.path.join(self.input_image_path, image_file_name)}"')
-            else:
-                image = None
+                local_image_path = get_input_source(self.input_image_path).local_path(image_file_name)
+                image_path = local_image_path if local_image_path is not None else os.path.join(self.input_image_path, image_file_name)
+
+                if self.large_image_threshold is not None:
+                    # Files on the disk are not read whole just to find out their size
+                    if local_image_path is None:
+                        image_data = self.read_image(image_file_name)
+                        image_size = get_image_size(io.BytesIO(image_data))
+                    else:
+                        image_size = get_image_size(local_image_path)
+
+                    if image_size[0] * image_size[1] >= self.large_image_threshold * 1e6:
+                        large_image_path = image_path
+
+                if large_image_path is None:
+                    if image_data is None:
+                        image_data = self.read_image(image_file_name)
+
+                    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), 1)
+                    image_data = None
+                    if image is None:
+                        raise Exception(f'Unable to read image "{image_path}"')
 
-            alto_file_path = None
-            page_layout = PageLayout(id=file_id, page_size=(image.shape[0], image.shape[1]))
+                    image_size = image.shape[:2]
+
+            input_alto_data = None
+            page_layout = PageLayout(id=file_id, page_size=(image_size[0], image_size[1]))
 
             self.logger.info(f"Created empty page layout for id: '{file_id}'.")
 
@@ -239,16 +419,19 @@ class Computator:
                 if not self.page_parser.requires_lines:
                     self.logger.info("Page parser does not require lines, skipping ALTO file loading.")
                 else:
+                    alto_source = get_input_source(self.input_alto_path)
                     alto_file_path = os.path.join(self.input_alto_path, file_id + '.xml')
-                    if os.path.isfile(alto_file_path):
-                        page_layout.from_altoxml(alto_file_path)
+                    if alto_source.exists(file_id + '.xml'):
+                        input_alto_data = alto_source.read(file_id + '.xml')
+                        page_layout.from_altoxml(io.BytesIO(input_alto_data))
                         self.logger.info(f"Loaded ALTO file: '{alto_file_path}'.")
                     else:
                         self.logger.warning(f"ALTO file does not exist: '{alto_file_path}'.")
             elif self.input_xml_path is not None:
+                xml_source = get_input_source(self.input_xml_path)
                 xml_file_path = os.path.join(self.input_xml_path, file_id + '.xml')
-                if os.path.isfile(xml_file_path):
-                    page_layout = PageLayout(file=xml_file_path)
+                if xml_source.exists(file_id + '.xml'):
+                    page_layout = PageLayout(file=io.BytesIO(xml_source.read(file_id + '.xml')))
                     self.logger.info(f"Loaded PAGE XML file: '{xml_file_path}'.")
                 else:
                     self.logger.warning(f"PAGE XML file does not exist: '{xml_file_path}'.")
@@ -264,62 +447,82 @@ class Computator:
                     image = cv2.resize(image, (page_width, page_height))
                     self.logger.info(f"Resized image to page size: ({page_width}, {page_height}).")
 
+            if large_image_path is not None:
+                large_image = load_large_image(large_image_path,
+                                               page_size=page_layout.page_size,
+                                               proxy_max_size=self.large_image_proxy_size,
+                                               cache_path=self.large_image_cache_path,
+                                               data=image_data)
+                image_data = None
+                image = large_image.image
+                get_crop_store(page_layout, image).set_proxy(large_image.proxy, large_image.proxy_scale)
+                self.logger.info(f"Loaded large image with proxy of size {large_image.proxy.shape[1]}x{large_image.proxy.shape[0]}.")
+
+            engines = None
+            if rerun_sections is not None and self.output_alto_path is not None:
+                rerun_engines = self.page_parser.get_rerun_engines(rerun_sections)
+                if rerun_engines is None:
+                    self.logger.info(f"Regions of '{file_id}' are detected again, processing the page from scratch.")
+                elif self.load_previous_outputs(page_layout, file_id, rerun_engines):
+                    engines = rerun_engines
+                    self.logger.info(f"Running {len(engines)} of {len(self.page_parser.engines)} engine(s) on previous outputs.")
+
             page_layout.metadata["anno_page_metadata"] = file_metadata
             page_layout.metadata["anno_page_processing"] = {}
-            page_layout = self.page_parser.process_page(image, page_layout)
+            page_layout = self.page_parser.process_page(image, page_layout, engines=engines)
 
-            self.processing_info[file_id] = page_layout.metadata["anno_page_processing"]
+            page_processing_info = page_layout.metadata["anno_page_processing"]
+            self.processing_info[file_id] = page_processing_info
 
             if self.output_xml_path is not None:
                 set_handlers(page_layout)
-                page_layout.to_pagexml(os.path.join(self.output_xml_path, file_id + '.xml'))
+                self.write_output(output_files, "page_xml", file_id + '.xml', page_layout.to_pagexml_string().encode('utf-8'))
 
             if self.output_alto_path is not None:
-                output_alto_path = os.path.join(self.output_alto_path, file_id + '.xml')
-
-                if alto_file_path is not None:
-                    parser = ET.XMLParser(remove_blank_text=True)
-                    alto = ET.parse(alto_file_path, parser)
-                    add_page_layout_to_alto(page_layout, alto.getroot())
-
-                    with open(output_alto_path, 'w', encoding="utf-8") as file:
-                        file.write(ET.tostring(alto, pretty_print=True, encoding="utf-8", xml_declaration=True).decode("utf-8"))
+                if input_alto_data is not None:
+                    # pero-ocr parses the input on its own (only from a path or a stream), the tree to merge the
+                    # results into is parsed only here, it is not held during the processing
+                    alto_tree = load_alto_tree(io.BytesIO(input_alto_data))
+                    add_page_layout_to_alto(page_layout, alto_tree.getroot())
+                    self.write_output_stream(output_files, "alto", file_id + '.xml', lambda file: write_alto_tree(alto_tree, file))
 
                 else:
                     set_handlers(page_layout)
-                    page_layout.to_altoxml(output_alto_path, version=ALTOVersion.ALTO_v4_4)
+                    with element_id_allocators():
+                        alto_data = page_layout.to_altoxml_string(version=ALTOVersion.ALTO_v4_4).encode('utf-8')
+                    self.write_output(output_files, "alto", file_id + '.xml', alto_data)
 
             if self.output_embeddings_path is not None:
                 embeddings = page_layout.get_all_embeddings()
 
                 extension = 'jsonl' if self.embeddings_jsonlines else 'json'
-                embeddings_file = os.path.join(self.output_embeddings_path, f"{file_id}.{extension}")
-                with open(embeddings_file, 'w') as file:
-                    if self.embeddings_jsonlines:
-                        for embedding in embeddings:
-                            file.write(embedding.model_dump_json() + "\n")
-                    else:
-                        json.dump([embedding.model_dump() for embedding in embeddings], file, ensure_ascii=False, indent=4)
+                if self.embeddings_jsonlines:
+                    embeddings_data = "".join(embedding.model_dump_json() + "\n" for embedding in embeddings)
+                else:
+                    embeddings_data = json.dumps([embedding.model_dump() for embedding in embeddings], ensure_ascii=False, indent=4)
+
+                self.write_output(output_files, "embeddings", f"{file_id}.{extension}", embeddings_data.encode('utf-8'))
 
             if self.output_render_path is not None:
-                render = render_to_image(image, page_layout)
-                render_file = str(os.path.join(self.output_render_path, file_id + '.jpg'))
-                cv2.imwrite(render_file, render, [int(cv2.IMWRITE_JPEG_QUALITY), 70])
+                if large_image is not None:
+                    render = render_to_image(large_image.proxy, page_layout, scale=large_image.proxy_scale)
+                else:
+                    render = render_to_image(image, page_layout)
+                render_data = cv2.imencode('.jpg', render, [int(cv2.IMWRITE_JPEG_QUALITY), 70])[1].tobytes()
+                self.write_output(output_files, "renders", file_id + '.jpg', render_data)
 
             if self.output_crops_path is not None:
+                crop_store = get_crop_store(page_layout, image)
+
                 for region in page_layout.regions:
                     if region.category in (None, "text"):
                         continue
 
-                    x1, y1, x2, y2 = region.get_polygon_bounding_box()
-                    crop = image[y1:y2, x1:x2]
-
                     suffix = f"{region.id}"
                     if region.graphical_metadata is not None:
                         suffix = f"{region.graphical_metadata.tag_id}"
 
-                    crop_path = os.path.join(self.output_crops_path, f"{file_id}_{suffix}.jpg")
-                    cv2.imwrite(crop_path, crop, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+                    self.write_output(output_files, "crops", f"{file_id}_{suffix}.jpg", crop_store.jpeg(region, quality=95))
 
             if self.output_image_captioning_prompts_path is not None:
                 for region in page_layout.regions:
@@ -330,10 +533,11 @@ class Computator:
                         region_prompts = region.graphical_metadata.prompts
                         if region_prompts is not None:
                             suffix = f"{region.graphical_metadata.tag_id}"
-                            prompts_path = os.path.join(self.output_image_captioning_prompts_path, f"{file_id}_{suffix}.txt")
-                            with open(prompts_path, 'w', encoding='utf-8') as file:
-                                json.dump(region_prompts, file, ensure_ascii=False, indent=4)
+                            prompts_data = json.dumps(region_prompts, ensure_ascii=False, indent=4).encode('utf-8')
+                            self.write_output(output_files, "image_captioning_prompts", f"{file_id}_{suffix}.txt", prompts_data)
 
+            self.output_writer.commit_page(file_id)
+            succeeded = True
 
         except KeyboardInterrupt:
             traceback.print_exc()
@@ -344,9 +548,103 @@ class Computator:
             self.logger.error(e)
             traceback.print_exc()
 
+        if not succeeded:
+            self.output_writer.discard_page()
+
+        if large_image is not None:
+            large_image.close()
+
         end_time = time.time()
         self.logger.info(f"DONE {index + 1}/{ids_count} ({100 * (index + 1) / ids_count:.2f} %) [id: {file_id}] Time:{end_time - start_time:.2f}")
 
+        return {
+            "file_id": file_id,
+            "succeeded": succeeded,
+            "processing_info": page_processing_info,
+            "output_files": output_files,
+            "time": end_time - start_time
+        }
+
+
+_worker_computator: Computator | None = None
+
+
+def init_worker(device_queue, config_string, config_path, device, threads_per_process, llm_api_aliases_path,
+                logging_level, computator_kwargs, input_source_indices):
+    global _worker_computator
+
+    setup_logging(logging_level)
+    logger = logging.getLogger(__name__)
+
+    set_input_source_indices(input_source_indices)
+
+    config = configparser.ConfigParser()
+    config.read_string(config_string)
+
+    worker_index, gpu_id = device_queue.get()
+    torch_device = get_device(device, gpu_id, logger)
+
+    if threads_per_process is not None:
+        set_num_threads(threads_per_process)
+
+    if llm_api_aliases_path is not None:
+        load_llm_api_aliases(llm_api_aliases_path, reload=True)
+
+    page_parser = PageParser(config, config_path=config_path, device=torch_device)
+    # Every worker appends to output shards of its own
+    _worker_computator = Computator(page_parser=page_parser, output_shards_prefix=get_worker_shards_prefix("shard", worker_index), **computator_kwargs)
+
+    # Engines may own processes of their own, they have to be stopped before the worker process waits for its children
+    Finalize(page_parser, page_parser.close, exitpriority=10)
+    Finalize(_worker_computator, _worker_computator.close, exitpriority=10)
+
+    logger.info(f"Worker {os.getpid()} initialized on device {torch_device}.")
+
+
+def process_in_worker(task):
+    return _worker_computator(*task)
+
+
+def run_sharded(tasks, process_count, gpu_ids, config, config_path, device, threads_per_process, llm_api_aliases_path,
+                logging_level, computator_kwargs, tasks_per_process=2):
+    # Spawned processes do not inherit CUDA state, every worker loads its own page parser once in the initializer
+    # and pages are then handed out one by one, so the faster workers take more of them. At most tasks_per_process
+    # pages per worker are submitted at a time, the pending tasks and results of large batches are not all held.
+    mp_context = get_context("spawn")
+
+    device_queue = mp_context.Queue()
+    for worker_device in get_worker_devices(process_count, gpu_ids):
+        device_queue.put(worker_device)
+
+    config_string = io.StringIO()
+    config.write(config_string)
+
+    # Archives are listed once here instead of in every worker
+    for path in (computator_kwargs["input_image_path"], computator_kwargs["input_xml_path"], computator_kwargs["input_alto_path"]):
+        if path is not None:
+            get_input_source(path)
+
+    with ProcessPoolExecutor(max_workers=process_count,
+                             mp_context=mp_context,
+                             initializer=init_worker,
+                             initargs=(device_queue, config_string.getvalue(), config_path, device, threads_per_process,
+                                       llm_api_aliases_path, logging_level, computator_kwargs,
+                                       get_input_source_indices())) as executor:
+        tasks = iter(tasks)
+        futures = set()
+        while True:
+            for task in tasks:
+                futures.add(executor.submit(process_in_worker, task))
+                if len(futures) >= process_count * tasks_per_process:
+                    break
+
+            if not futures:
+                break
+
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
 
 def main():
     args = parse_arguments()
@@ -399,13 +697,6 @@ def main():
     if args.output_processing_info_path is not None:
         config['PARSE_FOLDER']['OUTPUT_PROCESSING_INFO_PATH'] = args.output_processing_info_path
 
-    device = get_device(args.device, args.gpu_id, logger)
-
-    if args.llm_api_aliases_path is not None:
-        load_llm_api_aliases(args.llm_api_aliases_path, reload=True)
-
-    page_parser = PageParser(config, config_path=os.path.dirname(config_path), device=device)
-
     input_image_path = get_value_or_none(config, 'PARSE_FOLDER', 'INPUT_IMAGE_PATH')
     input_xml_path = get_value_or_none(config, 'PARSE_FOLDER', 'INPUT_XML_PATH')
     input_alto_path = get_value_or_none(config, 'PARSE_FOLDER', 'INPUT_ALTO_PATH')
@@ -420,23 +711,29 @@ def main():
 
     embeddings_jsonlines = args.embeddings_jsonlines
 
-    if output_xml_path is not None:
-        create_dir_if_not_exists(output_xml_path)
+    if args.output_shards_path is not None:
+        create_dir_if_not_exists(args.output_shards_path)
+    else:
+        if output_xml_path is not None:
+            create_dir_if_not_exists(output_xml_path)
+
+        if output_alto_path is not None:
+            create_dir_if_not_exists(output_alto_path)
 
-    if output_alto_path is not None:
-        create_dir_if_not_exists(output_alto_path)
+        if output_embeddings_path is not None:
+            create_dir_if_not_exists(output_embeddings_path)
 
-    if output_embeddings_path is not None:
-        create_dir_if_not_exists(output_embeddings_path)
+        if output_render_path is not None:
+            create_dir_if_not_exists(output_render_path)
 
-    if output_render_path is not None:
-        create_dir_if_not_exists(output_render_path)
+        if output_crops_path is not None:
+            create_dir_if_not_exists(output_crops_path)
 
-    if output_crops_path is not None:
-        create_dir_if_not_exists(output_crops_path)
+        if output_image_captioning_prompts_path is not None:
+            create_dir_if_not_exists(output_image_captioning_prompts_path)
 
-    if output_image_captioning_prompts_path is not None:
-        create_dir_if_not_exists(output_image_captioning_prompts_path)
+    if args.large_image_cache_path is not None:
+        create_dir_if_not_exists(args.large_image_cache_path)
 
     files_metadata = {}
     if input_metadata_path is not None:
@@ -449,12 +746,26 @@ def main():
     if input_image_path is not None:
         logger.info(f'Reading images from {input_image_path}.')
         ignored_extensions = ['', '.xml', '.logits']
-        images_to_process = [f for f in os.listdir(input_image_path) if os.path.splitext(f)[1].lower() not in ignored_extensions]
-        images_to_process = sorted(images_to_process)
+        # Directories are listed sorted, archives and manifests in their own order (sequential reads)
+        images_to_process = [f for f in get_input_source(input_image_path).names() if os.path.splitext(f)[1].lower() not in ignored_extensions]
         ids_to_process = [os.path.splitext(os.path.basename(file))[0] for file in images_to_process]
 
+    manifest = None
+    config_hash, engine_hashes = config_fingerprints(config, os.path.dirname(config_path))
+    if args.manifest_path is not None:
+        manifest = ProcessingManifest(args.manifest_path)
+
+    if args.incremental and (manifest is None or output_alto_path is None):
+        logger.error("Incremental processing requires --manifest-path and the output ALTO path.")
+        exit(-1)
+
     if skip_already_processed_files:
-        already_processed_files = load_already_processed_files([output_xml_path, output_alto_path, output_render_path])
+        if manifest is not None:
+            already_processed_files = manifest.get_done_file_ids(config_hash)
+        elif args.output_shards_path is not None:
+            already_processed_files = ShardedOutputReader(args.output_shards_path).file_ids()
+        else:
+            already_processed_files = load_already_processed_files([output_xml_path, output_alto_path, output_render_path])
 
         if len(already_processed_files) > 0:
             logger.info(f"Already processed {len(already_processed_files)} file(s).")
@@ -462,33 +773,116 @@ def main():
             images_to_process = [image for id, image in zip(ids_to_process, images_to_process) if id not in already_processed_files]
             ids_to_process = [id for id in ids_to_process if id not in already_processed_files]
 
-    computator = Computator(page_parser=page_parser,
-                            input_image_path=input_image_path,
-                            input_xml_path=input_xml_path,
-                            input_alto_path=input_alto_path,
-                            output_xml_path=output_xml_path,
-                            output_alto_path=output_alto_path,
-                            output_embeddings_path=output_embeddings_path,
-                            output_render_path=output_render_path,
-                            output_crops_path=output_crops_path,
-                            output_image_captioning_prompts_path=output_image_captioning_prompts_path,
-                            embeddings_jsonlines=embeddings_jsonlines)
-
-    results = []
-    if args.process_count > 1:
-        with Pool(processes=args.process_count) as pool:
-            tasks = []
-            for index, (file_id, image_file_name) in enumerate(zip(ids_to_process, images_to_process)):
-                file_metadata = files_metadata.get(image_file_name, None)
-                tasks.append((image_file_name, file_id, index, len(ids_to_process), file_metadata))
-            results = pool.starmap(computator, tasks)
+    computator_kwargs = {
+        "input_image_path": input_image_path,
+        "input_xml_path": input_xml_path,
+        "input_alto_path": input_alto_path,
+        "output_xml_path": output_xml_path,
+        "output_alto_path": output_alto_path,
+        "output_embeddings_path": output_embeddings_path,
+        "output_render_path": output_render_path,
+        "output_crops_path": output_crops_path,
+        "output_image_captioning_prompts_path": output_image_captioning_prompts_path,
+        "embeddings_jsonlines": embeddings_jsonlines,
+        "large_image_threshold": args.large_image_threshold,
+        "large_image_proxy_size": args.large_image_proxy_size,
+        "large_image_cache_path": args.large_image_cache_path,
+        "output_shards_path": args.output_shards_path,
+        "shard_max_size": args.shard_max_size,
+        "shard_max_pages": args.shard_max_pages
+    }
+
+    rerun_sections = {}
+    if args.incremental:
+        for file_id in ids_to_process:
+            rerun_sections[file_id] = get_rerun_sections(manifest.get(file_id), config_hash, engine_hashes)
+
+        images_to_process = [image for id, image in zip(ids_to_process, images_to_process) if rerun_sections[id] != set()]
+        ids_to_process = [id for id in ids_to_process if rerun_sections[id] != set()]
+
+        incremental_count = len([id for id in ids_to_process if rerun_sections[id] is not None])
+        logger.info(f"Incremental processing: {incremental_count} page(s) reuse previous outputs, {len(ids_to_process) - incremental_count} page(s) are processed from scratch.")
+
+    tasks = []
+    for index, (file_id, image_file_name) in enumerate(zip(ids_to_process, images_to_process)):
+        file_metadata = files_metadata.get(image_file_name, None)
+        tasks.append((image_file_name, file_id, index, len(ids_to_process), file_metadata, rerun_sections.get(file_id, None)))
+
+    gpu_ids = parse_gpu_ids(args.gpu_ids, args.gpu_id)
+    process_count = args.process_count
+    if gpu_ids and process_count == 1:
+        process_count = len(gpu_ids)
+
+    page_parser = None
+    computator = None
+    if process_count > 1:
+        results = run_sharded(tasks,
+                              process_count=process_count,
+                              gpu_ids=gpu_ids,
+                              config=config,
+                              config_path=os.path.dirname(config_path),
+                              device=args.device,
+                              threads_per_process=args.threads_per_process,
+                              llm_api_aliases_path=args.llm_api_aliases_path,
+                              logging_level=args.logging_level,
+                              computator_kwargs=computator_kwargs)
     else:
-        for index, (file_id, image_file_name) in enumerate(zip(ids_to_process, images_to_process)):
-            file_metadata = files_metadata.get(image_file_name, None)
-            results.append(computator(image_file_name, file_id, index, len(ids_to_process), file_metadata))
+        device = get_device(args.device, gpu_ids[0] if gpu_ids else None, logger)
+
+        if args.threads_per_process is not None:
+            set_num_threads(args.threads_per_process)
+
+        if args.llm_api_aliases_path is not None:
+            load_llm_api_aliases(args.llm_api_aliases_path, reload=True)
+
+        page_parser = PageParser(config, config_path=os.path.dirname(config_path), device=device)
+        computator = Computator(page_parser=page_parser, **computator_kwargs)
+        if args.read_ahead > 0 and input_image_path is not None:
+            computator.enable_read_ahead([task[0] for task in tasks], args.read_ahead)
+
+        results = (computator(*task) for task in tasks)
+
+    processing_info = {}
+    processing_times = {}
+    for done_count, result in enumerate(results, start=1):
+        if result["processing_info"] is not None:
+            processing_info[result["file_id"]] = result["processing_info"]
+        processing_times[result["file_id"]] = result["time"]
+
+        if manifest is not None:
+            manifest.record(result["file_id"],
+                            state=ProcessingManifest.STATE_DONE if result["succeeded"] else ProcessingManifest.STATE_FAILED,
+                            config_hash=config_hash,
+                            engine_hashes=engine_hashes,
+                            output_files=result["output_files"],
+                            processing_time=result["time"])
+
+        # Recorded in the manifest first, a page reported as done is also done after a restart
+        if args.progress_jsonl:
+            print(json.dumps({
+                "file_id": result["file_id"],
+                "succeeded": result["succeeded"],
+                "done": done_count,
+                "total": len(tasks),
+                "output_files": list(result["output_files"])
+            }, ensure_ascii=False), flush=True)
+
+    if manifest is not None:
+        manifest.close()
+
+    if computator is not None:
+        computator.close()
+
+    if page_parser is not None:
+        page_parser.close()
+
+    close_input_sources()
+
+    logger.info(f"Processed {len(processing_times)} file(s) in {sum(processing_times.values()):.2f} s of page processing time.")
 
     if output_processing_info_path is not None:
-        processing_info = summarize_processing_info(computator.processing_info)
+        processing_info = summarize_processing_info(processing_info)
+        processing_info["timings"] = summarize_processing_times(processing_times)
         save_processing_info(processing_info, output_processing_info_path)
 
     return 0